@@ -117,6 +117,12 @@ run_migrations() {
     # Apply all migrations
     echo "Applying database migrations..."
     sudo docker compose exec web python manage.py migrate
+    
+    # Create the search extensions/indexes and backfill search vectors
+    sudo docker compose exec web python manage.py setup_search_index
+    
+    # Backfill/repair the stored shopping list counters
+    sudo docker compose exec web python manage.py reconcile_list_counters
     echo "✓ Migrations completed"
 }
 
@@ -5,5 +5,5 @@ set -e
 mkdir -p /app/media/store_logos
 chmod -R 777 /app/media
 
-# Start Gunicorn
-exec gunicorn --bind 0.0.0.0:8000 --workers 3 shop_smart.wsgi:application
\ No newline at end of file
+# Start Gunicorn with Uvicorn workers so live list event streams don't tie up a worker each
+exec gunicorn --bind 0.0.0.0:8000 --workers 3 --worker-class uvicorn.workers.UvicornWorker shop_smart.asgi:application
\ No newline at end of file
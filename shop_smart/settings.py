@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'crispy_forms',
@@ -86,7 +87,10 @@ DATABASES = {
         'PASSWORD': get_env_variable('DB_PASSWORD', 'postgres', required=not DEBUG),
         'HOST': get_env_variable('DB_HOST', 'db'),  # Use 'db' for Docker, 'localhost' for local dev
         'PORT': get_env_variable('DB_PORT', '5432'),
-        'CONN_MAX_AGE': int(get_env_variable('DB_CONN_MAX_AGE', '600')),
+        # The app is served over ASGI (see docker-entrypoint.sh), where sync views
+        # run in a thread pool and persistent connections are kept per thread, so
+        # they would pile up until Postgres runs out of slots
+        'CONN_MAX_AGE': int(get_env_variable('DB_CONN_MAX_AGE', '0')),
     }
 }
 
@@ -206,8 +210,10 @@ CACHES = {
     }
 }
 
-# Use Redis cache if available
-REDIS_URL = os.environ.get('REDIS_URL')
+# Redis is required in production: every worker shares the cache (and the
+# cache generations that invalidate it) and live list updates go through its
+# pub/sub. Without it each worker only sees its own changes.
+REDIS_URL = get_env_variable('REDIS_URL', required=not DEBUG)
 if REDIS_URL:
     CACHES['default'] = {
         'BACKEND': 'django_redis.cache.RedisCache',
@@ -217,6 +223,10 @@ if REDIS_URL:
         }
     }
 
+# Popularity counters are buffered and written in batches (see shopping/counters.py)
+POPULARITY_FLUSH_INTERVAL = int(get_env_variable('POPULARITY_FLUSH_INTERVAL', '60'))
+POPULARITY_FLUSH_THRESHOLD = int(get_env_variable('POPULARITY_FLUSH_THRESHOLD', '500'))
+
 # Session settings
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 60 * 60 * 24 * 30  # 30 days
@@ -242,6 +252,13 @@ PWA_APP_START_URL = get_env_variable('PWA_APP_START_URL', '/')
 
 # API Settings
 OPENFOODFACTS_USER_AGENT = get_env_variable('OPENFOODFACTS_USER_AGENT', 'ShopSmart - Django Shopping App')
+# Open Food Facts client limits (see shopping/off_client.py)
+OPENFOODFACTS_MAX_CONNECTIONS = int(get_env_variable('OPENFOODFACTS_MAX_CONNECTIONS', '10'))
+OPENFOODFACTS_CIRCUIT_FAILURES = int(get_env_variable('OPENFOODFACTS_CIRCUIT_FAILURES', '5'))
+OPENFOODFACTS_CIRCUIT_RESET = int(get_env_variable('OPENFOODFACTS_CIRCUIT_RESET', '30'))
+# Open Food Facts lookup caching in seconds (see shopping/off_cache.py)
+OFF_NEGATIVE_CACHE_TIMEOUT = int(get_env_variable('OFF_NEGATIVE_CACHE_TIMEOUT', str(60 * 60)))
+OFF_STALE_TIMEOUT = int(get_env_variable('OFF_STALE_TIMEOUT', str(60 * 60 * 24 * 7)))
 
 # Cloudflare settings
 CLOUDFLARE_TUNNEL_TOKEN = get_env_variable('CLOUDFLARE_TUNNEL_TOKEN', '', required=not DEBUG)
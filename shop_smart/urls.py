@@ -25,6 +25,8 @@ urlpatterns = [
     path('api/items/create/', views.GroceryItemCreateAPIView.as_view(), name='item_create_api'),
     path('api/items/barcode/<str:barcode>/', views.BarcodeSearchView.as_view(), name='barcode_search'),
     path('api/stores/search/', views.StoreSearchView.as_view(), name='store_search'),
+    path('api/sync/', views.SyncIngestView.as_view(), name='sync_ingest'),
+    path('api/sync/changes/', views.SyncChangesView.as_view(), name='sync_changes'),
     
     # Authentication URLs
     path('login/', auth_views.LoginView.as_view(template_name='groceries/auth/login.html'), name='login'),
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from django.db.models import Count, Sum, Avg, Q
+from django.db.models import Count, DecimalField, ExpressionWrapper, Sum, Avg, Q
+from django.db.models.functions import NullIf
 from django.urls import path, reverse
 from django.shortcuts import render, redirect
 from django.contrib import messages
@@ -15,7 +16,8 @@ from datetime import datetime, timedelta
 from .models import (
     Family, FamilyMember, UserProfile, GroceryStore, StoreLocation,
     ProductCategory, GroceryItem, FamilyItemUsage, ItemStoreInfo,
-    ShoppingList, ShoppingListItem, SyncLog
+    ShoppingList, ShoppingListItem, SyncLog, FamilyRecommendation,
+    OpenFoodFactsProduct, PriceObservation
 )
 
 # Custom admin site
@@ -176,6 +178,9 @@ class UserProfileAdmin(admin.ModelAdmin):
         ('Preferences', {
             'fields': ('dark_mode', 'show_categories')
         }),
+        ('Allergens & Diet', {
+            'fields': ('allergens', 'dietary_preferences')
+        }),
     )
     
     def get_queryset(self, request):
@@ -313,7 +318,7 @@ class GroceryItemAdmin(admin.ModelAdmin):
     list_display = ('name', 'category', 'brand', 'barcode', 'display_image', 'times_used', 'avg_price', 'popularity_score')
     list_filter = ('category', 'is_verified', 'is_user_added', 'created_at')
     search_fields = ('name', 'barcode', 'brand', 'description')
-    readonly_fields = ('global_popularity', 'created_at', 'updated_at', 'display_image_large')
+    readonly_fields = ('global_popularity', 'safety_flags', 'created_at', 'updated_at', 'display_image_large')
     
     fieldsets = (
         ('Basic Information', {
@@ -327,7 +332,7 @@ class GroceryItemAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Metadata', {
-            'fields': ('is_verified', 'is_user_added', 'global_popularity'),
+            'fields': ('is_verified', 'is_user_added', 'global_popularity', 'safety_flags'),
             'classes': ('collapse',)
         }),
         ('Timestamps', {
@@ -339,7 +344,11 @@ class GroceryItemAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).annotate(
             times_used=Count('shoppinglistitem'),
-            avg_price=Avg('store_info__last_price')
+            # Mean of every observed price, from the running totals
+            avg_price=ExpressionWrapper(
+                Sum('store_info__price_total') / NullIf(Sum('store_info__price_count'), 0),
+                output_field=DecimalField()
+            )
         ).select_related('category', 'created_by')
     
     def times_used(self, obj):
@@ -384,14 +393,45 @@ class GroceryItemAdmin(admin.ModelAdmin):
     unverify_items.short_description = 'Unverify selected items'
 
 
+@admin.register(OpenFoodFactsProduct, site=admin_site)
+class OpenFoodFactsProductAdmin(admin.ModelAdmin):
+    list_display = ('code', 'product_name', 'brand', 'last_modified', 'imported_at')
+    search_fields = ('code',)
+    readonly_fields = ('code', 'last_modified', 'data', 'imported_at')
+    
+    def product_name(self, obj):
+        return obj.data.get('name')
+    product_name.short_description = 'Name'
+    
+    def brand(self, obj):
+        return obj.data.get('brand')
+    brand.short_description = 'Brand'
+    
+    def has_add_permission(self, request):
+        # Rows come from the data dump import
+        return False
+
+
 @admin.register(ItemStoreInfo, site=admin_site)
 class ItemStoreInfoAdmin(admin.ModelAdmin):
-    list_display = ('item', 'store', 'location', 'typical_price', 'last_price', 'price_difference', 'last_purchased')
+    list_display = (
+        'item', 'store', 'location', 'typical_price', 'last_price', 'price_difference',
+        'average_price', 'price_range', 'price_count', 'last_purchased'
+    )
     list_filter = ('store', 'location', 'last_purchased')
     search_fields = ('item__name', 'store__name')
-    readonly_fields = ('last_purchased',)
+    readonly_fields = (
+        'last_purchased', 'average_price', 'price_count', 'price_total', 'min_price', 'max_price',
+        'ewma_price', 'recent_prices', 'median_price'
+    )
     list_editable = ('typical_price', 'last_price')
     
+    def price_range(self, obj):
+        if obj.min_price is not None:
+            return f'${obj.min_price:.2f} - ${obj.max_price:.2f}'
+        return '-'
+    price_range.short_description = 'Price Range'
+    
     def price_difference(self, obj):
         if obj.typical_price and obj.last_price:
             diff = obj.last_price - obj.typical_price
@@ -405,6 +445,21 @@ class ItemStoreInfoAdmin(admin.ModelAdmin):
     price_difference.short_description = 'Price Diff'
 
 
+@admin.register(PriceObservation, site=admin_site)
+class PriceObservationAdmin(admin.ModelAdmin):
+    list_display = ('item', 'store', 'price', 'observed_at')
+    list_filter = ('store', 'observed_at')
+    search_fields = ('item__name', 'store__name')
+    readonly_fields = ('item', 'store', 'price', 'observed_at', 'list_item')
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('item', 'store')
+    
+    def has_add_permission(self, request):
+        # Observations are recorded as prices are entered on lists
+        return False
+
+
 @admin.register(FamilyItemUsage, site=admin_site)
 class FamilyItemUsageAdmin(admin.ModelAdmin):
     list_display = ('item', 'family', 'usage_count', 'last_used', 'avg_quantity', 'frequency')
@@ -437,6 +492,21 @@ class FamilyItemUsageAdmin(admin.ModelAdmin):
     frequency.short_description = 'Frequency'
 
 
+@admin.register(FamilyRecommendation, site=admin_site)
+class FamilyRecommendationAdmin(admin.ModelAdmin):
+    list_display = ('family', 'store', 'item_count', 'is_stale', 'computed_at')
+    list_filter = ('is_stale', 'store')
+    search_fields = ('family__name',)
+    readonly_fields = ('computed_at',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('family', 'store')
+    
+    def item_count(self, obj):
+        return len(obj.item_ids)
+    item_count.short_description = '# Items'
+
+
 class ShoppingListItemInline(admin.TabularInline):
     model = ShoppingListItem
     extra = 0
@@ -466,11 +536,7 @@ class ShoppingListAdmin(admin.ModelAdmin):
     )
     
     def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            item_count=Count('items'),
-            checked_count=Count('items', filter=Q(items__checked=True)),
-            total_cost=Sum('items__actual_price')
-        ).select_related('store', 'family', 'created_by')
+        return super().get_queryset(request).select_related('store', 'family', 'created_by')
     
     def status_badge(self, obj):
         if obj.completed:
@@ -497,40 +563,35 @@ class ShoppingListAdmin(admin.ModelAdmin):
     progress.short_description = 'Progress'
     
     def total_cost(self, obj):
-        if obj.total_cost:
-            return f'${obj.total_cost:.2f}'
+        if obj.estimated_total:
+            return f'${obj.estimated_total:.2f}'
         return '-'
-    total_cost.admin_order_field = 'total_cost'
-    total_cost.short_description = 'Total Cost'
+    total_cost.admin_order_field = 'estimated_total'
+    total_cost.short_description = 'Est. Total'
     
     actions = ['mark_completed', 'mark_active', 'duplicate_list']
     
     def mark_completed(self, request, queryset):
-        updated = queryset.update(completed=True, completed_at=datetime.now())
+        updated = self._set_completed(queryset, True)
         messages.success(request, f'{updated} lists marked as completed.')
     mark_completed.short_description = 'Mark selected lists as completed'
     
     def mark_active(self, request, queryset):
-        updated = queryset.update(completed=False, completed_at=None)
+        updated = self._set_completed(queryset, False)
         messages.success(request, f'{updated} lists marked as active.')
     mark_active.short_description = 'Mark selected lists as active'
     
+    def _set_completed(self, queryset, completed):
+        # One list at a time, so the sync feed, co-purchase counts, cadences
+        # and recommendations are kept up as when a family completes a list
+        shopping_lists = list(queryset)
+        for shopping_list in shopping_lists:
+            shopping_list.set_completed(completed)
+        return len(shopping_lists)
+    
     def duplicate_list(self, request, queryset):
         for list_obj in queryset:
-            new_list = ShoppingList.objects.create(
-                name=f'{list_obj.name} (Copy)',
-                store=list_obj.store,
-                family=list_obj.family,
-                created_by=request.user
-            )
-            for item in list_obj.items.all():
-                ShoppingListItem.objects.create(
-                    shopping_list=new_list,
-                    item=item.item,
-                    quantity=item.quantity,
-                    unit=item.unit,
-                    note=item.note
-                )
+            list_obj.duplicate(f'{list_obj.name} (Copy)', created_by=request.user)
         messages.success(request, f'{queryset.count()} lists duplicated.')
     duplicate_list.short_description = 'Duplicate selected lists'
 
@@ -566,13 +627,13 @@ class ShoppingListItemAdmin(admin.ModelAdmin):
 class SyncLogAdmin(admin.ModelAdmin):
     list_display = ('operation', 'model_name', 'record_id', 'user', 'timestamp', 'sync_status')
     list_filter = ('operation', 'model_name', 'synced', 'timestamp')
-    search_fields = ('user__username', 'model_name', 'record_id')
+    search_fields = ('user__username', 'model_name', 'record_id', 'op_id')
     readonly_fields = ('timestamp', 'synced_at', 'data_preview')
     date_hierarchy = 'timestamp'
     
     fieldsets = (
         ('Operation Details', {
-            'fields': ('operation', 'model_name', 'record_id', 'user')
+            'fields': ('operation', 'model_name', 'record_id', 'user', 'op_id')
         }),
         ('Sync Status', {
             'fields': ('synced', 'synced_at')
@@ -3,8 +3,25 @@ Allergen and Dietary Preferences Management for ShopSmart
 
 This module provides functionality to handle food allergens and dietary preferences,
 including allergen detection, preference filtering, and product recommendations.
+
+The keyword lists are compiled once into a single Aho-Corasick automaton over
+ingredient characters, so a product's ingredients are scanned in one pass
+however many keywords there are. Keywords match inside compound words
+("buttermilk", "soymilk", "oatmeal"), except for the few in BOUNDED_KEYWORDS
+that are also parts of unrelated words ("eggplant" is not an egg).
+
+Detected allergen categories and diet conflicts are also stored on each
+GroceryItem as a bitmask (safety_flags), so a user's allergens and dietary
+preferences can be applied as a filter in SQL.
 """
 
+import functools
+import re
+from collections import deque
+
+from django.db.models import F, Q
+from django.db.models.lookups import Exact
+
 # Common allergens based on international food labeling standards
 COMMON_ALLERGENS = {
     'gluten': ['wheat', 'barley', 'rye', 'oats', 'spelt', 'kamut', 'triticum', 'gluten'],
@@ -64,6 +81,165 @@ DIETARY_PREFERENCES = {
 }
 
 
+NON_WORD_RE = re.compile(r'[\W_]+')
+
+# Keywords that only match at a word boundary, because they are also part of
+# unrelated words: 'start' keywords must begin a word ("peppercorn" is not
+# corn, "goat" is not an oat), 'word' keywords must be a whole word, or its
+# plural ("eggplant" is not an egg, "peanut" is not a tree nut).
+BOUNDED_KEYWORDS = {
+    'egg': 'word',
+    'eggs': 'word',
+    'nuts': 'word',
+    'oats': 'start',
+    'corn': 'start',
+    'rice': 'start',
+}
+
+# Distinct ingredient texts whose scan results are kept in memory
+MATCH_CACHE_SIZE = 20000
+
+ALLERGEN = 'allergen'
+DIET = 'diet'
+
+
+def _stem(word):
+    """Fold a simple plural so 'peanuts' and 'peanut' become the same word"""
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def _normalize(text):
+    """Lowercase text with each run of punctuation and spaces made one space"""
+    return NON_WORD_RE.sub(' ', text.lower()).strip()
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over characters.
+
+    Keywords are phrases of one or more words, folded to their singular so
+    a keyword also matches inside longer words ("milk" in "buttermilk", "oats"
+    in "oatmeal"). Every keyword occurring in the text is found in a single
+    pass over it, overlapping ones included.
+    """
+
+    def __init__(self, keywords, bounded=None):
+        """
+        Args:
+            keywords: Iterable of (phrase, label) pairs; scan returns the
+                labels of the phrases found
+            bounded: Optional mapping of phrase to 'start' or 'word' for
+                phrases that only match at the start of a word or as a
+                whole word (see BOUNDED_KEYWORDS)
+        """
+        bounded = bounded or {}
+        self._goto = [{}]
+        self._fail = [0]
+        # Per state: (label, keyword length, boundary) of the keywords ending there
+        self._output = [[]]
+
+        for phrase, label in keywords:
+            keyword = ' '.join(_stem(word) for word in _normalize(phrase).split())
+            state = 0
+            for char in keyword:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state].append((label, len(keyword), bounded.get(phrase)))
+
+        # Failure links, breadth first so shorter suffixes are linked first
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, target in self._goto[state].items():
+                queue.append(target)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[target] = self._goto[fail].get(char, 0)
+                self._output[target] = self._output[target] + self._output[self._fail[target]]
+
+    @staticmethod
+    def _at_boundary(text, start, end, boundary):
+        if start > 0 and text[start - 1] != ' ':
+            return False
+        if boundary == 'word' and end < len(text) and text[end] != ' ':
+            # A plural of the word still counts
+            return text[end] == 's' and (end + 1 == len(text) or text[end + 1] == ' ')
+        return True
+
+    def scan(self, text):
+        """Return the labels of all keywords found in text, in text order"""
+        goto, fail, output = self._goto, self._fail, self._output
+        text = _normalize(text)
+        matches = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for label, length, boundary in output[state]:
+                if boundary is None or self._at_boundary(text, index + 1 - length, index + 1, boundary):
+                    matches.append(label)
+        return matches
+
+
+def _keywords():
+    for category, keywords in COMMON_ALLERGENS.items():
+        for keyword in keywords:
+            yield keyword, (ALLERGEN, category, keyword)
+    for preference, data in DIETARY_PREFERENCES.items():
+        for ingredient in data['avoid']:
+            yield ingredient, (DIET, preference, ingredient)
+
+
+MATCHER = KeywordMatcher(_keywords(), BOUNDED_KEYWORDS)
+
+
+@functools.lru_cache(maxsize=MATCH_CACHE_SIZE)
+def ingredient_matches(text):
+    """
+    Allergen and diet keywords found in an ingredients text (or allergen tag).
+
+    Returns a tuple of (kind, category, keyword) triples, where kind is
+    ALLERGEN or DIET. Results are cached by the text's hash, so products
+    seen again (the same item on another search page) aren't rescanned.
+    """
+    return tuple(dict.fromkeys(MATCHER.scan(text)))
+
+
+# Bits of GroceryItem.safety_flags: allergen categories from bit 0, diets
+# from DIET_BIT_OFFSET. Only ever append to COMMON_ALLERGENS and
+# DIETARY_PREFERENCES; reordering them changes the meaning of stored flags.
+DIET_BIT_OFFSET = 16
+
+ALLERGEN_BITS = {category: 1 << bit for bit, category in enumerate(COMMON_ALLERGENS)}
+DIET_BITS = {preference: 1 << (DIET_BIT_OFFSET + bit) for bit, preference in enumerate(DIETARY_PREFERENCES)}
+
+# Set on items whose ingredients haven't been analysed, or that have no text
+# to analyse. Such items are never taken as safe for anyone avoiding something.
+UNANALYSED = 1 << 30
+
+
+def safe_items_filter(mask, field='safety_flags'):
+    """
+    Q matching items with none of the flags in mask set. Unless mask is
+    empty, items whose flags are UNANALYSED don't match either.
+
+    Args:
+        mask: Flags to avoid, from AllergenDetector.safety_mask
+        field: Path to the safety_flags field, e.g. 'items__safety_flags'
+    """
+    if not mask:
+        return Q()
+    return Q(Exact(F(field).bitand(mask | UNANALYSED), 0))
+
+
 class AllergenDetector:
     """
     Detect allergens and dietary preference conflicts in product ingredients 
@@ -86,24 +262,19 @@ class AllergenDetector:
         # Check direct allergen tags if available
         if product_data.get('allergens') and isinstance(product_data['allergens'], list):
             for allergen in product_data['allergens']:
-                for category, keywords in COMMON_ALLERGENS.items():
-                    if any(keyword.lower() in allergen.lower() for keyword in keywords):
-                        if category not in detected:
-                            detected[category] = []
-                        detected[category].append(allergen)
+                categories = [category for kind, category, _ in ingredient_matches(allergen) if kind == ALLERGEN]
+                for category in dict.fromkeys(categories):
+                    detected.setdefault(category, []).append(allergen)
         
         # Check ingredients text
         ingredients_text = product_data.get('ingredients', '') or ''
         if isinstance(ingredients_text, str) and ingredients_text:
-            ingredients_lower = ingredients_text.lower()
-            
-            for category, keywords in COMMON_ALLERGENS.items():
-                for keyword in keywords:
-                    if keyword.lower() in ingredients_lower:
-                        if category not in detected:
-                            detected[category] = []
-                        if keyword not in detected[category]:
-                            detected[category].append(keyword)
+            for kind, category, keyword in ingredient_matches(ingredients_text):
+                if kind != ALLERGEN:
+                    continue
+                found = detected.setdefault(category, [])
+                if keyword not in found:
+                    found.append(keyword)
         
         return detected
     
@@ -125,23 +296,56 @@ class AllergenDetector:
         if not isinstance(ingredients_text, str) or not ingredients_text:
             return conflicts
         
-        ingredients_lower = ingredients_text.lower()
+        for kind, preference, ingredient in ingredient_matches(ingredients_text):
+            if kind == DIET:
+                conflicts.setdefault(preference, []).append(ingredient)
         
-        # Check each dietary preference
-        for preference, data in DIETARY_PREFERENCES.items():
-            avoid_ingredients = data['avoid']
-            
-            # Track specific conflicts
-            found_conflicts = []
-            
-            for ingredient in avoid_ingredients:
-                if ingredient.lower() in ingredients_lower:
-                    found_conflicts.append(ingredient)
+        return conflicts
+    
+    @classmethod
+    def safety_flags(cls, product_data):
+        """
+        Bitmask of the allergens and diet conflicts detected in a product
+        
+        Args:
+            product_data (dict): Product data that includes 'ingredients' or 'allergens'
             
-            if found_conflicts:
-                conflicts[preference] = found_conflicts
+        Returns:
+            int: Value for GroceryItem.safety_flags, UNANALYSED if the product
+            has neither ingredients text nor allergen tags
+        """
+        ingredients_text = product_data.get('ingredients')
+        allergen_tags = product_data.get('allergens')
+        if not (isinstance(ingredients_text, str) and ingredients_text.strip()) and not (
+            isinstance(allergen_tags, list) and allergen_tags
+        ):
+            return UNANALYSED
         
-        return conflicts
+        flags = 0
+        for category in cls.detect_allergens(product_data):
+            flags |= ALLERGEN_BITS[category]
+        for preference in cls.check_dietary_preferences(product_data):
+            flags |= DIET_BITS[preference]
+        return flags
+    
+    @classmethod
+    def safety_mask(cls, user_allergens=None, user_preferences=None):
+        """
+        Bitmask of the flags a user needs to avoid
+        
+        Args:
+            user_allergens (list): List of user's allergen categories
+            user_preferences (list): List of user's dietary preferences
+            
+        Returns:
+            int: Mask for safe_items_filter; unknown names are ignored
+        """
+        mask = 0
+        for allergen in user_allergens or []:
+            mask |= ALLERGEN_BITS.get(allergen, 0)
+        for preference in user_preferences or []:
+            mask |= DIET_BITS.get(preference, 0)
+        return mask
     
     @classmethod
     def is_safe_for_user(cls, product_data, user_allergens=None, user_preferences=None):
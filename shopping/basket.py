@@ -0,0 +1,239 @@
+"""
+ShopSmart Basket Pricing
+
+Prices a whole shopping list at each of the family's stores. The list's
+item x store price matrix is loaded in one query and the totals are
+computed with NumPy in whole cents. A store with no price for an item is
+charged the median of the item's prices at the other stores, and those
+lines are counted per store so the estimate's quality is visible. Items
+no store has a price for are left out of every total.
+
+The split-trip plan is the cheapest way to buy the list from at most
+``max_stores`` stores, each item bought wherever in the chosen stores it
+is cheapest. Plans buy items where their price is known whenever any
+store can, so an imputed price never sends anyone to a store that may
+not stock the item.
+
+Results are cached per list version and price generations: the list's
+family's, bumped whenever prices at one of its stores or its stores
+themselves change, and the list's store's, bumped whenever prices there
+change (see CheapestItemPrice.refresh). A price edit only makes the
+baskets that include that store stale.
+"""
+
+import itertools
+from decimal import Decimal
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+
+# Bumped when every cached basket is stale; each family and store also has
+# its own generation under this key
+PRICE_GENERATION_CACHE_KEY = 'shopping:basket_price_generation'
+
+BASKET_CACHE_TIMEOUT = 60 * 60
+
+DEFAULT_SPLIT_STORES = 2
+
+# Plans are searched over every combination of this many stores
+MAX_SPLIT_STORES = 3
+
+# Added to imputed line costs (in cents) when choosing a plan
+IMPUTED_PENALTY = 1e9
+
+
+def _family_generation_key(family_id):
+    return f'{PRICE_GENERATION_CACHE_KEY}:family:{family_id}'
+
+
+def _store_generation_key(store_id):
+    return f'{PRICE_GENERATION_CACHE_KEY}:store:{store_id}'
+
+
+def price_basket(shopping_list, max_stores=DEFAULT_SPLIT_STORES):
+    """Cached compute_basket for the list as of its current version"""
+    keys = [
+        PRICE_GENERATION_CACHE_KEY,
+        _family_generation_key(shopping_list.family_id),
+        _store_generation_key(shopping_list.store_id),
+    ]
+    generations = cache.get_many(keys)
+    generation = '.'.join(str(generations.get(key, 0)) for key in keys)
+    # Moving a list to another store or family doesn't bump its version
+    key = (
+        f'shopping:basket:{shopping_list.pk}:{shopping_list.version}:'
+        f'{shopping_list.store_id}:{shopping_list.family_id}:{generation}:{max_stores}'
+    )
+
+    basket = cache.get(key)
+    if basket is None:
+        basket = compute_basket(shopping_list, max_stores)
+        cache.set(key, basket, BASKET_CACHE_TIMEOUT)
+    return basket
+
+
+def invalidate_basket_prices(family_ids=None, store_ids=None):
+    """Mark the cached baskets of these families and at these stores (or every basket) as stale"""
+    if family_ids is None and store_ids is None:
+        keys = [PRICE_GENERATION_CACHE_KEY]
+    else:
+        keys = [_family_generation_key(family_id) for family_id in set(family_ids or ())]
+        keys += [_store_generation_key(store_id) for store_id in set(store_ids or ())]
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def load_price_matrix(shopping_list):
+    """
+    Load the price of each list line at each of the family's stores.
+
+    The list's own store is always included, and a price entered on the
+    list overrides that store's price for the line.
+
+    Returns:
+        Tuple of (lines, stores, prices) where lines are dicts with id,
+        item_id, name and quantity, stores are (id, name) pairs, and
+        prices[i, j] is the unit price in cents of lines[i] at stores[j],
+        NaN when unknown
+    """
+    from .models import EFFECTIVE_PRICE_FIELDS, GroceryStore, ItemStoreInfo
+
+    lines = list(shopping_list.items.order_by('sort_order', 'id').values(
+        'id', 'item_id', 'quantity', 'actual_price', name=F('item__name')
+    ))
+    stores = list(GroceryStore.objects.filter(
+        Q(families=shopping_list.family_id) | Q(pk=shopping_list.store_id)
+    ).distinct().order_by('name', 'id').values_list('id', 'name'))
+
+    prices = np.full((len(lines), len(stores)), np.nan)
+    store_index = {store_id: col for col, (store_id, _) in enumerate(stores)}
+    line_index = {}
+    for row, line in enumerate(lines):
+        line_index.setdefault(line['item_id'], []).append(row)
+
+    for item_id, store_id, price in ItemStoreInfo.objects.filter(
+        item_id__in=list(line_index), store_id__in=list(store_index)
+    ).annotate(
+        effective_price=Coalesce(*EFFECTIVE_PRICE_FIELDS)
+    ).filter(effective_price__isnull=False).values_list('item_id', 'store_id', 'effective_price'):
+        prices[line_index[item_id], store_index[store_id]] = int(price * 100)
+
+    list_store = store_index[shopping_list.store_id]
+    for row, line in enumerate(lines):
+        if line['actual_price'] is not None:
+            prices[row, list_store] = int(line['actual_price'] * 100)
+
+    return lines, stores, prices
+
+
+def compute_basket(shopping_list, max_stores=DEFAULT_SPLIT_STORES):
+    """
+    Price a list at every store and find the cheapest split-trip plan.
+
+    Args:
+        shopping_list: The ShoppingList to price
+        max_stores: Most stores the split-trip plan may visit (capped at
+            MAX_SPLIT_STORES)
+
+    Returns:
+        A JSON-ready dict with per-store totals (cheapest first), the
+        items no store has a price for, and the split-trip plan
+    """
+    lines, stores, prices = load_price_matrix(shopping_list)
+    quantities = np.array([float(line['quantity'] or 0) for line in lines])
+
+    known = ~np.isnan(prices)
+    priced = known.any(axis=1)
+    medians = np.zeros(len(lines))
+    if priced.any():
+        medians[priced] = np.nanmedian(prices[priced], axis=1)
+
+    # Whole-cent line costs, with unknown prices imputed from the item's median
+    costs = np.rint(np.where(known, prices, medians[:, None]) * quantities[:, None])
+    costs[~priced] = 0
+    imputed = ~known & priced[:, None]
+
+    totals = costs.sum(axis=0)
+    store_totals = sorted(
+        (
+            {
+                'id': store_id,
+                'name': name,
+                'total': _dollars(totals[col]),
+                'imputed_items': int(imputed[:, col].sum()),
+                'is_list_store': store_id == shopping_list.store_id,
+            }
+            for col, (store_id, name) in enumerate(stores)
+        ),
+        key=lambda store: (Decimal(store['total']), store['imputed_items'], store['name'])
+    )
+
+    return {
+        'list_id': shopping_list.pk,
+        'version': shopping_list.version,
+        'stores': store_totals,
+        'cheapest_store_id': store_totals[0]['id'] if store_totals else None,
+        'unpriced_items': [line['name'] for line, has_price in zip(lines, priced) if not has_price],
+        'split_plan': _split_plan(lines, stores, costs, imputed, priced, max_stores),
+    }
+
+
+def _split_plan(lines, stores, costs, imputed, priced, max_stores):
+    """Cheapest plan over every combination of up to max_stores stores, with its savings over one trip"""
+    if not stores or not priced.any():
+        return None
+
+    penalized = costs + np.where(imputed, IMPUTED_PENALTY, 0)
+
+    plans = []
+    for size in range(1, min(max(max_stores, 1), MAX_SPLIT_STORES, len(stores)) + 1):
+        combinations = np.array(list(itertools.combinations(range(len(stores)), size)))
+        # lines x combinations x stores in the combination
+        totals = penalized[:, combinations].min(axis=2).sum(axis=0)
+        index = int(totals.argmin())
+        # Another store is only worth the trip if it saves something
+        if not plans or totals[index] < plans[-1][0]:
+            plans.append((totals[index], combinations[index]))
+
+    def assign(plan_stores):
+        choice = plan_stores[penalized[:, plan_stores].argmin(axis=1)]
+        return choice, costs[np.arange(len(lines)), choice].sum()
+
+    choice, total = assign(plans[-1][1])
+    _, one_trip_total = assign(plans[0][1])
+
+    trips = []
+    for col in plans[-1][1]:
+        rows = [row for row in np.flatnonzero(choice == col) if priced[row]]
+        if not rows:
+            continue
+        trips.append({
+            'id': stores[col][0],
+            'name': stores[col][1],
+            'total': _dollars(costs[rows, col].sum()),
+            'items': [
+                {
+                    'id': lines[row]['id'],
+                    'name': lines[row]['name'],
+                    'cost': _dollars(costs[row, col]),
+                    'imputed': bool(imputed[row, col]),
+                }
+                for row in rows
+            ],
+        })
+
+    return {
+        'total': _dollars(total),
+        'savings': _dollars(one_trip_total - total),
+        'stores': trips,
+    }
+
+
+def _dollars(cents):
+    """Whole cents as a dollar string, the way list prices are serialized"""
+    return str((Decimal(int(cents)) / 100).quantize(Decimal('0.01')))
@@ -0,0 +1,186 @@
+"""
+ShopSmart Collaborative Filtering
+
+Builds a family x item usage matrix from FamilyItemUsage, finds each
+family's nearest neighbours by cosine similarity in batches and persists
+them as FamilyNeighbour rows. Recommendations are then a similarity
+weighted sum over the neighbours' items, which only touches the k
+neighbour families instead of joining every family's usage.
+"""
+
+import logging
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NEIGHBOURS = 20
+DEFAULT_BATCH_SIZE = 256
+
+
+def build_usage_matrix(rows=None):
+    """
+    Build a row-normalised family x item usage matrix.
+
+    Usage counts are damped with log1p so a handful of staples bought every
+    week don't dominate the similarity.
+
+    Args:
+        rows: Optional iterable of (family_id, item_id, usage_count) tuples.
+            Defaults to every FamilyItemUsage row.
+
+    Returns:
+        Tuple of (family_ids, item_ids, matrix) where row i of the CSR matrix
+        belongs to family_ids[i] and column j to item_ids[j]
+    """
+    if rows is None:
+        from .models import FamilyItemUsage
+        rows = FamilyItemUsage.objects.filter(
+            usage_count__gt=0
+        ).values_list('family_id', 'item_id', 'usage_count').iterator(chunk_size=10000)
+
+    family_col = []
+    item_col = []
+    counts = []
+    for family_id, item_id, usage_count in rows:
+        family_col.append(family_id)
+        item_col.append(item_id)
+        counts.append(usage_count)
+
+    if not family_col:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, sparse.csr_matrix((0, 0), dtype=np.float32)
+
+    family_ids, family_index = np.unique(np.asarray(family_col, dtype=np.int64), return_inverse=True)
+    item_ids, item_index = np.unique(np.asarray(item_col, dtype=np.int64), return_inverse=True)
+    values = np.log1p(np.asarray(counts, dtype=np.float32))
+
+    matrix = sparse.csr_matrix(
+        (values, (family_index, item_index)),
+        shape=(len(family_ids), len(item_ids)),
+        dtype=np.float32
+    )
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    matrix = sparse.diags(1.0 / norms).dot(matrix).tocsr()
+
+    return family_ids, item_ids, matrix
+
+
+def compute_neighbours(matrix, k=DEFAULT_NEIGHBOURS, batch_size=DEFAULT_BATCH_SIZE, min_similarity=0.0):
+    """
+    Find the top-k most similar rows for every row of a normalised matrix.
+
+    Similarities are computed one block of rows at a time so memory stays
+    bounded by batch_size x families rather than families x families.
+
+    Yields:
+        (row, neighbour_rows, similarities) with neighbours in descending
+        order of similarity
+    """
+    n_rows = matrix.shape[0]
+    transposed = matrix.T.tocsr()
+
+    for start in range(0, n_rows, batch_size):
+        stop = min(start + batch_size, n_rows)
+        block = matrix[start:stop].dot(transposed).tocsr()
+
+        for offset in range(stop - start):
+            row = start + offset
+            lo, hi = block.indptr[offset], block.indptr[offset + 1]
+            cols = block.indices[lo:hi]
+            sims = block.data[lo:hi]
+
+            mask = (cols != row) & (sims > min_similarity)
+            cols = cols[mask]
+            sims = sims[mask]
+
+            if len(sims) > k:
+                top = np.argpartition(-sims, k)[:k]
+                cols = cols[top]
+                sims = sims[top]
+
+            order = np.argsort(-sims, kind='stable')
+            yield row, cols[order], sims[order]
+
+
+def rebuild_neighbours(k=DEFAULT_NEIGHBOURS, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Recompute and persist FamilyNeighbour rows for every family.
+
+    Returns:
+        Number of neighbour rows written
+    """
+    from django.db import transaction
+    from .models import FamilyNeighbour
+
+    family_ids, _, matrix = build_usage_matrix()
+
+    with transaction.atomic():
+        FamilyNeighbour.objects.all().delete()
+
+        pending = []
+        written = 0
+        for row, cols, sims in compute_neighbours(matrix, k=k, batch_size=batch_size):
+            family_id = int(family_ids[row])
+            for col, similarity in zip(cols, sims):
+                pending.append(FamilyNeighbour(
+                    family_id=family_id,
+                    neighbour_id=int(family_ids[col]),
+                    similarity=float(similarity)
+                ))
+
+            if len(pending) >= 5000:
+                FamilyNeighbour.objects.bulk_create(pending)
+                written += len(pending)
+                pending = []
+
+        FamilyNeighbour.objects.bulk_create(pending)
+        written += len(pending)
+
+    logger.info(f"Rebuilt {written} family neighbour rows for {len(family_ids)} families")
+    return written
+
+
+def recommend_from_neighbours(family, store=None, limit=5):
+    """
+    Score items bought by a family's neighbours that the family hasn't bought.
+
+    Each candidate's score is the sum of the similarities of the neighbours
+    that use it.
+
+    Returns:
+        List of GroceryItems, or None if no neighbours have been computed for
+        this family
+    """
+    from .models import FamilyItemUsage, FamilyNeighbour, GroceryItem
+
+    neighbours = dict(FamilyNeighbour.objects.filter(
+        family=family
+    ).values_list('neighbour_id', 'similarity'))
+
+    if not neighbours:
+        return None
+
+    own_items = FamilyItemUsage.objects.filter(family=family).values_list('item_id', flat=True)
+    usage = FamilyItemUsage.objects.filter(
+        family_id__in=list(neighbours),
+        usage_count__gt=0
+    ).exclude(
+        item_id__in=own_items
+    )
+
+    # Filter by store if specified
+    if store:
+        usage = usage.filter(item__store_info__store=store)
+
+    scores = defaultdict(float)
+    for neighbour_id, item_id in usage.values_list('family_id', 'item_id'):
+        scores[item_id] += neighbours[neighbour_id]
+
+    ranked = sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
+    items_by_id = GroceryItem.objects.in_bulk([item_id for item_id, _ in ranked])
+    return [items_by_id[item_id] for item_id, _ in ranked if item_id in items_by_id]
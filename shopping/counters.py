@@ -0,0 +1,321 @@
+"""
+ShopSmart Popularity Counters
+
+Adding an item to a shopping list bumps GroceryItem.global_popularity and the
+family's FamilyItemUsage.usage_count. Doing that with a read-modify-write on
+every save races between workers and keeps row locks on hot items, so the
+increments are buffered instead and applied in batches:
+
+- With REDIS_URL set, increments go to Redis hashes shared by every worker
+  and a flush atomically takes the whole pending batch.
+- Otherwise each process keeps its own in-memory buffer.
+
+A flush happens when a process has buffered POPULARITY_FLUSH_THRESHOLD
+increments, and a background thread in every process flushes whatever is
+left once POPULARITY_FLUSH_INTERVAL seconds have passed without one, so an
+idle worker doesn't sit on its increments. The flush_popularity command
+forces a flush of the shared Redis buffer (without Redis it can only reach
+its own process's buffer). A flush that fails puts its increments back for
+the next one. After a flush the counts are exactly what per-save increments
+would have produced.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_KEY = 'shopping:popularity:global'
+FAMILY_KEY = 'shopping:popularity:family'
+FLUSH_LOCK_KEY = 'shopping:popularity:flush'
+
+
+def flush_interval():
+    return getattr(settings, 'POPULARITY_FLUSH_INTERVAL', 60)
+
+
+def flush_threshold():
+    return getattr(settings, 'POPULARITY_FLUSH_THRESHOLD', 500)
+
+
+class MemoryCounterBuffer:
+    """Per-process buffer of pending popularity increments"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._global = Counter()
+        self._family = Counter()
+        self.pending = 0
+
+    def add(self, increments, family_id=None):
+        """Buffer {item_id: amount} increments, optionally for a family too"""
+        with self._lock:
+            for item_id, amount in increments.items():
+                self._global[item_id] += amount
+                if family_id:
+                    self._family[(family_id, item_id)] += amount
+                self.pending += amount
+
+    def drain(self):
+        """Remove and return (item increments, (family, item) increments)"""
+        with self._lock:
+            drained = self._global, self._family
+            self._global = Counter()
+            self._family = Counter()
+            self.pending = 0
+        return drained
+
+    def restore(self, global_counts, family_counts):
+        """Put drained increments back, e.g. after a failed flush"""
+        with self._lock:
+            self._global.update(global_counts)
+            self._family.update(family_counts)
+            self.pending += sum(global_counts.values())
+
+    def lock(self):
+        return self._flush_lock
+
+
+class RedisCounterBuffer:
+    """Buffer of pending popularity increments shared through Redis hashes"""
+
+    def __init__(self, client):
+        self.client = client
+        # Increments added by this process since its last flush
+        self.pending = 0
+
+    def add(self, increments, family_id=None):
+        """Buffer {item_id: amount} increments, optionally for a family too"""
+        pipe = self.client.pipeline()
+        for item_id, amount in increments.items():
+            pipe.hincrby(GLOBAL_KEY, item_id, amount)
+            if family_id:
+                pipe.hincrby(FAMILY_KEY, f'{family_id}:{item_id}', amount)
+            self.pending += amount
+        pipe.execute()
+
+    def _take(self, key):
+        # RENAME is atomic, so increments arriving during the flush land in a
+        # fresh hash and are picked up by the next one
+        from redis.exceptions import ResponseError
+
+        draining = f'{key}:draining'
+        try:
+            self.client.rename(key, draining)
+        except ResponseError:
+            # Nothing buffered under this key
+            return {}
+        pipe = self.client.pipeline()
+        pipe.hgetall(draining)
+        pipe.delete(draining)
+        values, _ = pipe.execute()
+        return values
+
+    def drain(self):
+        self.pending = 0
+        global_counts = Counter({
+            int(item_id): int(count) for item_id, count in self._take(GLOBAL_KEY).items()
+        })
+        family_counts = Counter()
+        for key, count in self._take(FAMILY_KEY).items():
+            family_id, item_id = (int(part) for part in key.decode().split(':'))
+            family_counts[(family_id, item_id)] = int(count)
+        return global_counts, family_counts
+
+    def restore(self, global_counts, family_counts):
+        """Put drained increments back, e.g. after a failed flush"""
+        pipe = self.client.pipeline()
+        for item_id, amount in global_counts.items():
+            pipe.hincrby(GLOBAL_KEY, item_id, amount)
+        for (family_id, item_id), amount in family_counts.items():
+            pipe.hincrby(FAMILY_KEY, f'{family_id}:{item_id}', amount)
+        pipe.execute()
+        self.pending += sum(global_counts.values())
+
+    def lock(self):
+        return self.client.lock(FLUSH_LOCK_KEY, timeout=120)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def get_buffer():
+    """Return the process-wide counter buffer, Redis-backed when available"""
+    global _buffer
+
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                if getattr(settings, 'REDIS_URL', None):
+                    from django_redis import get_redis_connection
+                    _buffer = RedisCounterBuffer(get_redis_connection('default'))
+                else:
+                    _buffer = MemoryCounterBuffer()
+                    atexit.register(_flush_at_exit)
+                threading.Thread(
+                    target=_flush_periodically, name='popularity-flush', daemon=True
+                ).start()
+    return _buffer
+
+
+def record_item_added(item_id, family_id=None):
+    """
+    Count an item being added to a family's list.
+
+    The increment is buffered once the surrounding transaction commits, so a
+    rolled back list save doesn't count.
+    """
+    record_items_added({item_id: 1}, family_id)
+
+
+def record_items_added(increments, family_id=None):
+    """Count several items ({item_id: times added}) being added at once"""
+    increments = {item_id: amount for item_id, amount in increments.items() if amount}
+    if not increments:
+        return
+
+    def buffer_increments():
+        get_buffer().add(increments, family_id)
+        maybe_flush()
+
+    transaction.on_commit(buffer_increments)
+
+
+def maybe_flush():
+    """Flush if this process has waited long enough or buffered enough"""
+    buffer = get_buffer()
+    due = time.monotonic() - _last_flush >= flush_interval()
+    if due or buffer.pending >= flush_threshold():
+        try:
+            flush()
+        except Exception as e:
+            # The increments were put back and the next flush retries them
+            logger.error(f"Error flushing popularity counters: {str(e)}", exc_info=True)
+
+
+def flush():
+    """
+    Apply every buffered increment to the database.
+
+    Returns:
+        Tuple of (items updated, family usage rows updated)
+    """
+    global _last_flush
+
+    buffer = get_buffer()
+    with buffer.lock():
+        global_counts, family_counts = buffer.drain()
+        _last_flush = time.monotonic()
+        if global_counts or family_counts:
+            try:
+                apply_increments(global_counts, family_counts)
+            except Exception:
+                buffer.restore(global_counts, family_counts)
+                raise
+
+    if global_counts or family_counts:
+        logger.info(
+            f"Flushed popularity for {len(global_counts)} items and {len(family_counts)} family items"
+        )
+    return len(global_counts), len(family_counts)
+
+
+def apply_increments(global_counts, family_counts):
+    """
+    Add a batch of increments to GroceryItem and FamilyItemUsage.
+
+    Items are updated with one F() UPDATE per distinct increment. Family
+    usage rows are created if missing, locked, and upserted with their new
+    totals in one bulk statement.
+
+    Args:
+        global_counts: {item_id: increment}
+        family_counts: {(family_id, item_id): increment}
+    """
+    from .models import Family, FamilyItemUsage, GroceryItem
+
+    with transaction.atomic():
+        by_amount = defaultdict(list)
+        for item_id, amount in global_counts.items():
+            if amount:
+                by_amount[amount].append(item_id)
+        for amount, item_ids in by_amount.items():
+            GroceryItem.objects.filter(id__in=item_ids).update(
+                global_popularity=F('global_popularity') + amount
+            )
+
+        # Families and items deleted since they were counted are skipped, or
+        # the batch would fail, be put back and fail again at every flush
+        family_ids = set(Family.objects.filter(
+            id__in={family_id for family_id, _ in family_counts}
+        ).values_list('id', flat=True))
+        item_ids = set(GroceryItem.objects.filter(
+            id__in={item_id for _, item_id in family_counts}
+        ).values_list('id', flat=True))
+        family_counts = {
+            (family_id, item_id): amount for (family_id, item_id), amount in family_counts.items()
+            if amount and family_id in family_ids and item_id in item_ids
+        }
+        if not family_counts:
+            return
+
+        # Make sure every row exists so all of them can be locked
+        FamilyItemUsage.objects.bulk_create(
+            [
+                FamilyItemUsage(family_id=family_id, item_id=item_id, usage_count=0)
+                for family_id, item_id in family_counts
+            ],
+            ignore_conflicts=True
+        )
+
+        current = {
+            (family_id, item_id): usage_count
+            for family_id, item_id, usage_count in FamilyItemUsage.objects.select_for_update().filter(
+                family_id__in=family_ids, item_id__in=item_ids
+            ).order_by('pk').values_list('family_id', 'item_id', 'usage_count')
+        }
+
+        now = timezone.now()
+        FamilyItemUsage.objects.bulk_create(
+            [
+                FamilyItemUsage(
+                    family_id=family_id,
+                    item_id=item_id,
+                    usage_count=current.get((family_id, item_id), 0) + amount,
+                    last_used=now
+                )
+                for (family_id, item_id), amount in family_counts.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['family', 'item'],
+            update_fields=['usage_count', 'last_used']
+        )
+
+
+def _flush_periodically():
+    """Background loop that flushes buffers no item add has flushed for a while"""
+    while True:
+        time.sleep(flush_interval())
+        try:
+            maybe_flush()
+        finally:
+            # This thread's connection isn't managed by the request cycle
+            connection.close()
+
+
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        logger.exception("Error flushing popularity counters at exit")
@@ -2,7 +2,10 @@
 Open Food Facts API Integration for ShopSmart
 
 This module provides comprehensive integration with the Open Food Facts API,
-handling data retrieval, caching, and error handling.
+handling data retrieval, caching, and error handling. Requests go through
+the shared client in shopping.off_client (connection pooling, timeouts,
+per-host limits, coalescing and a circuit breaker) and results are cached by
+shopping.off_cache (digest keys, negative caching, stale-while-revalidate).
 """
 
 import requests
@@ -10,15 +13,23 @@ from urllib.parse import quote
 import json
 import logging
 from datetime import datetime, timedelta
-from django.core.cache import cache
+from asgiref.sync import sync_to_async
 from django.conf import settings
 
+from .off_cache import LookupCache
+from .off_client import get_client
+
 logger = logging.getLogger(__name__)
 
 # Cache settings - can be overridden in Django settings
 CACHE_TIMEOUT = getattr(settings, 'OFF_CACHE_TIMEOUT', 60 * 60 * 24)  # 24 hours default
 SEARCH_CACHE_TIMEOUT = getattr(settings, 'OFF_SEARCH_CACHE_TIMEOUT', 60 * 60)  # 1 hour default
 
+PRODUCT_CACHE = LookupCache('product', CACHE_TIMEOUT)
+SEARCH_CACHE = LookupCache('search', SEARCH_CACHE_TIMEOUT)
+CATEGORY_CACHE = LookupCache('categories', CACHE_TIMEOUT * 7)  # Categories rarely change
+CACHE_KINDS = (PRODUCT_CACHE.kind, SEARCH_CACHE.kind, CATEGORY_CACHE.kind)
+
 class OpenFoodFactsAPI:
     """
     Client for interacting with the Open Food Facts API.
@@ -33,54 +44,94 @@ class OpenFoodFactsAPI:
     
     BASE_URL = 'https://world.openfoodfacts.org/api/v0'
     USER_AGENT = 'ShopSmart - Django Shopping App'
+    PRODUCT_TIMEOUT = 5
+    SEARCH_TIMEOUT = 10
     
     @classmethod
     def get_product(cls, barcode):
         """
         Fetch a product by barcode from Open Food Facts API.
         
+        Products in the local mirror (imported from the OFF data dump) are
+        answered without calling the API. Unknown barcodes are cached too,
+        for a shorter time.
+        
         Args:
             barcode (str): Product barcode (UPC, EAN, etc.)
             
         Returns:
             dict: Normalized product data or None if not found
         """
-        # Check cache first
-        cache_key = f'off_product_{barcode}'
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            logger.debug(f"Cache hit for barcode {barcode}")
-            return cached_data
+        from .models import OpenFoodFactsProduct
+        
+        local = OpenFoodFactsProduct.objects.filter(pk=barcode).values_list('data', flat=True).first()
+        if local is not None:
+            return local
         
         try:
-            # Make API request
-            url = f"{cls.BASE_URL}/product/{barcode}.json"
-            headers = {'User-Agent': cls.USER_AGENT}
-            
-            response = requests.get(url, headers=headers, timeout=5)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Check if product was found
-            if data.get('status') != 1 or 'product' not in data:
-                logger.info(f"Product with barcode {barcode} not found")
-                return None
-            
-            # Normalize and extract relevant product data
-            product_data = cls._normalize_product_data(data['product'])
-            
-            # Cache the results
-            cache.set(cache_key, product_data, CACHE_TIMEOUT)
-            
-            return product_data
+            return PRODUCT_CACHE.get_or_fetch(
+                PRODUCT_CACHE.key(barcode), lambda: cls._fetch_product(barcode)
+            )
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error fetching product {barcode}: {str(e)}")
+            return None
+        except (json.JSONDecodeError, KeyError) as e:
+            logger.error(f"Error parsing product data for {barcode}: {str(e)}")
+            return None
+    
+    @classmethod
+    async def aget_product(cls, barcode):
+        """
+        Async version of get_product for ASGI views.
+        
+        Args:
+            barcode (str): Product barcode (UPC, EAN, etc.)
             
+        Returns:
+            dict: Normalized product data or None if not found
+        """
+        from .models import OpenFoodFactsProduct
+        
+        local = await OpenFoodFactsProduct.objects.filter(pk=barcode).values_list('data', flat=True).afirst()
+        if local is not None:
+            return local
+        
+        cache_key = PRODUCT_CACHE.key(barcode)
+        found, product = await sync_to_async(PRODUCT_CACHE.peek)(
+            cache_key, lambda: cls._fetch_product(barcode)
+        )
+        if found:
+            return product
+        
+        try:
+            data = await get_client().afetch_product(barcode, timeout=cls.PRODUCT_TIMEOUT)
+            product = cls._product_from_response(barcode, data)
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching product {barcode}: {str(e)}")
             return None
         except (json.JSONDecodeError, KeyError) as e:
             logger.error(f"Error parsing product data for {barcode}: {str(e)}")
             return None
+        
+        await sync_to_async(PRODUCT_CACHE.store)(cache_key, product)
+        return product
+    
+    @classmethod
+    def _fetch_product(cls, barcode):
+        # Concurrent lookups of the same barcode share one request
+        data = get_client().fetch_product(barcode, timeout=cls.PRODUCT_TIMEOUT)
+        return cls._product_from_response(barcode, data)
+    
+    @classmethod
+    def _product_from_response(cls, barcode, data):
+        """Normalized product from a lookup response, or None if not found"""
+        # Check if product was found
+        if not data or data.get('status') != 1 or 'product' not in data:
+            logger.info(f"Product with barcode {barcode} not found")
+            return None
+        
+        # Normalize and extract relevant product data
+        return cls._normalize_product_data(data['product'])
     
     @classmethod
     def search_products(cls, query, page=1, page_size=20, categories=None, brands=None):
@@ -97,64 +148,13 @@ class OpenFoodFactsAPI:
         Returns:
             dict: Search results with products and pagination info
         """
-        # Create cache key based on all parameters
-        cache_params = f"{query}_{page}_{page_size}"
-        if categories:
-            cache_params += f"_cats={'_'.join(categories)}"
-        if brands:
-            cache_params += f"_brands={'_'.join(brands)}"
-        
-        cache_key = f'off_search_{hash(cache_params)}'
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            logger.debug(f"Cache hit for search: {query}")
-            return cached_data
+        # Cache key based on all parameters
+        cache_key = SEARCH_CACHE.key(query, page, page_size, categories or [], brands or [])
         
         try:
-            # Build search URL
-            url = f"{cls.BASE_URL}/search"
-            
-            # Build parameters
-            params = {
-                'search_terms': query,
-                'page': page,
-                'page_size': page_size,
-                'json': 1,
-            }
-            
-            # Add filter parameters if provided
-            if categories:
-                params['tagtype_0'] = 'categories'
-                params['tag_contains_0'] = 'contains'
-                params['tag_0'] = ','.join(categories)
-                
-            if brands:
-                tag_index = 1 if categories else 0
-                params[f'tagtype_{tag_index}'] = 'brands'
-                params[f'tag_contains_{tag_index}'] = 'contains'
-                params[f'tag_{tag_index}'] = ','.join(brands)
-            
-            # Make API request
-            headers = {'User-Agent': cls.USER_AGENT}
-            response = requests.get(url, params=params, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Normalize result data
-            result = {
-                'products': [cls._normalize_product_data(p) for p in data.get('products', [])],
-                'total': data.get('count', 0),
-                'page': data.get('page', page),
-                'page_size': data.get('page_size', page_size),
-                'total_pages': data.get('page_count', 0)
-            }
-            
-            # Cache the results (shorter time than individual products)
-            cache.set(cache_key, result, SEARCH_CACHE_TIMEOUT)
-            
-            return result
-            
+            return SEARCH_CACHE.get_or_fetch(
+                cache_key, lambda: cls._fetch_search(query, page, page_size, categories, brands)
+            )
         except requests.exceptions.RequestException as e:
             logger.error(f"Error searching products: {str(e)}")
             return {'products': [], 'total': 0, 'page': page, 'page_size': page_size, 'total_pages': 0}
@@ -162,6 +162,43 @@ class OpenFoodFactsAPI:
             logger.error(f"Error parsing search results: {str(e)}")
             return {'products': [], 'total': 0, 'page': page, 'page_size': page_size, 'total_pages': 0}
     
+    @classmethod
+    def _fetch_search(cls, query, page, page_size, categories, brands):
+        # Build search URL
+        url = f"{cls.BASE_URL}/search"
+        
+        # Build parameters
+        params = {
+            'search_terms': query,
+            'page': page,
+            'page_size': page_size,
+            'json': 1,
+        }
+        
+        # Add filter parameters if provided
+        if categories:
+            params['tagtype_0'] = 'categories'
+            params['tag_contains_0'] = 'contains'
+            params['tag_0'] = ','.join(categories)
+        
+        if brands:
+            tag_index = 1 if categories else 0
+            params[f'tagtype_{tag_index}'] = 'brands'
+            params[f'tag_contains_{tag_index}'] = 'contains'
+            params[f'tag_{tag_index}'] = ','.join(brands)
+        
+        # Make API request
+        data = get_client().get_json(url, params=params, timeout=cls.SEARCH_TIMEOUT) or {}
+        
+        # Normalize result data
+        return {
+            'products': [cls._normalize_product_data(p) for p in data.get('products', [])],
+            'total': data.get('count', 0),
+            'page': data.get('page', page),
+            'page_size': data.get('page_size', page_size),
+            'total_pages': data.get('page_count', 0)
+        }
+    
     @classmethod
     def get_categories(cls):
         """
@@ -170,43 +207,33 @@ class OpenFoodFactsAPI:
         Returns:
             list: List of category data dictionaries
         """
-        cache_key = 'off_categories'
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return cached_data
-        
         try:
-            url = f"{cls.BASE_URL}/categories.json"
-            headers = {'User-Agent': cls.USER_AGENT}
-            
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Extract and normalize category data
-            categories = []
-            for tag in data.get('tags', []):
-                if tag.get('products') > 100:  # Only include popular categories
-                    categories.append({
-                        'id': tag.get('id'),
-                        'name': tag.get('name'),
-                        'products': tag.get('products', 0),
-                        'url': tag.get('url')
-                    })
-            
-            # Sort by product count
-            categories.sort(key=lambda x: x['products'], reverse=True)
-            
-            # Cache the results (longer time since categories rarely change)
-            cache.set(cache_key, categories, CACHE_TIMEOUT * 7)  # Cache for a week
-            
-            return categories
-            
+            return CATEGORY_CACHE.get_or_fetch(CATEGORY_CACHE.key(), cls._fetch_categories)
         except Exception as e:
             logger.error(f"Error fetching categories: {str(e)}")
             return []
     
+    @classmethod
+    def _fetch_categories(cls):
+        url = f"{cls.BASE_URL}/categories.json"
+        data = get_client().get_json(url, timeout=cls.SEARCH_TIMEOUT) or {}
+        
+        # Extract and normalize category data
+        categories = []
+        for tag in data.get('tags', []):
+            if tag.get('products') > 100:  # Only include popular categories
+                categories.append({
+                    'id': tag.get('id'),
+                    'name': tag.get('name'),
+                    'products': tag.get('products', 0),
+                    'url': tag.get('url')
+                })
+        
+        # Sort by product count
+        categories.sort(key=lambda x: x['products'], reverse=True)
+        
+        return categories
+    
     @classmethod
     def _normalize_product_data(cls, product):
         """
@@ -0,0 +1,257 @@
+"""
+ShopSmart Live List Updates
+
+Everyone viewing a shopping list gets the item-level changes other family
+members make pushed to them over Server-Sent Events (ListEventsView), so
+the detail page no longer has to be reloaded to see them.
+
+Changes are published from the sync change feed: once a transaction that
+touched a list commits (shopping.sync.record_changes), the current state of
+the changed items is serialised once and published on the list's channel,
+only if somebody is watching it. Each event's ID is the feed cursor, so a
+reconnecting browser sends Last-Event-ID and is caught up from the feed.
+
+Brokers:
+- With REDIS_URL set, Redis pub/sub, so every ASGI worker sees changes made
+  by any other process. Settings require REDIS_URL outside DEBUG.
+- Otherwise an in-process broker (development and tests), which only reaches
+  viewers connected to the process that made the change.
+
+Streams need an ASGI server (see docker-entrypoint.sh); under WSGI each open
+stream would tie up a worker.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIX = 'shopping:list-events:'
+
+# Comment sent on idle streams so proxies don't close them
+KEEPALIVE_SECONDS = 25
+
+# How long browsers wait before reconnecting a dropped stream
+RETRY_MS = 3000
+
+
+def channel_name(list_id):
+    return f'{CHANNEL_PREFIX}{list_id}'
+
+
+class MemorySubscription:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout):
+        """Next message, or None if none arrives within ``timeout`` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class MemoryBroker:
+    """Pub/sub between the threads and event loops of one process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def watched(self, channels):
+        """The subset of channels somebody is subscribed to"""
+        with self._lock:
+            return {channel for channel in channels if self._subscriptions.get(channel)}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, message)
+            except RuntimeError:
+                # The subscriber's event loop has shut down
+                pass
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        subscription = MemorySubscription()
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscriptions[channel].discard(subscription)
+                if not self._subscriptions[channel]:
+                    del self._subscriptions[channel]
+
+
+class RedisSubscription:
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def get(self, timeout):
+        """Next message, or None if none arrives within ``timeout`` seconds"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is not None:
+                return message['data'].decode()
+
+
+class RedisBroker:
+    """Pub/sub across processes through Redis"""
+
+    def __init__(self, url):
+        import redis
+
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+
+    def watched(self, channels):
+        channels = list(channels)
+        if not channels:
+            return set()
+        return {
+            channel.decode() for channel, count in self.client.pubsub_numsub(*channels) if count
+        }
+
+    def publish(self, channel, message):
+        self.client.publish(channel, message)
+
+    @asynccontextmanager
+    async def subscribe(self, channel):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(channel)
+        try:
+            yield RedisSubscription(pubsub)
+        finally:
+            await pubsub.unsubscribe(channel)
+            await pubsub.aclose()
+            await client.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """Return the process-wide broker, Redis-backed when REDIS_URL is set"""
+    global _broker
+
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                redis_url = getattr(settings, 'REDIS_URL', None)
+                _broker = RedisBroker(redis_url) if redis_url else MemoryBroker()
+    return _broker
+
+
+def format_event(delta):
+    """Serialise a list delta as an SSE ``changes`` event"""
+    return f"id: {delta['cursor']}\nevent: changes\ndata: {json.dumps(delta)}\n\n"
+
+
+def list_delta(list_id, changes):
+    """
+    Current state of what changed on a list.
+
+    Args:
+        list_id: The list
+        changes: (change id, model name, record id, deleted) tuples, oldest first
+
+    Returns:
+        Dict with ``list_id``, ``cursor``, ``list`` (None once deleted),
+        ``items`` and ``deleted_items``
+    """
+    from .models import ShoppingList, ShoppingListItem
+    from .sync import LIST_MODEL, serialize_item, serialize_list
+
+    latest = {}
+    for _, model_name, record_id, deleted in changes:
+        latest[(model_name, record_id)] = deleted
+
+    item_ids = {record_id for (model_name, record_id), deleted in latest.items()
+                if model_name != LIST_MODEL and not deleted}
+    deleted_items = {record_id for (model_name, record_id), deleted in latest.items()
+                     if model_name != LIST_MODEL and deleted}
+
+    shopping_list = ShoppingList.objects.filter(pk=list_id).first()
+    items = list(ShoppingListItem.objects.filter(
+        pk__in=item_ids, shopping_list_id=list_id
+    ).select_related('item')) if shopping_list else []
+    deleted_items |= item_ids - {list_item.id for list_item in items}
+
+    return {
+        'list_id': list_id,
+        'cursor': max(change[0] for change in changes),
+        'list': serialize_list(shopping_list) if shopping_list else None,
+        'items': [serialize_item(list_item) for list_item in items],
+        'deleted_items': sorted(deleted_items),
+    }
+
+
+def list_changes_since(list_id, since):
+    """Delta of a list's changes after a feed cursor, or None if there are none"""
+    from .models import SyncChange
+    from .sync import PAGE_SIZE
+
+    changes = list(SyncChange.objects.filter(
+        list_id=list_id, id__gt=since
+    ).order_by('id').values_list('id', 'model_name', 'record_id', 'deleted')[:PAGE_SIZE])
+    return list_delta(list_id, changes) if changes else None
+
+
+def publish_changes(changes):
+    """Push committed SyncChange rows to anyone watching the lists they touch"""
+    try:
+        broker = get_broker()
+        by_list = defaultdict(list)
+        for change in changes:
+            by_list[change.list_id].append(
+                (change.id, change.model_name, change.record_id, change.deleted)
+            )
+
+        watched = broker.watched(channel_name(list_id) for list_id in by_list)
+        for list_id, list_changes in by_list.items():
+            if channel_name(list_id) in watched:
+                broker.publish(channel_name(list_id), format_event(list_delta(list_id, list_changes)))
+    except Exception as e:
+        # The changes are committed either way; viewers catch up on reconnect
+        logger.error(f"Error publishing list changes: {str(e)}", exc_info=True)
+
+
+async def event_stream(list_id, last_event_id=None):
+    """SSE stream of a list's changes, starting with any missed since ``last_event_id``"""
+    from asgiref.sync import sync_to_async
+
+    async with get_broker().subscribe(channel_name(list_id)) as subscription:
+        yield f'retry: {RETRY_MS}\n\n'
+
+        # Replay the missed changes a page at a time until caught up
+        cursor = last_event_id
+        while cursor is not None:
+            missed = await sync_to_async(list_changes_since)(list_id, cursor)
+            if not missed:
+                break
+            yield format_event(missed)
+            cursor = missed['cursor']
+
+        while True:
+            message = await subscription.get(KEEPALIVE_SECONDS)
+            yield message if message is not None else ': keepalive\n\n'
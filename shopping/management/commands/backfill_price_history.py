@@ -0,0 +1,99 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from shopping.models import CheapestItemPrice, ItemStoreInfo, PriceObservation, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Record the prices entered on shopping lists as price history and rebuild the price statistics from it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows read and written per batch (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            recorded = self._record_list_prices(batch_size)
+            rebuilt = self._rebuild_statistics(batch_size)
+            # The rebuilt averages and last prices can change which store is cheapest
+            CheapestItemPrice.refresh(batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Recorded {recorded} list prices; rebuilt price statistics for {rebuilt} store items'
+        ))
+
+    def _record_list_prices(self, batch_size):
+        """Add an observation for every list item price that doesn't have one yet"""
+        rows = ShoppingListItem.objects.filter(
+            actual_price__isnull=False
+        ).exclude(
+            id__in=PriceObservation.objects.filter(list_item__isnull=False).values('list_item_id')
+        ).annotate(
+            observed_at=Coalesce('shopping_list__completed_at', 'shopping_list__updated_at')
+        ).values_list(
+            'id', 'shopping_list__store_id', 'item_id', 'actual_price', 'observed_at'
+        ).iterator(chunk_size=batch_size)
+
+        recorded = 0
+        batch = []
+        for list_item_id, store_id, item_id, price, observed_at in rows:
+            batch.append(PriceObservation(
+                store_id=store_id, item_id=item_id, price=price, observed_at=observed_at, list_item_id=list_item_id
+            ))
+            if len(batch) >= batch_size:
+                recorded += len(PriceObservation.objects.bulk_create(batch))
+                batch = []
+        if batch:
+            recorded += len(PriceObservation.objects.bulk_create(batch))
+        return recorded
+
+    def _rebuild_statistics(self, batch_size):
+        """Fold every (store, item) history in time order, in one ordered pass"""
+        rows = PriceObservation.objects.order_by(
+            'store_id', 'item_id', 'observed_at', 'id'
+        ).values_list('store_id', 'item_id', 'price', 'observed_at').iterator(chunk_size=batch_size)
+
+        rebuilt = 0
+        folded = {}
+        current = None
+        for store_id, item_id, price, observed_at in rows:
+            if current is None or (current.store_id, current.item_id) != (store_id, item_id):
+                if len(folded) >= batch_size:
+                    rebuilt += self._save(folded)
+                    folded = {}
+                current = ItemStoreInfo(store_id=store_id, item_id=item_id)
+                folded[(store_id, item_id)] = current
+            current.add_price(price, observed_at)
+
+        if folded:
+            rebuilt += self._save(folded)
+        return rebuilt
+
+    def _save(self, folded):
+        existing = {
+            (info.store_id, info.item_id): info
+            for info in ItemStoreInfo.objects.filter(
+                store_id__in={store_id for store_id, _ in folded},
+                item_id__in={item_id for _, item_id in folded}
+            )
+        }
+
+        to_update, to_create = [], []
+        for key, stats in folded.items():
+            info = existing.get(key)
+            if info is None:
+                to_create.append(stats)
+                continue
+            for field in ItemStoreInfo.PRICE_FIELDS:
+                setattr(info, field, getattr(stats, field))
+            to_update.append(info)
+
+        ItemStoreInfo.objects.bulk_update(to_update, ItemStoreInfo.PRICE_FIELDS, batch_size=1000)
+        ItemStoreInfo.objects.bulk_create(to_create, batch_size=1000)
+        return len(folded)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shopping.models import GroceryItem, OpenFoodFactsProduct
+
+
+class Command(BaseCommand):
+    help = 'Recompute the allergen and diet flags stored on grocery items'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Items read and written per batch (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = changed = 0
+
+        batch = []
+        for item in GroceryItem.objects.order_by('pk').only(
+            'name', 'description', 'barcode', 'off_id', 'safety_flags'
+        ).iterator(chunk_size=batch_size):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                changed += self._backfill(batch)
+                checked += len(batch)
+                batch = []
+        if batch:
+            changed += self._backfill(batch)
+            checked += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} items, updated flags on {changed}'))
+
+    def _backfill(self, items):
+        """Recompute flags for a batch, preferring the mirrored OFF product data"""
+        mirrored = dict(OpenFoodFactsProduct.objects.filter(
+            code__in=[item.barcode for item in items if item.barcode]
+        ).values_list('code', 'data'))
+
+        to_update = []
+        for item in items:
+            flags = item.detect_safety_flags(mirrored.get(item.barcode))
+            if flags != item.safety_flags:
+                item.safety_flags = flags
+                to_update.append(item)
+
+        with transaction.atomic():
+            GroceryItem.objects.bulk_update(to_update, ['safety_flags'])
+        return len(to_update)
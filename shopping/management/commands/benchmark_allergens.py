@@ -0,0 +1,102 @@
+import itertools
+import json
+import time
+from django.core.management.base import BaseCommand
+from shopping.allergens import COMMON_ALLERGENS, DIETARY_PREFERENCES, AllergenDetector, ingredient_matches
+from shopping.food_api import OpenFoodFactsAPI
+from shopping.management.commands.populate_products import SAMPLE_FIXTURE
+from shopping.models import OpenFoodFactsProduct
+
+
+def substring_scan(product):
+    """The per-keyword substring checks the compiled matcher replaced, for comparison"""
+    detected, conflicts = {}, {}
+    for allergen in product.get('allergens') or []:
+        for category, keywords in COMMON_ALLERGENS.items():
+            if any(keyword.lower() in allergen.lower() for keyword in keywords):
+                detected.setdefault(category, []).append(allergen)
+
+    ingredients_lower = (product.get('ingredients') or '').lower()
+    if ingredients_lower:
+        for category, keywords in COMMON_ALLERGENS.items():
+            for keyword in keywords:
+                if keyword.lower() in ingredients_lower:
+                    detected.setdefault(category, []).append(keyword)
+        for preference, data in DIETARY_PREFERENCES.items():
+            found = [ingredient for ingredient in data['avoid'] if ingredient.lower() in ingredients_lower]
+            if found:
+                conflicts[preference] = found
+    return detected, conflicts
+
+
+class Command(BaseCommand):
+    help = 'Benchmark allergen and diet detection on Open Food Facts products'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count',
+            type=int,
+            default=5000,
+            help='Number of products to scan (default: 5000)'
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=3,
+            help='Timed passes over the products; the best is reported (default: 3)'
+        )
+
+    def handle(self, *args, **options):
+        products = self._load_products(options['count'])
+        if not products:
+            self.stdout.write(self.style.ERROR('No products with ingredients to benchmark'))
+            return
+
+        distinct = len({product.get('ingredients') for product in products})
+        self.stdout.write(f'Scanning {len(products)} products ({distinct} distinct ingredient lists)')
+
+        def compiled(product):
+            AllergenDetector.detect_allergens(product)
+            AllergenDetector.check_dietary_preferences(product)
+
+        def uncached(product):
+            ingredient_matches.cache_clear()
+            compiled(product)
+
+        substring_ms = self._time(substring_scan, products, options['rounds'])
+        self.stdout.write(f'Substring checks: {substring_ms:.1f} ms')
+
+        for label, scan in (('Compiled matcher', uncached), ('Compiled matcher, cached', compiled)):
+            elapsed_ms = self._time(scan, products, options['rounds'])
+            self.stdout.write(f'{label}: {elapsed_ms:.1f} ms ({substring_ms / max(elapsed_ms, 0.001):.1f}x)')
+
+    def _time(self, scan, products, rounds):
+        best = None
+        for _ in range(max(rounds, 1)):
+            started = time.perf_counter()
+            for product in products:
+                scan(product)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
+
+    def _load_products(self, count):
+        """Products from the local mirror, topped up from the bundled search sample"""
+        products = [
+            data for data in OpenFoodFactsProduct.objects.values_list('data', flat=True)[:count]
+            if data.get('ingredients')
+        ]
+        if len(products) >= count:
+            return products
+
+        with open(SAMPLE_FIXTURE) as f:
+            sample = [
+                OpenFoodFactsAPI._normalize_product_data(product)
+                for pages in json.load(f).values()
+                for page in pages
+                for product in page.get('products', [])
+                if product.get('ingredients_text')
+            ]
+        if not sample:
+            return products
+        return products + list(itertools.islice(itertools.cycle(sample), count - len(products)))
@@ -0,0 +1,113 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shopping.collaborative import build_usage_matrix, compute_neighbours, recommend_from_neighbours
+from shopping.models import Family, FamilyItemUsage, FamilyNeighbour, GroceryItem
+from shopping.recommender import ShoppingRecommender
+
+
+class RollbackBenchmark(Exception):
+    """Raised to roll back the synthetic benchmark data"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the neighbour index against the ORM collaborative query on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--families',
+            type=int,
+            nargs='+',
+            default=[10000, 100000],
+            help='Family counts to benchmark (default: 10000 100000)'
+        )
+        parser.add_argument(
+            '--items',
+            type=int,
+            default=2000,
+            help='Number of synthetic grocery items (default: 2000)'
+        )
+        parser.add_argument(
+            '--items-per-family',
+            type=int,
+            default=30,
+            help='Average distinct items used per family (default: 30)'
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=20,
+            help='Families to time recommendation lookups for (default: 20)'
+        )
+        parser.add_argument(
+            '--skip-orm',
+            action='store_true',
+            help='Only time the matrix path (the ORM query is very slow at 100k families)'
+        )
+
+    def handle(self, *args, **options):
+        for family_count in options['families']:
+            try:
+                with transaction.atomic():
+                    self._run(family_count, options)
+                    raise RollbackBenchmark()
+            except RollbackBenchmark:
+                pass
+
+    def _run(self, family_count, options):
+        rng = random.Random(42)
+        self.stdout.write(f'--- {family_count} families ---')
+
+        items = GroceryItem.objects.bulk_create(
+            [GroceryItem(name=f'bench-item-{i}') for i in range(options['items'])],
+            batch_size=5000
+        )
+        families = Family.objects.bulk_create(
+            [Family(name=f'bench-family-{i}') for i in range(family_count)],
+            batch_size=5000
+        )
+
+        # Skewed item popularity so some staples are shared by most families
+        weights = [1.0 / (rank + 1) for rank in range(len(items))]
+        usage = []
+        for family in families:
+            chosen = {item.id for item in rng.choices(items, weights=weights, k=options['items_per_family'])}
+            usage.extend(
+                FamilyItemUsage(family_id=family.id, item_id=item_id, usage_count=rng.randint(1, 20))
+                for item_id in chosen
+            )
+        FamilyItemUsage.objects.bulk_create(usage, batch_size=10000)
+        self.stdout.write(f'Seeded {len(usage)} usage rows')
+
+        started = time.monotonic()
+        family_ids, _, matrix = build_usage_matrix()
+        built = time.monotonic()
+        neighbours = []
+        for row, cols, sims in compute_neighbours(matrix):
+            neighbours.extend(
+                FamilyNeighbour(family_id=int(family_ids[row]), neighbour_id=int(family_ids[col]), similarity=float(sim))
+                for col, sim in zip(cols, sims)
+            )
+        computed = time.monotonic()
+        FamilyNeighbour.objects.bulk_create(neighbours, batch_size=10000)
+        persisted = time.monotonic()
+        self.stdout.write(
+            f'Index build: matrix {built - started:.2f}s, '
+            f'top-k {computed - built:.2f}s, persist {persisted - computed:.2f}s'
+        )
+
+        sample = rng.sample(families, min(options['samples'], len(families)))
+
+        started = time.monotonic()
+        for family in sample:
+            recommend_from_neighbours(family, limit=10)
+        index_ms = (time.monotonic() - started) * 1000 / len(sample)
+        self.stdout.write(f'Neighbour index lookup: {index_ms:.1f} ms/family')
+
+        if not options['skip_orm']:
+            started = time.monotonic()
+            for family in sample:
+                list(ShoppingRecommender._get_collaborative_recommendations_orm(family, limit=10))
+            orm_ms = (time.monotonic() - started) * 1000 / len(sample)
+            self.stdout.write(f'ORM query: {orm_ms:.1f} ms/family ({orm_ms / max(index_ms, 0.001):.1f}x)')
@@ -0,0 +1,152 @@
+import random
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.test import RequestFactory
+from shopping.models import (
+    CheapestItemPrice, Family, FamilyItemUsage, FamilyMember, GroceryItem, GroceryStore, ItemStoreInfo
+)
+from shopping.views import GroceryItemListView
+
+
+class RollbackBenchmark(Exception):
+    """Raised to roll back the synthetic benchmark data"""
+
+
+def subquery_queryset(user):
+    """The per-item correlated subqueries the cheapest price table replaced, for comparison"""
+    accessible_stores = GroceryStore.objects.filter(
+        families__in=Family.objects.filter(members__user=user)
+    ).distinct()
+    store_info_subquery = ItemStoreInfo.objects.filter(
+        item=OuterRef('pk'),
+        store__in=accessible_stores
+    ).annotate(
+        effective_price=Coalesce('typical_price', 'last_price', 'average_price')
+    ).exclude(
+        effective_price__isnull=True
+    ).order_by('effective_price')
+
+    return GroceryItem.objects.filter(
+        Q(created_by=user) | Q(families__members__user=user)
+    ).annotate(
+        lowest_price=Subquery(store_info_subquery.values('effective_price')[:1]),
+        lowest_price_store_id=Subquery(store_info_subquery.values('store__id')[:1]),
+        lowest_price_store_name=Subquery(store_info_subquery.values('store__name')[:1])
+    ).distinct().order_by('name')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the item catalogue page against the per-item subquery version on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items',
+            type=int,
+            default=100000,
+            help='Number of synthetic grocery items (default: 100000)'
+        )
+        parser.add_argument(
+            '--stores',
+            type=int,
+            default=20,
+            help='Number of synthetic stores, each pricing every item (default: 20)'
+        )
+        parser.add_argument(
+            '--rounds',
+            type=int,
+            default=3,
+            help='Timed page loads per page; the best is reported (default: 3)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options)
+                raise RollbackBenchmark()
+        except RollbackBenchmark:
+            pass
+
+    def _run(self, options):
+        rng = random.Random(42)
+
+        user = User.objects.create_user(username='bench-item-list')
+        family = Family.objects.create(name='bench-family', created_by=user)
+        FamilyMember.objects.create(user=user, family=family)
+
+        stores = GroceryStore.objects.bulk_create([
+            GroceryStore(name=f'bench-store-{i}', slug=f'bench-store-{i}') for i in range(options['stores'])
+        ])
+        family.stores.add(*stores)
+
+        items = GroceryItem.objects.bulk_create(
+            [GroceryItem(name=f'bench-item-{i:06d}') for i in range(options['items'])],
+            batch_size=5000
+        )
+        FamilyItemUsage.objects.bulk_create(
+            [FamilyItemUsage(family=family, item=item, usage_count=1) for item in items],
+            batch_size=5000
+        )
+
+        # Some stores only have a last paid price, to exercise the fallback
+        infos = []
+        for item in items:
+            for store in stores:
+                price = Decimal(rng.randint(50, 2000)) / 100
+                if rng.random() < 0.2:
+                    infos.append(ItemStoreInfo(item=item, store=store, last_price=price))
+                else:
+                    infos.append(ItemStoreInfo(item=item, store=store, typical_price=price))
+        ItemStoreInfo.objects.bulk_create(infos, batch_size=10000)
+        self.stdout.write(f'Seeded {len(items)} items x {len(stores)} stores ({len(infos)} store prices)')
+
+        started = time.monotonic()
+        written = CheapestItemPrice.refresh()
+        self.stdout.write(f'Full rebuild: {written} rows in {time.monotonic() - started:.2f}s')
+
+        started = time.monotonic()
+        ItemStoreInfo.record_prices(stores[0].id, {items[0].id: Decimal('0.10')})
+        self.stdout.write(f'Price update incl. refresh: {(time.monotonic() - started) * 1000:.1f} ms')
+
+        request = RequestFactory().get('/items/')
+        request.user = user
+        view = GroceryItemListView()
+        view.setup(request)
+
+        paginate_by = GroceryItemListView.paginate_by
+        last_page = (len(items) + paginate_by - 1) // paginate_by
+        for page_number in (1, last_page // 2):
+            def materialized():
+                view.kwargs = {}
+                view.request.GET = {'page': page_number}
+                return view.paginate_queryset(view.get_queryset(), paginate_by)[2]
+
+            def subqueries():
+                return list(Paginator(subquery_queryset(user), paginate_by).page(page_number).object_list)
+
+            if [(item.id, item.lowest_price) for item in materialized()] != [
+                (item.id, item.lowest_price) for item in subqueries()
+            ]:
+                self.stdout.write(self.style.ERROR(f'Page {page_number}: the two versions disagree'))
+                return
+
+            subquery_ms = self._time(subqueries, options['rounds'])
+            materialized_ms = self._time(materialized, options['rounds'])
+            self.stdout.write(
+                f'Page {page_number}: subqueries {subquery_ms:.1f} ms, '
+                f'cheapest price table {materialized_ms:.1f} ms ({subquery_ms / max(materialized_ms, 0.001):.1f}x)'
+            )
+
+    def _time(self, load_page, rounds):
+        best = None
+        for _ in range(max(rounds, 1)):
+            started = time.perf_counter()
+            load_page()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
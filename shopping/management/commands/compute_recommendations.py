@@ -0,0 +1,54 @@
+import logging
+from django.core.management.base import BaseCommand
+from shopping.models import Family, FamilyRecommendation
+from shopping.recommender import ShoppingRecommender
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Precompute ranked recommendations for each family and each of its stores'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--family',
+            type=int,
+            help='Family ID to compute recommendations for (default: all families)',
+        )
+        parser.add_argument(
+            '--stale-only',
+            action='store_true',
+            help='Only refresh rows that are missing or marked stale',
+        )
+
+    def handle(self, *args, **options):
+        families = Family.objects.prefetch_related('stores')
+        if options['family']:
+            families = families.filter(id=options['family'])
+            if not families.exists():
+                self.stdout.write(self.style.ERROR(f'Family with ID {options["family"]} not found!'))
+                return
+
+        fresh_keys = set()
+        if options['stale_only']:
+            fresh_keys = set(
+                FamilyRecommendation.objects.filter(is_stale=False).values_list('family_id', 'store_id')
+            )
+
+        refreshed = 0
+        for family in families:
+            # One row for the store-independent dashboard plus one per family store
+            for store in [None] + list(family.stores.all()):
+                store_id = store.id if store else None
+                if (family.id, store_id) in fresh_keys:
+                    continue
+
+                try:
+                    ShoppingRecommender.refresh_family_recommendations(family, store)
+                    refreshed += 1
+                except Exception as e:
+                    logger.error(f"Error computing recommendations for family {family.id}: {str(e)}")
+                    self.stdout.write(self.style.ERROR(f'Failed for {family.name}: {str(e)}'))
+
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {refreshed} recommendation rows'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from shopping.counters import flush
+
+
+class Command(BaseCommand):
+    help = 'Write buffered item popularity and family usage increments to the database (the shared Redis buffer when REDIS_URL is set)'
+
+    def handle(self, *args, **options):
+        items, family_items = flush()
+        self.stdout.write(self.style.SUCCESS(
+            f'Flushed popularity for {items} items and {family_items} family items'
+        ))
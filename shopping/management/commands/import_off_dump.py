@@ -0,0 +1,36 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from shopping.off_dump import BATCH_SIZE, import_products, iter_products
+
+
+class Command(BaseCommand):
+    help = 'Import products from an Open Food Facts data dump (JSONL or CSV, optionally gzipped) into the local product mirror'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Path to the dump, e.g. openfoodfacts-products.jsonl.gz'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Products written per transaction (default: {BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            self.stdout.write(self.style.ERROR(f"Dump file not found: {path}"))
+            return
+
+        started = time.monotonic()
+        stats = import_products(iter_products(path), batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['created']} new and {stats['updated']} updated products "
+            f"({stats['unchanged']} unchanged, {stats['skipped']} without a barcode) in {elapsed:.1f}s"
+        ))
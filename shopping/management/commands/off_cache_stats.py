@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from shopping.food_api import CACHE_KINDS
+from shopping.off_cache import cache_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Show Open Food Facts cache hits, negative hits, stale hits, misses, entries stored and bytes written (shared across workers when REDIS_URL is set)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the counters after showing them'
+        )
+
+    def handle(self, *args, **options):
+        for kind, stats in cache_stats(CACHE_KINDS).items():
+            ratio = f"{stats['hit_ratio']:.1%}" if stats['hit_ratio'] is not None else 'n/a'
+            self.stdout.write(
+                f"{kind}: {stats['hit']} hits, {stats['negative_hit']} negative hits, "
+                f"{stats['stale']} stale, {stats['miss']} misses (hit ratio {ratio}); "
+                f"{stats['stored']} entries stored, {stats['bytes_written']} bytes written"
+            )
+
+        if options['reset']:
+            reset_stats(CACHE_KINDS)
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -1,14 +1,86 @@
 import json
+import os
+import threading
 import time
-import requests
 import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.conf import settings
-from shopping.models import GroceryItem, ProductCategory, GroceryStore, ItemStoreInfo
+from shopping.allergens import AllergenDetector
+from shopping.models import CheapestItemPrice, GroceryItem, ProductCategory, GroceryStore, ItemStoreInfo
+from shopping.off_client import get_client
 
 logger = logging.getLogger(__name__)
 
+SEARCH_URL = "https://world.openfoodfacts.org/cgi/search.pl"
+
+# Recorded search pages used by --dry-run
+SAMPLE_FIXTURE = os.path.join(settings.BASE_DIR, 'shopping', 'data', 'off_search_sample.json')
+
+# GroceryItem fields set from Open Food Facts. updated_at is set by hand because
+# bulk_update doesn't touch auto_now fields
+ITEM_FIELDS = [
+    'name', 'description', 'brand', 'image_url', 'off_id', 'is_verified', 'category', 'safety_flags', 'updated_at'
+]
+
+
+class RateLimiter:
+    """Spaces calls from any number of threads at least ``interval`` seconds apart"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next = 0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class Checkpoint:
+    """
+    Pages already imported per category, saved to a JSON file so an
+    interrupted run can resume. Without a path nothing is saved.
+    """
+
+    def __init__(self, path=None, resume=True):
+        self.path = path
+        self.data = {}
+        if path and resume and os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    def pages_to_fetch(self, key, pages):
+        """Pages out of 1..pages not imported yet and not past the last page"""
+        entry = self.data.get(key, {})
+        done = set(entry.get('pages', []))
+        last_page = entry.get('last_page') or pages
+        return [page for page in range(1, min(pages, last_page) + 1) if page not in done]
+
+    def page_done(self, key, page):
+        self.data.setdefault(key, {}).setdefault('pages', []).append(page)
+        self.save()
+
+    def last_page(self, key, page):
+        """Record that the results end at ``page``"""
+        self.data.setdefault(key, {})['last_page'] = page
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        # Write then rename so an interrupted run never leaves half a file
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+
 class Command(BaseCommand):
     help = 'Populates the database with products from Open Food Facts API'
 
@@ -38,7 +110,14 @@ class Command(BaseCommand):
             '--wait',
             type=float,
             default=1.0,
-            help='Wait time between API requests in seconds (default: 1.0)'
+            help='Minimum time between API requests in seconds, across all fetchers (default: 1.0)'
+        )
+        
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Number of pages fetched at the same time (default: 4)'
         )
         
         parser.add_argument(
@@ -52,14 +131,41 @@ class Command(BaseCommand):
             action='store_true',
             help='Update existing products instead of skipping them'
         )
+        
+        parser.add_argument(
+            '--checkpoint',
+            type=str,
+            default='populate_products.checkpoint.json',
+            help='File recording imported pages, so an interrupted run resumes where it stopped '
+                 '(default: populate_products.checkpoint.json)'
+        )
+        
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore the checkpoint file and import every page again'
+        )
+        
+        parser.add_argument(
+            '--fixture',
+            type=str,
+            help='Read search pages from a recorded JSON file ({category: [page, ...]}) instead of the API'
+        )
+        
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Benchmark the import against a recorded fixture (the bundled sample unless --fixture '
+                 'is given) and roll back every write'
+        )
 
     def handle(self, *args, **options):
         categories = options['categories']
         count_per_category = options['count']
         country = options['country']
-        wait_time = options['wait']
         store_slug = options['store']
         update_existing = options['update']
+        dry_run = options['dry_run']
         
         # Initialize store if specified
         store = None
@@ -71,39 +177,115 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR(f"Store with slug '{store_slug}' not found"))
                 return
         
-        # If no categories specified, use default common categories
+        fixture = None
+        fixture_path = options['fixture'] or (SAMPLE_FIXTURE if dry_run else None)
+        if fixture_path:
+            with open(fixture_path) as f:
+                fixture = json.load(f)
+            self.stdout.write(f"Reading search pages from {fixture_path}")
+        
+        # If no categories specified, use the fixture's or default common categories
         if not categories:
-            categories = [
+            categories = list(fixture) if fixture else [
                 'dairy', 'fruits', 'vegetables', 'meat', 'seafood',
                 'bakery', 'cereals', 'snacks', 'beverages', 'frozen-foods',
                 'canned-foods', 'condiments', 'spices', 'baking', 'pasta'
             ]
             self.stdout.write(f"Using default categories: {', '.join(categories)}")
         
-        # Process each category
-        for category in categories:
-            self.stdout.write(f"Processing category: {category}")
-            self._import_category_products(
-                category, 
-                count_per_category, 
-                country, 
-                wait_time, 
-                store, 
-                update_existing
-            )
-            
+        self.country = country
+        self.fixture = fixture
+        self.rate_limiter = RateLimiter(0 if fixture else options['wait'])
+        # Dry runs leave the checkpoint alone
+        self.checkpoint = Checkpoint(None if dry_run else options['checkpoint'], resume=not options['restart'])
+        
+        self.stats = {'pages': 0, 'imported': 0, 'updated': 0, 'skipped': 0, 'fetch_time': 0.0, 'write_time': 0.0}
+        started = time.monotonic()
+        
+        if dry_run:
+            with transaction.atomic():
+                self._import(categories, count_per_category, options['concurrency'], store, update_existing)
+                transaction.set_rollback(True)
+        else:
+            # Each page commits on its own so the checkpoint matches the database
+            self._import(categories, count_per_category, options['concurrency'], store, update_existing)
+        
+        self._report(time.monotonic() - started, dry_run)
         self.stdout.write(self.style.SUCCESS('Product import completed successfully'))
 
-    def _import_category_products(self, category, count, country, wait_time, store, update_existing):
-        """Import products for a specific category"""
-        
-        base_url = "https://world.openfoodfacts.org/cgi/search.pl"
+    def _import(self, categories, count, concurrency, store, update_existing):
+        """
+        Fetch search pages concurrently and write each page as it arrives.
         
+        Fetching happens on worker threads (rate limited, through the shared
+        OFF client); all database writes happen on this thread.
+        """
         # We'll need to paginate to get the requested count
         page_size = min(count, 100)  # Max page size is 100
+        if self.fixture:
+            # Recorded pages keep the size they were recorded with
+            page_size = max(
+                (len(recorded.get('products', [])) for recorded_pages in self.fixture.values() for recorded in recorded_pages),
+                default=page_size
+            )
         pages = (count + page_size - 1) // page_size
         
-        # Get or create category
+        tasks = []
+        category_objs = {}
+        for category in categories:
+            to_fetch = self.checkpoint.pages_to_fetch(self._checkpoint_key(category, page_size), pages)
+            if not to_fetch:
+                self.stdout.write(f"Skipping category {category}: already imported")
+                continue
+            
+            self.stdout.write(f"Processing category: {category}")
+            category_objs[category] = self._get_category(category)
+            tasks.extend((category, page) for page in to_fetch)
+        
+        exhausted = {}
+        pending = set()
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            tasks = iter(tasks)
+            while True:
+                # Keep at most `concurrency` pages in flight or waiting to be written
+                for category, page in tasks:
+                    if page > exhausted.get(category, pages):
+                        continue
+                    future = executor.submit(self._fetch_page, category, page, page_size)
+                    future.task = (category, page)
+                    pending.add(future)
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    break
+                
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    category, page = future.task
+                    try:
+                        products, elapsed = future.result()
+                    except Exception as e:
+                        self.stdout.write(self.style.ERROR(
+                            f"Error fetching page {page} of {category}: {str(e)}"
+                        ))
+                        logger.exception(f"Error in populate_products for {category}")
+                        continue
+                    
+                    self.stats['fetch_time'] += elapsed
+                    if not products:
+                        # Later pages of this category are empty too
+                        self.stdout.write(f"No products found for category {category} on page {page}")
+                        exhausted[category] = min(exhausted.get(category, pages), page - 1)
+                        self.checkpoint.last_page(self._checkpoint_key(category, page_size), exhausted[category])
+                        continue
+                    
+                    if self._write_page(category, page, products, category_objs[category], store, update_existing):
+                        self.checkpoint.page_done(self._checkpoint_key(category, page_size), page)
+
+    def _checkpoint_key(self, category, page_size):
+        return f"{self.country}/{category}/{page_size}"
+
+    def _get_category(self, category):
         category_obj, created = ProductCategory.objects.get_or_create(
             name=category.replace('-', ' ').title(),
             defaults={
@@ -114,14 +296,17 @@ class Command(BaseCommand):
         
         if created:
             self.stdout.write(f"Created new category: {category_obj.name}")
+        return category_obj
+
+    def _fetch_page(self, category, page, page_size):
+        """Fetch one page of search results; returns (products, seconds taken)"""
+        self.rate_limiter.wait()
+        started = time.monotonic()
         
-        # Track statistics
-        total_imported = 0
-        total_updated = 0
-        total_skipped = 0
-        
-        # Process each page
-        for page in range(1, pages + 1):
+        if self.fixture is not None:
+            recorded = self.fixture.get(category, [])
+            data = recorded[page - 1] if page <= len(recorded) else {}
+        else:
             params = {
                 'action': 'process',
                 'tagtype_0': 'categories',
@@ -129,117 +314,129 @@ class Command(BaseCommand):
                 'tag_0': category,
                 'tagtype_1': 'countries',
                 'tag_contains_1': 'contains',
-                'tag_1': country,
+                'tag_1': self.country,
                 'page_size': page_size,
                 'page': page,
                 'json': 1
             }
-            
-            try:
-                # Make API request
-                self.stdout.write(f"Fetching page {page} of {pages} for {category}")
-                response = requests.get(base_url, params=params)
-                
-                if response.status_code != 200:
-                    self.stdout.write(self.style.ERROR(
-                        f"Error fetching products: HTTP {response.status_code}"
-                    ))
-                    continue
-                
-                data = response.json()
-                products = data.get('products', [])
-                
-                if not products:
-                    self.stdout.write(f"No products found for category {category} on page {page}")
-                    break
-                
-                # Process products
-                for product in products:
-                    result = self._process_product(product, category_obj, store, update_existing)
-                    
-                    if result == 'imported':
-                        total_imported += 1
-                    elif result == 'updated':
-                        total_updated += 1
-                    else:  # skipped
-                        total_skipped += 1
-                
-                # Wait between requests to avoid rate limiting
-                time.sleep(wait_time)
-                
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f"Error processing category {category}: {str(e)}"))
-                logger.exception(f"Error in import_category_products for {category}")
-        
-        # Print summary
-        self.stdout.write(self.style.SUCCESS(
-            f"Category {category}: {total_imported} imported, {total_updated} updated, {total_skipped} skipped"
-        ))
+            data = get_client().get_json(SEARCH_URL, params=params, timeout=30) or {}
+        
+        return data.get('products', []), time.monotonic() - started
 
-    def _process_product(self, product, category, store, update_existing):
-        """Process a single product"""
+    def _write_page(self, category, page, products, category_obj, store, update_existing):
+        """Import one page of products with one lookup and bulk writes; returns whether it succeeded"""
+        from shopping.routes import invalidate_item_routes
+        from shopping.search import invalidate_item_index, update_search_vectors
         
-        # Extract product information
-        barcode = product.get('code', '')
-        name = product.get('product_name', '')
+        started = time.monotonic()
+        imported = updated = skipped = 0
         
-        # Skip products without barcode or name
-        if not barcode or not name:
-            return 'skipped'
+        # Skip products without barcode or name; a page can repeat a barcode
+        by_barcode = {}
+        for product in products:
+            barcode = str(product.get('code') or '')[:100]
+            if not barcode or not product.get('product_name'):
+                skipped += 1
+                continue
+            by_barcode[barcode] = product
         
-        # Check if product already exists
-        existing_product = GroceryItem.objects.filter(barcode=barcode).first()
+        existing = {}
+        for item in GroceryItem.objects.filter(barcode__in=by_barcode):
+            existing.setdefault(item.barcode, item)
         
-        # If product exists and we're not updating, skip it
-        if existing_product and not update_existing:
-            return 'skipped'
+        to_create, to_update = [], []
+        for barcode, product in by_barcode.items():
+            item = existing.get(barcode)
+            if item and not update_existing:
+                skipped += 1
+                continue
+            
+            product_data = self._item_data(product, category_obj)
+            if item:
+                for key, value in product_data.items():
+                    setattr(item, key, value)
+                to_update.append(item)
+            else:
+                to_create.append(GroceryItem(barcode=barcode, **product_data))
         
         try:
             with transaction.atomic():
-                # Prepare product data
-                product_data = {
-                    'name': name,
-                    'description': product.get('ingredients_text', ''),
-                    'brand': product.get('brands', ''),
-                    'image_url': product.get('image_url', ''),
-                    'off_id': product.get('id', ''),
-                    'is_verified': True,
-                    'category': category
-                }
-                
-                if existing_product and update_existing:
-                    # Update existing product
-                    for key, value in product_data.items():
-                        setattr(existing_product, key, value)
-                    
-                    existing_product.save()
-                    product_obj = existing_product
-                    result = 'updated'
-                else:
-                    # Create new product
-                    product_obj = GroceryItem.objects.create(
-                        barcode=barcode,
-                        **product_data
-                    )
-                    result = 'imported'
+                GroceryItem.objects.bulk_create(to_create)
+                GroceryItem.objects.bulk_update(to_update, ITEM_FIELDS)
+                items = to_create + to_update
                 
-                # If store is specified, create store info
-                if store and product_obj:
-                    # Get or create store info
-                    store_info, _ = ItemStoreInfo.objects.get_or_create(
-                        item=product_obj,
-                        store=store,
-                        defaults={
-                            'typical_price': self._extract_price(product),
-                        }
-                    )
-                
-                return result
+                # If store is specified, create missing store info
+                if store and items:
+                    linked = set(ItemStoreInfo.objects.filter(
+                        store=store, item__in=items
+                    ).values_list('item_id', flat=True))
+                    ItemStoreInfo.objects.bulk_create([
+                        ItemStoreInfo(
+                            item=item,
+                            store=store,
+                            typical_price=self._extract_price(by_barcode[item.barcode])
+                        )
+                        for item in items if item.id not in linked
+                    ])
+                    CheapestItemPrice.refresh(item_ids=[item.id for item in items], store_ids=[store.id])
                 
+                # Bulk writes skip the post_save signals that maintain search data and aisle routes
+                if items:
+                    update_search_vectors(GroceryItem.objects.filter(pk__in=[item.id for item in items]))
+                    transaction.on_commit(invalidate_item_index)
+                    if to_update:
+                        updated_ids = [item.id for item in to_update]
+                        transaction.on_commit(lambda: invalidate_item_routes(updated_ids))
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Error processing product {barcode}: {str(e)}"))
-            logger.exception(f"Error in _process_product for {barcode}")
-            return 'skipped'
+            self.stdout.write(self.style.ERROR(f"Error writing page {page} of {category}: {str(e)}"))
+            logger.exception(f"Error in populate_products for {category}")
+            return False
+        
+        imported += len(to_create)
+        updated += len(to_update)
+        
+        self.stats['pages'] += 1
+        self.stats['imported'] += imported
+        self.stats['updated'] += updated
+        self.stats['skipped'] += skipped
+        self.stats['write_time'] += time.monotonic() - started
+        
+        self.stdout.write(
+            f"Category {category} page {page}: {imported} imported, {updated} updated, {skipped} skipped"
+        )
+        return True
+
+    def _item_data(self, product, category):
+        """GroceryItem field values for an Open Food Facts product"""
+        from django.utils import timezone
+        
+        image_url = product.get('image_url') or ''
+        return {
+            'name': product.get('product_name', '')[:100],
+            'description': product.get('ingredients_text', ''),
+            'brand': (product.get('brands') or '')[:100],
+            'image_url': image_url if len(image_url) <= 200 else '',
+            'off_id': str(product.get('id') or '')[:100],
+            'is_verified': True,
+            'category': category,
+            'safety_flags': AllergenDetector.safety_flags({
+                'ingredients': product.get('ingredients_text'),
+                'allergens': product.get('allergens_tags'),
+            }),
+            'updated_at': timezone.now(),
+        }
+
+    def _report(self, elapsed, dry_run):
+        stats = self.stats
+        products = stats['imported'] + stats['updated'] + stats['skipped']
+        rate = products / elapsed if elapsed else 0
+        self.stdout.write(
+            f"{stats['pages']} pages, {products} products in {elapsed:.2f}s ({rate:.0f} products/s): "
+            f"{stats['imported']} imported, {stats['updated']} updated, {stats['skipped']} skipped; "
+            f"fetching {stats['fetch_time']:.2f}s, writing {stats['write_time']:.2f}s"
+        )
+        if dry_run:
+            self.stdout.write("Dry run: all changes rolled back")
 
     def _extract_price(self, product):
         """Extract price from product data if available"""
@@ -277,4 +474,4 @@ class Command(BaseCommand):
             'alcohol': 'wine'
         }
         
-        return icons.get(category.lower(), 'grocery')
\ No newline at end of file
+        return icons.get(category.lower(), 'grocery')
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from shopping.models import SyncChange
+
+
+class Command(BaseCommand):
+    help = 'Delete old offline sync change feed rows; devices with an older cursor get a full resync'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Keep changes from the last N days (default: 30)',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        latest = SyncChange.objects.order_by('-id').values_list('id', flat=True).first()
+
+        # The newest row always stays so expired cursors can still be detected
+        deleted, _ = SyncChange.objects.filter(created_at__lt=cutoff).exclude(pk=latest).delete()
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} sync changes older than {options["days"]} days'))
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from shopping.models import CheapestItemPrice
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-family cheapest item prices shown in the item catalogue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows read and written per batch (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = CheapestItemPrice.refresh(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} cheapest price rows in {elapsed:.1f}s'))
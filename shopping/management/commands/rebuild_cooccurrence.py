@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shopping.models import ItemCoOccurrence, ShoppingList
+
+
+class Command(BaseCommand):
+    help = 'Rebuild item co-purchase counts from completed shopping lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--family',
+            type=int,
+            help='Only rebuild counts for this family ID (global counts are left untouched)',
+        )
+
+    def handle(self, *args, **options):
+        lists = ShoppingList.objects.filter(completed=True)
+        family_id = options['family']
+
+        with transaction.atomic():
+            if family_id:
+                lists = lists.filter(family_id=family_id)
+                ItemCoOccurrence.objects.filter(family_id=family_id).delete()
+            else:
+                ItemCoOccurrence.objects.all().delete()
+
+            rebuilt = 0
+            for shopping_list in lists.iterator():
+                ItemCoOccurrence.record_list(shopping_list, include_global=not family_id)
+                rebuilt += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt co-purchase counts from {rebuilt} completed lists'))
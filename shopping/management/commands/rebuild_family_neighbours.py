@@ -0,0 +1,28 @@
+import time
+from django.core.management.base import BaseCommand
+from shopping.collaborative import DEFAULT_BATCH_SIZE, DEFAULT_NEIGHBOURS, rebuild_neighbours
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the nearest-neighbour family index used for collaborative recommendations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--neighbours',
+            type=int,
+            default=DEFAULT_NEIGHBOURS,
+            help=f'Number of neighbours to keep per family (default: {DEFAULT_NEIGHBOURS})'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f'Families per similarity block; lower uses less memory (default: {DEFAULT_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        written = rebuild_neighbours(k=options['neighbours'], batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} neighbour rows in {elapsed:.1f}s'))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shopping.models import ItemPurchaseCadence, ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Rebuild per-family item purchase cadence from the full completed-list history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--family',
+            type=int,
+            help='Only rebuild cadence for this family ID (default: all families)',
+        )
+
+    def handle(self, *args, **options):
+        purchases = ShoppingListItem.objects.filter(
+            shopping_list__completed=True,
+            shopping_list__completed_at__isnull=False
+        )
+        cadences = ItemPurchaseCadence.objects.all()
+        if options['family']:
+            purchases = purchases.filter(shopping_list__family_id=options['family'])
+            cadences = cadences.filter(family_id=options['family'])
+
+        # One ordered pass over the history: each (family, item) run is folded in date order
+        rows = purchases.order_by(
+            'shopping_list__family_id', 'item_id', 'shopping_list__completed_at'
+        ).values_list(
+            'shopping_list__family_id', 'item_id', 'shopping_list__completed_at'
+        ).iterator(chunk_size=5000)
+
+        rebuilt = ItemPurchaseCadence.from_history(rows)
+
+        with transaction.atomic():
+            cadences.delete()
+            ItemPurchaseCadence.objects.bulk_create(rebuilt, batch_size=1000)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt purchase cadence for {len(rebuilt)} family items'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from shopping.models import ShoppingList
+
+
+class Command(BaseCommand):
+    help = 'Recount stored item, checked and estimated cost counters on shopping lists and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--family',
+            type=int,
+            help='Only reconcile lists for this family ID (default: all families)',
+        )
+        parser.add_argument(
+            '--active-only',
+            action='store_true',
+            help='Skip completed lists',
+        )
+
+    def handle(self, *args, **options):
+        lists = ShoppingList.objects.all()
+        if options['family']:
+            lists = lists.filter(family_id=options['family'])
+        if options['active_only']:
+            lists = lists.filter(completed=False)
+
+        checked = 0
+        fixed = 0
+        for shopping_list in lists.iterator(chunk_size=500):
+            checked += 1
+            if shopping_list.refresh_counters():
+                fixed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} lists, fixed counters on {fixed}'))
@@ -0,0 +1,55 @@
+import logging
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction, DatabaseError
+from shopping import search
+from shopping.models import GroceryItem
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Create the item search indexes and backfill search vectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-backfill',
+            action='store_true',
+            help='Only create extensions and indexes, do not recompute search vectors',
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_postgres():
+            index = search.get_item_index()
+            self.stdout.write(self.style.SUCCESS(
+                f'{connection.vendor} database: using the in-memory index ({index.size} items)'
+            ))
+            return
+
+        table = GroceryItem._meta.db_table
+
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError as e:
+            logger.warning(f"Could not create pg_trgm extension: {str(e)}")
+            self.stdout.write(self.style.WARNING(
+                'pg_trgm is not available; search will use full-text matching only'
+            ))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {table}_search_vector_gin '
+                f'ON {table} USING gin (search_vector)'
+            )
+            search._trigram_available = None
+            if search.has_trigram_extension():
+                cursor.execute(
+                    f'CREATE INDEX IF NOT EXISTS {table}_name_trgm '
+                    f'ON {table} USING gin (name gin_trgm_ops)'
+                )
+        self.stdout.write('Search indexes are in place')
+
+        if not options['skip_backfill']:
+            updated = search.update_search_vectors()
+            self.stdout.write(self.style.SUCCESS(f'Updated search vectors for {updated} items'))
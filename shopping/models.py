@@ -1,8 +1,16 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, FilteredRelation, Max, Min, OuterRef, Q, Subquery
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.contrib.postgres.search import SearchVectorField
 from django.dispatch import receiver
 from django.utils.text import slugify
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from collections import Counter, namedtuple
+
+from .allergens import UNANALYSED
 
 class Family(models.Model):
     """Family group for sharing shopping lists"""
@@ -62,9 +70,54 @@ class UserProfile(models.Model):
     default_family = models.ForeignKey(Family, on_delete=models.SET_NULL, null=True, blank=True, related_name='default_for_users')
     dark_mode = models.BooleanField(default=False)
     show_categories = models.BooleanField(default=True, help_text="Show items grouped by categories in shopping lists")
+    
+    # Allergen and dietary preferences, stored as {'selected': [...]}
+    allergens = models.JSONField(default=dict, blank=True, help_text="User allergen preferences")
+    dietary_preferences = models.JSONField(default=dict, blank=True, help_text="User dietary preferences")
 
     def __str__(self):
         return f"Profile for {self.user.username}"
+    
+    def get_allergens(self):
+        """Get user's allergen preferences as a list"""
+        if isinstance(self.allergens, list):
+            return self.allergens
+        return self.allergens.get('selected', [])
+    
+    def set_allergens(self, allergen_list):
+        """Set user's allergen preferences"""
+        if not isinstance(self.allergens, dict):
+            self.allergens = {}
+        
+        self.allergens['selected'] = allergen_list
+        self.save(update_fields=['allergens'])
+    
+    def get_preferences(self):
+        """Get user's dietary preferences as a list"""
+        if isinstance(self.dietary_preferences, list):
+            return self.dietary_preferences
+        return self.dietary_preferences.get('selected', [])
+    
+    def set_preferences(self, preference_list):
+        """Set user's dietary preferences"""
+        if not isinstance(self.dietary_preferences, dict):
+            self.dietary_preferences = {}
+        
+        self.dietary_preferences['selected'] = preference_list
+        self.save(update_fields=['dietary_preferences'])
+    
+    def get_safety_mask(self):
+        """GroceryItem.safety_flags this user's allergens and diets rule out"""
+        from .allergens import AllergenDetector
+        return AllergenDetector.safety_mask(self.get_allergens(), self.get_preferences())
+    
+    @classmethod
+    def safety_mask_for(cls, user):
+        """The safety mask for a user, 0 when they have no profile"""
+        try:
+            return user.profile.get_safety_mask()
+        except cls.DoesNotExist:
+            return 0
 
 
 @receiver(post_save, sender=User)
@@ -128,6 +181,26 @@ class ProductCategory(models.Model):
         return self.name
 
 
+@receiver([post_save, post_delete], sender=StoreLocation)
+@receiver([post_save, post_delete], sender=ProductCategory)
+def invalidate_routes_on_layout_change(sender, instance, raw=False, **kwargs):
+    """Aisle orders and the category fallback both depend on these"""
+    if raw:
+        return
+    from .routes import invalidate_store_routes
+    # A category rename can move items at any store
+    invalidate_store_routes([instance.store_id] if sender is StoreLocation else None)
+
+
+@receiver([post_save, post_delete], sender=StoreLocation)
+def invalidate_location_table_on_change(sender, instance, raw=False, **kwargs):
+    """Category lookups at a store are matched against its locations"""
+    if raw:
+        return
+    from .store_utils import invalidate_location_table
+    invalidate_location_table(instance.store_id)
+
+
 class GroceryItem(models.Model):
     """Grocery items that can be added to shopping lists"""
     # Core fields
@@ -145,6 +218,15 @@ class GroceryItem(models.Model):
     image_url = models.URLField(blank=True, null=True)
     off_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     
+    # Detected allergen categories and diet conflicts, see shopping.allergens.
+    # Redetected on save when the name or description changes.
+    safety_flags = models.IntegerField(
+        default=UNANALYSED, help_text="Allergen and diet conflict bits detected from the ingredients"
+    )
+    
+    # Search fields (populated on PostgreSQL only, see shopping.search)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+    
     # Community fields
     is_verified = models.BooleanField(default=False)
     is_user_added = models.BooleanField(default=False)
@@ -159,22 +241,111 @@ class GroceryItem(models.Model):
     def __str__(self):
         return self.name
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        item = super().from_db(db, field_names, values)
+        # Remembered so a save can tell whether the flags need redetecting
+        item._loaded_text = (item.__dict__.get('name'), item.__dict__.get('description'))
+        return item
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        text = (self.__dict__.get('name'), self.__dict__.get('description'))
+        if self._state.adding:
+            # Flags given on creation (e.g. from Open Food Facts data) are kept
+            detect = self.safety_flags == UNANALYSED
+        else:
+            detect = text != getattr(self, '_loaded_text', None)
+            if update_fields is not None:
+                detect = detect and not {'name', 'description'}.isdisjoint(update_fields)
+        if detect:
+            product = None
+            if self.barcode:
+                product = OpenFoodFactsProduct.objects.filter(code=self.barcode).values_list('data', flat=True).first()
+            self.safety_flags = self.detect_safety_flags(product)
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['safety_flags']
+        super().save(*args, **kwargs)
+        self._loaded_text = text
+    
+    def detect_safety_flags(self, product=None):
+        """
+        Allergen and diet flags for this item.
+        
+        Args:
+            product: The item's product data from the Open Food Facts mirror,
+                if there is any; otherwise its own text is scanned
+        
+        Returns:
+            int: Value for safety_flags, UNANALYSED if there is nothing to scan
+        """
+        from .allergens import AllergenDetector
+        
+        if product is None:
+            # Imported items keep the OFF ingredients in the description;
+            # for items added by hand the name is often all there is
+            text = self.description if self.off_id else f"{self.name} {self.description or ''}"
+            product = {'ingredients': text}
+        return AllergenDetector.safety_flags(product)
+    
     def increment_popularity(self, family=None):
-        """Increment the popularity counter when item is added to a list"""
+        """
+        Increment the popularity counters right away.
+        
+        List saves buffer their increments through counters.record_item_added
+        instead; this is for callers that need the new value immediately.
+        """
+        from .counters import apply_increments
+        
+        family_counts = {(family.pk, self.pk): 1} if family else {}
+        apply_increments({self.pk: 1}, family_counts)
         self.global_popularity += 1
-        self.save(update_fields=['global_popularity'])
-        
-        if family:
-            # Also increment the family-specific counter
-            usage, created = FamilyItemUsage.objects.get_or_create(
-                family=family,
-                item=self,
-                defaults={'usage_count': 1}
-            )
-            
-            if not created:
-                usage.usage_count += 1
-                usage.save(update_fields=['usage_count'])
+
+
+# Fields that feed the search vector and the in-memory search index
+SEARCHABLE_ITEM_FIELDS = {'name', 'brand', 'description', 'category', 'category_id'}
+
+
+@receiver(post_save, sender=GroceryItem)
+def refresh_item_search_data(sender, instance, update_fields=None, **kwargs):
+    """Keep the search vector and in-memory index in step with item text"""
+    if update_fields and not SEARCHABLE_ITEM_FIELDS.intersection(update_fields):
+        return
+    
+    from .search import invalidate_item_index, update_search_vectors
+    update_search_vectors(GroceryItem.objects.filter(pk=instance.pk))
+    invalidate_item_index()
+
+
+@receiver(post_delete, sender=GroceryItem)
+def drop_item_search_data(sender, instance, **kwargs):
+    from .search import invalidate_item_index
+    invalidate_item_index()
+
+
+@receiver(post_save, sender=GroceryItem)
+def invalidate_routes_on_category_change(sender, instance, update_fields=None, raw=False, **kwargs):
+    """An item's category decides its aisle when the store has no location for it"""
+    if raw or (update_fields and 'category' not in update_fields and 'category_id' not in update_fields):
+        return
+    from .routes import invalidate_item_routes
+    invalidate_item_routes([instance.pk])
+
+
+class OpenFoodFactsProduct(models.Model):
+    """
+    Local mirror of Open Food Facts products, imported from the OFF data dump
+    (see the import_off_dump command) so barcode lookups don't need the API.
+    """
+    code = models.CharField(max_length=100, primary_key=True)
+    last_modified = models.BigIntegerField(
+        default=0, help_text="OFF last_modified_t of the imported version"
+    )
+    data = models.JSONField(help_text="Normalized product data, as returned by OpenFoodFactsAPI.get_product")
+    imported_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.code} {self.data.get('name') or ''}".strip()
 
 
 class FamilyItemUsage(models.Model):
@@ -193,7 +364,16 @@ class FamilyItemUsage(models.Model):
 
 
 class ItemStoreInfo(models.Model):
-    """Association between grocery items and stores, with additional data"""
+    """Association between grocery items and stores, with additional data.
+    
+    The price statistics are running aggregates over the item's
+    PriceObservation rows at the store, folded in by add_price as prices
+    are recorded, so reading them never touches the history. Only replacing
+    or removing an observation rebuilds them from it (rebuild_prices).
+    """
+    EWMA_ALPHA = Decimal('0.3')
+    RECENT_PRICES = 20
+    
     item = models.ForeignKey(GroceryItem, on_delete=models.CASCADE, related_name='store_info')
     store = models.ForeignKey(GroceryStore, on_delete=models.CASCADE)
     location = models.ForeignKey(StoreLocation, on_delete=models.SET_NULL, null=True, blank=True)
@@ -202,12 +382,349 @@ class ItemStoreInfo(models.Model):
     last_purchased = models.DateTimeField(null=True, blank=True)
     average_price = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     
+    # Price statistics, see add_price
+    price_count = models.IntegerField(default=0, help_text="Number of prices observed")
+    price_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    min_price = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    ewma_price = models.DecimalField(
+        max_digits=10, decimal_places=4, null=True, blank=True, help_text="Exponentially smoothed price"
+    )
+    recent_prices = models.JSONField(default=list, blank=True, help_text="The last RECENT_PRICES prices, oldest first")
+    
+    PRICE_FIELDS = [
+        'last_price', 'last_purchased', 'average_price', 'price_count', 'price_total',
+        'min_price', 'max_price', 'ewma_price', 'recent_prices',
+    ]
+    
     class Meta:
         unique_together = ('item', 'store')
         verbose_name_plural = 'Item Store Info'
     
     def __str__(self):
         return f"{self.item.name} at {self.store.name}"
+    
+    def add_price(self, price, observed_at):
+        """Fold a new price observation into the running statistics"""
+        price = Decimal(str(price))
+        
+        self.price_count += 1
+        self.price_total += price
+        self.average_price = (self.price_total / self.price_count).quantize(Decimal('0.01'))
+        self.min_price = price if self.min_price is None else min(self.min_price, price)
+        self.max_price = price if self.max_price is None else max(self.max_price, price)
+        if self.ewma_price is None:
+            self.ewma_price = price
+        else:
+            self.ewma_price = (
+                self.EWMA_ALPHA * price + (1 - self.EWMA_ALPHA) * self.ewma_price
+            ).quantize(Decimal('0.0001'))
+        self.recent_prices = (list(self.recent_prices or []) + [str(price)])[-self.RECENT_PRICES:]
+        
+        # Replayed history can arrive out of order; the latest one is the last price
+        if self.last_purchased is None or observed_at >= self.last_purchased:
+            self.last_price = price
+            self.last_purchased = observed_at
+    
+    def price_percentile(self, percent):
+        """Percentile (0-100) of the recent prices, linearly interpolated"""
+        prices = sorted(Decimal(price) for price in self.recent_prices or [])
+        if not prices:
+            return None
+        
+        rank = (len(prices) - 1) * Decimal(percent) / 100
+        lower = int(rank)
+        upper = min(lower + 1, len(prices) - 1)
+        return (prices[lower] + (prices[upper] - prices[lower]) * (rank - lower)).quantize(Decimal('0.01'))
+    
+    @property
+    def median_price(self):
+        return self.price_percentile(50)
+    
+    def rebuild_prices(self):
+        """Recompute the price statistics from the item's PriceObservation rows"""
+        stats = ItemStoreInfo()
+        for price, observed_at in PriceObservation.objects.filter(
+            store_id=self.store_id, item_id=self.item_id
+        ).order_by('observed_at', 'id').values_list('price', 'observed_at'):
+            stats.add_price(price, observed_at)
+        for field in self.PRICE_FIELDS:
+            setattr(self, field, getattr(stats, field))
+    
+    @classmethod
+    def record_prices(cls, store_id, prices, observed_at=None, list_item_ids=None):
+        """
+        Record paid prices ({item_id: price}) at a store.
+        
+        Appends a PriceObservation per price and folds it into the item's
+        statistics, creating missing rows. A price from a list item replaces
+        the one recorded for it before, and a price of None (the list item's
+        price was cleared) just removes it; the statistics of the items
+        affected are then recomputed from their remaining history.
+        
+        Args:
+            store_id: The store the prices were paid at
+            prices: {item_id: price or None}
+            observed_at: When the prices were paid (default: now)
+            list_item_ids: Optional {item_id: ShoppingListItem id} the
+                prices came from
+        
+        Returns:
+            The ItemStoreInfo rows that had to be created
+        """
+        observed_at = observed_at or timezone.now()
+        list_item_ids = list_item_ids or {}
+        paid = {item_id: Decimal(str(price)) for item_id, price in prices.items() if price is not None}
+        
+        with transaction.atomic():
+            infos = {
+                (info.store_id, info.item_id): info
+                for info in cls.objects.select_for_update().filter(store_id=store_id, item_id__in=list(paid))
+            }
+            missing = [item_id for item_id in paid if (store_id, item_id) not in infos]
+            created = []
+            if missing:
+                # Rows another request creates meanwhile are skipped here and locked below
+                cls.objects.bulk_create(
+                    [cls(item_id=item_id, store_id=store_id) for item_id in missing], ignore_conflicts=True
+                )
+                created = list(cls.objects.select_for_update().filter(store_id=store_id, item_id__in=missing))
+                infos.update({(info.store_id, info.item_id): info for info in created})
+            
+            # Prices entered on these list items before are replaced
+            replaced = PriceObservation.objects.filter(
+                list_item_id__in=[list_item_ids[item_id] for item_id in prices if item_id in list_item_ids]
+            )
+            rebuild = set(replaced.values_list('store_id', 'item_id'))
+            # Cleared prices, or ones entered before the list's store changed
+            unlocked = rebuild - set(infos)
+            if unlocked:
+                for info in cls.objects.select_for_update().filter(
+                    store_id__in={store for store, _ in unlocked}, item_id__in={item_id for _, item_id in unlocked}
+                ):
+                    if (info.store_id, info.item_id) in unlocked:
+                        infos[(info.store_id, info.item_id)] = info
+            replaced.delete()
+            
+            PriceObservation.objects.bulk_create([
+                PriceObservation(
+                    store_id=store_id,
+                    item_id=item_id,
+                    price=price,
+                    observed_at=observed_at,
+                    list_item_id=list_item_ids.get(item_id),
+                )
+                for item_id, price in paid.items()
+            ])
+            for key, info in infos.items():
+                if key in rebuild:
+                    info.rebuild_prices()
+                elif key[1] in paid:
+                    info.add_price(paid[key[1]], observed_at)
+            if infos:
+                cls.objects.bulk_update(infos.values(), cls.PRICE_FIELDS)
+                # Bulk writes skip the post_save signal that maintains the cheapest prices
+                CheapestItemPrice.refresh(
+                    item_ids=list({item_id for _, item_id in infos}),
+                    store_ids=list({store for store, _ in infos})
+                )
+        
+        return created
+
+
+class PriceObservation(models.Model):
+    """
+    A price paid for an item at a store. A price entered on a list item is
+    replaced when it is entered again and removed when it is cleared.
+    """
+    store = models.ForeignKey(GroceryStore, on_delete=models.CASCADE, related_name='price_observations')
+    item = models.ForeignKey(GroceryItem, on_delete=models.CASCADE, related_name='price_observations')
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+    observed_at = models.DateTimeField(default=timezone.now)
+    list_item = models.ForeignKey(
+        'ShoppingListItem', on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+        help_text="The list item the price was entered on, if any"
+    )
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['store', 'item', 'observed_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.item_id} at store {self.store_id}: {self.price} on {self.observed_at:%Y-%m-%d}"
+
+
+class CheapestItemPrice(models.Model):
+    """The lowest known price of an item across one family's stores.
+    
+    A store's price is its typical price, falling back to the last and then
+    the average price paid. Rows are rebuilt by refresh() whenever store
+    prices or a family's stores change, so the item catalogue reads prices
+    with one indexed lookup instead of ranking ItemStoreInfo rows per item.
+    """
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='+')
+    item = models.ForeignKey(GroceryItem, on_delete=models.CASCADE, related_name='cheapest_prices')
+    store = models.ForeignKey(GroceryStore, on_delete=models.CASCADE, related_name='+')
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+    
+    class Meta:
+        unique_together = ('family', 'item')
+    
+    def __str__(self):
+        return f"{self.item_id} for family {self.family_id}: {self.price} at store {self.store_id}"
+    
+    @classmethod
+    def refresh(cls, item_ids=None, store_ids=None, family_ids=None, batch_size=5000):
+        """
+        Recompute the cheapest prices in a scope; with no arguments, rebuild everything.
+        
+        Args:
+            item_ids: Only these items
+            store_ids: Only the families these stores belong to
+            family_ids: Only these families
+            batch_size: Rows written per INSERT
+        
+        Returns:
+            The number of rows written
+        """
+        from django.db.models.functions import Coalesce
+        
+        links = GroceryStore.families.through.objects.all()
+        if store_ids is not None:
+            links = links.filter(family__stores__in=store_ids)
+        if family_ids is not None:
+            links = links.filter(family_id__in=family_ids)
+        
+        store_families = {}
+        for store_id, family_id in links.values_list('grocerystore_id', 'family_id').distinct():
+            store_families.setdefault(store_id, []).append(family_id)
+        scope_families = {family_id for families in store_families.values() for family_id in families}
+        if family_ids is not None:
+            # Families left without any stores still need their old rows cleared
+            scope_families.update(family_ids)
+        
+        prices = ItemStoreInfo.objects.filter(
+            store_id__in=list(store_families)
+        ).annotate(
+            effective_price=Coalesce(*EFFECTIVE_PRICE_FIELDS)
+        ).filter(effective_price__isnull=False)
+        if item_ids is not None:
+            prices = prices.filter(item_id__in=item_ids)
+        
+        with transaction.atomic():
+            # Refreshes sharing a family would both delete its rows and then
+            # insert the same ones; locking the families (in pk order, so two
+            # refreshes can't deadlock) makes them take turns
+            list(Family.objects.select_for_update().filter(
+                id__in=scope_families
+            ).order_by('pk').values_list('pk', flat=True))
+            
+            stale = cls.objects.filter(family_id__in=scope_families)
+            if item_ids is not None:
+                stale = stale.filter(item_id__in=item_ids)
+            stale.delete()
+            
+            written = 0
+            batch = {}
+            current_item = None
+            rows = prices.order_by('item_id').values_list(
+                'item_id', 'store_id', 'effective_price'
+            ).iterator(chunk_size=batch_size)
+            for item_id, store_id, price in rows:
+                # Only flush between items, so each item's stores are all compared
+                if item_id != current_item and len(batch) >= batch_size:
+                    written += len(cls.objects.bulk_create(batch.values()))
+                    batch = {}
+                current_item = item_id
+                
+                for family_id in store_families[store_id]:
+                    best = batch.get((family_id, item_id))
+                    if best is None or (price, store_id) < (best.price, best.store_id):
+                        batch[(family_id, item_id)] = cls(
+                            family_id=family_id, item_id=item_id, store_id=store_id, price=price
+                        )
+            if batch:
+                written += len(cls.objects.bulk_create(batch.values()))
+        
+        # Every store price change comes through here, so cached baskets
+        # priced at these stores or for these families are stale too
+        from .basket import invalidate_basket_prices
+        if store_ids is None and family_ids is None:
+            invalidate_basket_prices()
+        else:
+            invalidate_basket_prices(family_ids=scope_families, store_ids=store_ids or ())
+        
+        return written
+    
+    @classmethod
+    def for_items(cls, family_ids, item_ids):
+        """The cheapest row per item ({item_id: row}) across the given families"""
+        cheapest = {}
+        for row in cls.objects.filter(
+            family_id__in=family_ids, item_id__in=item_ids
+        ).select_related('store').order_by('price', 'store_id'):
+            cheapest.setdefault(row.item_id, row)
+        return cheapest
+
+
+# A store's price for an item, in order of preference
+EFFECTIVE_PRICE_FIELDS = ('typical_price', 'last_price', 'average_price')
+
+
+@receiver(post_save, sender=ItemStoreInfo)
+def refresh_cheapest_price(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and not set(EFFECTIVE_PRICE_FIELDS).intersection(update_fields)):
+        return
+    if created and all(getattr(instance, field) is None for field in EFFECTIVE_PRICE_FIELDS):
+        return
+    CheapestItemPrice.refresh(item_ids=[instance.item_id], store_ids=[instance.store_id])
+
+
+@receiver(post_save, sender=ItemStoreInfo)
+@receiver(post_delete, sender=ItemStoreInfo)
+def invalidate_routes_on_location_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and 'location' not in update_fields and 'location_id' not in update_fields):
+        return
+    from .routes import invalidate_store_routes
+    invalidate_store_routes([instance.store_id])
+
+
+@receiver(post_delete, sender=ItemStoreInfo)
+def refresh_cheapest_price_on_delete(sender, instance, origin=None, **kwargs):
+    # Deleting a store or item takes its rows with it; those deletes are handled once, below
+    if getattr(origin, 'model', type(origin)) in (GroceryStore, GroceryItem):
+        return
+    CheapestItemPrice.refresh(item_ids=[instance.item_id], store_ids=[instance.store_id])
+
+
+@receiver(m2m_changed, sender=GroceryStore.families.through)
+def refresh_cheapest_prices_on_store_link(sender, instance, action, reverse, pk_set, **kwargs):
+    """Linking or unlinking stores changes which prices a family sees"""
+    if reverse:
+        family_ids = [instance.pk]
+    elif action == 'pre_clear':
+        instance._linked_family_ids = list(instance.families.values_list('pk', flat=True))
+        return
+    elif action == 'post_clear':
+        family_ids = getattr(instance, '_linked_family_ids', [])
+    else:
+        family_ids = pk_set
+
+    if action in ('post_add', 'post_remove', 'post_clear') and family_ids:
+        CheapestItemPrice.refresh(family_ids=family_ids)
+
+
+@receiver(pre_delete, sender=GroceryStore)
+def remember_store_families(sender, instance, **kwargs):
+    instance._linked_family_ids = list(instance.families.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=GroceryStore)
+def refresh_cheapest_prices_on_store_deleted(sender, instance, **kwargs):
+    family_ids = getattr(instance, '_linked_family_ids', [])
+    if family_ids:
+        CheapestItemPrice.refresh(family_ids=family_ids)
 
 
 class ShoppingList(models.Model):
@@ -221,50 +738,440 @@ class ShoppingList(models.Model):
     completed = models.BooleanField(default=False)
     completed_at = models.DateTimeField(null=True, blank=True)
     
+    # Maintained by ShoppingListItem saves/deletes; see reconcile_list_counters
+    item_count = models.IntegerField(default=0, editable=False)
+    checked_count = models.IntegerField(default=0, editable=False)
+    estimated_total = models.DecimalField(
+        max_digits=10, decimal_places=2, default=Decimal('0'), editable=False,
+        help_text="Sum of each item's actual (or typical store) price times quantity"
+    )
+    version = models.IntegerField(default=0, editable=False, help_text="Bumped on every change to the list's items")
+    
+    COUNTER_FIELDS = ('item_count', 'checked_count', 'estimated_total')
+    MAINTAINED_FIELDS = COUNTER_FIELDS + ('version',)
+    
     class Meta:
         ordering = ['-created_at']
     
     def __str__(self):
         return f"{self.name} - {self.store.name} ({self.created_at.strftime('%Y-%m-%d')})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        shopping_list = super().from_db(db, field_names, values)
+        # Remembered so a save can tell whether it completes the list
+        shopping_list._loaded_completed = shopping_list.__dict__.get('completed')
+        return shopping_list
+    
+    def save(self, *args, **kwargs):
+        # Counters are only written with F() updates, so a stale copy of the
+        # list must not overwrite them when it is saved
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
+        # Read by post_save receivers that only care about the list being completed
+        self.just_completed = self.completed and not getattr(self, '_loaded_completed', False)
+        super().save(*args, **kwargs)
+        self._loaded_completed = self.completed
+    
     @property
     def total_items(self):
-        return self.items.count()
+        return self.item_count
     
     @property
     def checked_items(self):
-        return self.items.filter(checked=True).count()
+        return self.checked_count
     
     @property
     def progress_percentage(self):
-        if self.total_items == 0:
+        if self.item_count <= 0:
             return 0
-        return int((self.checked_items / self.total_items) * 100)
+        return int((self.checked_count / self.item_count) * 100)
+    
+    @classmethod
+    def adjust_counters(cls, list_id, items=0, checked=0, cost=Decimal('0')):
+        """Atomically apply deltas to a list's stored counters and bump its version"""
+        changes = {'version': F('version') + 1}
+        if items:
+            changes['item_count'] = F('item_count') + items
+        if checked:
+            changes['checked_count'] = F('checked_count') + checked
+        if cost:
+            changes['estimated_total'] = F('estimated_total') + cost
+        cls.objects.filter(pk=list_id).update(**changes)
+    
+    def count_items(self):
+        """Recount the counter values from the list's items"""
+        typical_price = Subquery(
+            ItemStoreInfo.objects.filter(
+                item=OuterRef('item_id'), store_id=self.store_id
+            ).values('typical_price')[:1]
+        )
+        rows = self.items.order_by().annotate(
+            typical_price=typical_price
+        ).values_list('checked', 'quantity', 'actual_price', 'typical_price')
+        
+        counts = {'item_count': 0, 'checked_count': 0, 'estimated_total': Decimal('0')}
+        for checked, quantity, actual_price, typical_price in rows:
+            counts['item_count'] += 1
+            counts['checked_count'] += int(checked)
+            counts['estimated_total'] += ShoppingListItem.line_cost(
+                quantity, actual_price if actual_price is not None else typical_price
+            )
+        return counts
+    
+    def refresh_counters(self):
+        """
+        Rewrite the stored counters from a fresh count.
+        
+        Returns:
+            True if the stored values had drifted
+        """
+        with transaction.atomic():
+            stored = ShoppingList.objects.select_for_update().filter(
+                pk=self.pk
+            ).values(*self.COUNTER_FIELDS).first()
+            counts = self.count_items()
+            drifted = stored != counts
+            if drifted:
+                ShoppingList.objects.filter(pk=self.pk).update(**counts)
+        
+        for field, value in counts.items():
+            setattr(self, field, value)
+        return drifted
     
-    def duplicate(self, new_name=None):
+    def load_detail_items(self):
+        """
+        Load this list's items for display in a single query.
+        
+        Each item gets ``current_store_info`` set to its ItemStoreInfo (with
+        location) at this list's store, or None, and ``route_location_name``
+        set to the aisle it is shopped in, which falls back to the one its
+        category maps to. Items are in walk order (see routes.walk_order):
+        unchecked first, then by aisle, then by their position on the list.
+        """
+        from .routes import store_route, walk_order
+        
+        items = list(self.items.annotate(
+            current_info=FilteredRelation(
+                'item__store_info',
+                condition=Q(item__store_info__store_id=self.store_id)
+            )
+        ).select_related(
+            'item', 'item__category', 'current_info', 'current_info__location'
+        ))
+        
+        for list_item in items:
+            # Django only sets the filtered relation when a row matched
+            list_item.current_store_info = getattr(list_item, 'current_info', None)
+        
+        order = walk_order(self, [
+            (
+                list_item.id,
+                list_item.checked,
+                list_item.sort_order,
+                list_item.item.name,
+                list_item.item.category.name if list_item.item.category else None,
+                list_item.current_store_info.location_id if list_item.current_store_info else None,
+            )
+            for list_item in items
+        ])
+        
+        route = store_route(self.store_id)
+        positions = {line_id: (position, location_id) for position, (line_id, location_id) in enumerate(order)}
+        for list_item in items:
+            location_id = positions.get(list_item.id, (None, None))[1]
+            list_item.route_location_name = route[location_id][1] if location_id in route else None
+        
+        items.sort(key=lambda list_item: positions.get(list_item.id, (len(positions),))[0])
+        return items
+    
+    def set_completed(self, completed):
+        """
+        Complete or reopen the list and save it, along with anything else
+        changed on it.
+        
+        Completing a list feeds its items into the co-purchase counts and
+        purchase cadences; reopening takes them back out until it is
+        completed again. Every way of completing a list goes through here.
+        """
+        was_completed = self.completed
+        if completed != was_completed:
+            self.completed = completed
+            self.completed_at = timezone.now() if completed else None
+        self.save()
+        
+        if completed and not was_completed:
+            ItemCoOccurrence.record_list(self)
+            ItemPurchaseCadence.record_list(self)
+        elif was_completed and not completed:
+            ItemCoOccurrence.record_list(self, delta=-1)
+            ItemPurchaseCadence.remove_list(self)
+    
+    def duplicate(self, new_name=None, created_by=None):
         """Create a duplicate of this list"""
         if not new_name:
             new_name = f"Copy of {self.name}"
         
-        new_list = ShoppingList.objects.create(
-            name=new_name,
-            store=self.store,
-            family=self.family,
-            created_by=self.created_by
+        with transaction.atomic():
+            new_list = ShoppingList.objects.create(
+                name=new_name,
+                store=self.store,
+                family=self.family,
+                created_by=created_by or self.created_by
+            )
+            new_list.copy_items_from(self)
+        
+        return new_list
+    
+    def copy_items_from(self, source):
+        """
+        Append every item of another list to this one in a single bulk insert.
+        
+        Copies are unchecked and unpriced. The list counters, the family's
+        popularity counts and its recommendation staleness are updated once
+        for the whole batch, since bulk_create skips ShoppingListItem.save()
+        and its signals.
+        
+        Returns:
+            The number of items copied
+        """
+        from .counters import record_items_added
+        from .sync import ITEM_MODEL, record_changes
+        
+        rows = list(source.items.order_by('sort_order', 'pk').values(
+            'item_id', 'quantity', 'unit', 'note', 'sort_order'
+        ))
+        if not rows:
+            return 0
+        
+        typical_prices = dict(ItemStoreInfo.objects.filter(
+            store_id=self.store_id, item_id__in={row['item_id'] for row in rows}
+        ).values_list('item_id', 'typical_price'))
+        estimated_cost = sum(
+            (ShoppingListItem.line_cost(row['quantity'], typical_prices.get(row['item_id'])) for row in rows),
+            Decimal('0')
         )
         
-        # Copy all items to the new list
-        for item in self.items.all():
-            ShoppingListItem.objects.create(
-                shopping_list=new_list,
-                item=item.item,
-                quantity=item.quantity,
-                unit=item.unit,
-                note=item.note,
-                sort_order=item.sort_order
+        with transaction.atomic():
+            copies = ShoppingListItem.objects.bulk_create(
+                [ShoppingListItem(shopping_list=self, **row) for row in rows],
+                batch_size=500
             )
+            ShoppingList.adjust_counters(self.pk, items=len(rows), cost=estimated_cost)
+            record_changes(ITEM_MODEL, self.family_id, [(copy.pk, self.pk) for copy in copies])
+            record_items_added(Counter(row['item_id'] for row in rows), self.family_id)
+            FamilyRecommendation.objects.filter(family_id=self.family_id).update(is_stale=True)
         
-        return new_list
+        self.item_count += len(rows)
+        self.estimated_total += estimated_cost
+        self.version += 1
+        return len(rows)
+    
+    # Op name -> the ShoppingListItem field it writes
+    ITEM_OPS = {
+        'toggle': 'checked',
+        'reorder': 'sort_order',
+        'quantity': 'quantity',
+        'price': 'actual_price',
+        'note': 'note',
+        'unit': 'unit',
+    }
+    
+    def apply_item_ops(self, ops):
+        """
+        Apply a batch of item edits in one transaction.
+        
+        Each op is a dict with ``op`` and the list item ``id``:
+        
+        - ``toggle``: optional ``checked``; without it the item is flipped.
+          Checked items move to the bottom and unchecked ones to the top,
+          as in ToggleListItemView.
+        - ``reorder``: ``sort_order``
+        - ``quantity``: ``quantity``
+        - ``price``: ``price`` (null clears it); also recorded on the
+          item's store info as in UpdateListItemPriceView
+        - ``note`` / ``unit``: ``note`` / ``unit``
+        
+        Edits replayed from another device carry the ``clock`` they were
+        made at (see shopping.hlc) and only land if they are newer than the
+        field's last write, so a batch merges the same way whatever order
+        its ops arrive in. Toggles with a clock need an explicit
+        ``checked`` and leave the item where it is.
+        
+        Ops are applied in order, the touched items are written with one
+        bulk_update and the list counters and version are updated once (not
+        at all when no item changed).
+        
+        Returns:
+            List of the changed ShoppingListItems
+        
+        Raises:
+            ValueError: If an op is malformed or names an item not on this list
+        """
+        from .hlc import supersedes
+        from .sync import ITEM_MODEL, record_changes
+        
+        parsed = [self._parse_item_op(op) for op in ops]
+        if not parsed:
+            return []
+        
+        with transaction.atomic():
+            # Serialise batches for the same list
+            ShoppingList.objects.select_for_update().filter(pk=self.pk).values_list('pk').first()
+            
+            item_ids = {item_id for _, item_id, _, _ in parsed}
+            items = self.items.in_bulk(item_ids)
+            missing = item_ids - set(items)
+            if missing:
+                raise ValueError(f"Items not on this list: {sorted(missing)}")
+            
+            bounds = self.items.aggregate(
+                max_sort=Max('sort_order'),
+                min_unchecked_sort=Min('sort_order', filter=Q(checked=False))
+            )
+            max_sort = bounds['max_sort'] or 0
+            min_sort = bounds['min_unchecked_sort'] or 0
+            
+            before = {item_id: item._counter_state() for item_id, item in items.items()}
+            fields = set()
+            touched = set()
+            prices = {}
+            price_items = {}
+            
+            for kind, item_id, value, clock in parsed:
+                item = items[item_id]
+                field = self.ITEM_OPS[kind]
+                if kind == 'toggle' and value is None:
+                    value = not item.checked
+                
+                if clock is not None:
+                    if not supersedes(clock, value, item.field_clock(field), getattr(item, field)):
+                        continue
+                elif kind == 'toggle' and item.checked == value:
+                    continue
+                
+                if kind == 'toggle' and clock is None:
+                    if value:
+                        max_sort += 100
+                        item.sort_order = max_sort
+                    else:
+                        min_sort -= 10
+                        item.sort_order = min_sort
+                    item.stamp_fields(['sort_order'])
+                    fields.add('sort_order')
+                
+                setattr(item, field, value)
+                item.stamp_fields([field], clock)
+                fields.update([field, 'field_clocks'])
+                if kind == 'price':
+                    prices[item.item_id] = value
+                    price_items[item.item_id] = item.pk
+                touched.add(item_id)
+            
+            changed = [items[item_id] for item_id in sorted(touched)]
+            if changed:
+                ShoppingListItem.objects.bulk_update(changed, sorted(fields))
+            
+            # A batch that changed nothing (e.g. every op was superseded) leaves the version alone
+            if changed:
+                checked_delta = sum(
+                    int(item.checked) - int(before[item.pk].checked) for item in changed
+                )
+                cost_delta = self._cost_delta(
+                    [(before[item.pk], item._counter_state()) for item in changed]
+                )
+                ShoppingList.adjust_counters(self.pk, checked=checked_delta, cost=cost_delta)
+            
+            if prices:
+                ItemStoreInfo.record_prices(self.store_id, prices, list_item_ids=price_items)
+            
+            record_changes(ITEM_MODEL, self.family_id, [(item.pk, self.pk) for item in changed])
+            
+            for item in changed:
+                item._counted_state = item._counter_state()
+                item._merge_values = item._merge_state()
+            
+            stored = ShoppingList.objects.values(*self.MAINTAINED_FIELDS).get(pk=self.pk)
+            for field, value in stored.items():
+                setattr(self, field, value)
+        
+        return changed
+    
+    def _parse_item_op(self, op):
+        """Validate one op for apply_item_ops and return (kind, item_id, value, clock)"""
+        from .hlc import Timestamp, server_clock
+        
+        if not isinstance(op, dict) or op.get('op') not in self.ITEM_OPS:
+            raise ValueError(f"Unknown operation: {op!r}")
+        kind = op['op']
+        
+        try:
+            item_id = int(op['id'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"Operation needs an item id: {op!r}")
+        
+        clock = None
+        if op.get('clock'):
+            clock = Timestamp.parse(op['clock'])
+            # Keeps this server's own writes ordered after every clock it has seen
+            server_clock().observe(clock)
+        
+        try:
+            if kind == 'toggle':
+                value = None if op.get('checked') is None else bool(op['checked'])
+                if value is None and clock is not None:
+                    raise ValueError
+            elif kind == 'reorder':
+                value = int(op['sort_order'])
+            elif kind == 'quantity':
+                value = Decimal(str(op['quantity']))
+                if not value.is_finite() or value <= 0:
+                    raise ValueError
+                value = self._fit_decimal_field(kind, value)
+            elif kind == 'price':
+                value = None if op.get('price') is None else Decimal(str(op['price']))
+                if value is not None:
+                    if not value.is_finite() or value < 0:
+                        raise ValueError
+                    value = self._fit_decimal_field(kind, value)
+            else:
+                value = str(op.get(kind) or '')
+                if kind == 'unit' and len(value) > 20:
+                    raise ValueError
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            raise ValueError(f"Invalid value for {kind}: {op!r}")
+        
+        return kind, item_id, value, clock
+    
+    def _fit_decimal_field(self, kind, value):
+        """Round an op's value to its item field, raising ValueError if it doesn't fit"""
+        field = ShoppingListItem._meta.get_field(self.ITEM_OPS[kind])
+        value = value.quantize(Decimal(1).scaleb(-field.decimal_places))
+        if value >= 10 ** (field.max_digits - field.decimal_places):
+            raise ValueError
+        return value
+    
+    def _cost_delta(self, state_changes):
+        """Change in estimated total for a set of (old, new) item counter states"""
+        cost_changes = [(old, new) for old, new in state_changes if old[:4] != new[:4]]
+        if not cost_changes:
+            return Decimal('0')
+        
+        typical_prices = dict(ItemStoreInfo.objects.filter(
+            store_id=self.store_id,
+            item_id__in={state.item_id for pair in cost_changes for state in pair}
+        ).values_list('item_id', 'typical_price'))
+        
+        def cost(state):
+            price = state.actual_price
+            if price is None:
+                price = typical_prices.get(state.item_id)
+            return ShoppingListItem.line_cost(state.quantity, price)
+        
+        return sum((cost(new) - cost(old) for old, new in cost_changes), Decimal('0'))
 
 
 class ShoppingListItem(models.Model):
@@ -278,21 +1185,446 @@ class ShoppingListItem(models.Model):
     note = models.TextField(blank=True, null=True)
     sort_order = models.IntegerField(default=0)
     
+    # Clock of the last write to each of MERGE_FIELDS; see shopping.hlc
+    field_clocks = models.JSONField(default=dict, blank=True, editable=False)
+    
+    MERGE_FIELDS = ('checked', 'quantity', 'actual_price', 'note', 'unit', 'sort_order')
+    
     class Meta:
         ordering = ['checked', 'sort_order']
     
+    # Values this row currently contributes to its list's counters
+    _counted_state = None
+    # MERGE_FIELDS values as last loaded or saved
+    _merge_values = None
+    
     def __str__(self):
         return f"{self.item.name} ({self.quantity})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields():
+            instance._counted_state = instance._counter_state()
+            instance._merge_values = instance._merge_state()
+        return instance
+    
+    @staticmethod
+    def line_cost(quantity, unit_price):
+        """Estimated cost of a list line, rounded to cents"""
+        if unit_price is None or quantity is None:
+            return Decimal('0')
+        cost = Decimal(str(unit_price)) * Decimal(str(quantity))
+        return cost.quantize(Decimal('0.01'))
+    
+    def field_clock(self, field):
+        """Clock of the last write to a field, or None if it has none"""
+        from .hlc import Timestamp
+        
+        value = (self.field_clocks or {}).get(field)
+        return Timestamp.parse(value) if value else None
+    
+    def stamp_fields(self, fields, clock=None):
+        """
+        Record that fields were written at ``clock``; by default, now on this
+        server and after whatever last wrote them.
+        """
+        from .hlc import server_clock
+        
+        if self.field_clocks is None:
+            self.field_clocks = {}
+        for field in fields:
+            stamp = clock
+            if stamp is None:
+                current = self.field_clock(field)
+                stamp = server_clock().observe(current) if current else server_clock().now()
+            self.field_clocks[field] = str(stamp)
+    
+    def _merge_state(self):
+        return {field: getattr(self, field) for field in self.MERGE_FIELDS}
+    
+    def _counter_state(self):
+        return ListItemCounterState(
+            self.shopping_list_id, self.item_id, self.quantity, self.actual_price, bool(self.checked)
+        )
+    
+    def _estimated_cost(self, state):
+        unit_price = state.actual_price
+        if unit_price is None:
+            unit_price = ItemStoreInfo.objects.filter(
+                item_id=state.item_id, store__lists__id=state.list_id
+            ).values_list('typical_price', flat=True).first()
+        return self.line_cost(state.quantity, unit_price)
+    
+    def _update_list_counters(self, old, new):
+        """
+        Move this row's contribution to the list counters from ``old`` to
+        ``new`` and bump the version of every list involved.
+        """
+        # Cost only needs recomputing when something it depends on changed
+        cost_changed = old is None or new is None or old[:4] != new[:4]
+        deltas = {}
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            items, checked, cost = deltas.get(state.list_id, (0, 0, Decimal('0')))
+            if cost_changed:
+                cost += sign * self._estimated_cost(state)
+            deltas[state.list_id] = (items + sign, checked + sign * int(state.checked), cost)
+        
+        for list_id, (items, checked, cost) in deltas.items():
+            ShoppingList.adjust_counters(list_id, items=items, checked=checked, cost=cost)
+            
+            # Keep an already loaded list object in step with the database
+            if self._meta.get_field('shopping_list').is_cached(self) and self.shopping_list.pk == list_id:
+                self.shopping_list.item_count += items
+                self.shopping_list.checked_count += checked
+                self.shopping_list.estimated_total += cost
+                self.shopping_list.version += 1
+    
     def save(self, *args, **kwargs):
-        # Increment item popularity for this family
         is_new = self.pk is None
         
-        # Only increment on creation, not update
-        if is_new and self.shopping_list.family:
-            self.item.increment_popularity(family=self.shopping_list.family)
+        # Direct edits are stamped so older offline edits can't undo them
+        if not is_new and self._merge_values is not None:
+            update_fields = kwargs.get('update_fields')
+            edited = [
+                field for field in self.MERGE_FIELDS
+                if getattr(self, field) != self._merge_values[field]
+                and (update_fields is None or field in update_fields)
+            ]
+            if edited:
+                self.stamp_fields(edited)
+                if update_fields is not None:
+                    kwargs['update_fields'] = list(update_fields) + ['field_clocks']
         
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Increment item popularity for this family, only on creation and
+            # only once the insert has succeeded
+            if is_new and self.shopping_list.family_id:
+                from .counters import record_item_added
+                record_item_added(self.item_id, self.shopping_list.family_id)
+            
+            new_state = self._counter_state()
+            if is_new or self._counted_state is not None:
+                self._update_list_counters(None if is_new else self._counted_state, new_state)
+            else:
+                # Loaded with deferred fields, so the old values are unknown
+                self.shopping_list.refresh_counters()
+                ShoppingList.adjust_counters(self.shopping_list_id)
+            self._counted_state = new_state
+            self._merge_values = self._merge_state()
+
+
+ListItemCounterState = namedtuple(
+    'ListItemCounterState', ['list_id', 'item_id', 'quantity', 'actual_price', 'checked']
+)
+
+
+@receiver(post_delete, sender=ShoppingListItem)
+def release_list_counters(sender, instance, origin=None, **kwargs):
+    """Take a deleted item out of its list's counters"""
+    # Nothing to update when the whole list is being deleted
+    if isinstance(origin, ShoppingList) or getattr(origin, 'model', None) is ShoppingList:
+        return
+    
+    state = instance._counted_state or instance._counter_state()
+    instance._update_list_counters(state, None)
+
+
+@receiver(post_save, sender=ShoppingList)
+def record_list_saved(sender, instance, raw=False, **kwargs):
+    """Add a saved list to the offline sync change feed"""
+    if not raw:
+        from .sync import LIST_MODEL, record_changes
+        record_changes(LIST_MODEL, instance.family_id, [(instance.pk, instance.pk)])
+
+
+@receiver(post_delete, sender=ShoppingList)
+def record_list_deleted(sender, instance, **kwargs):
+    """Leave a tombstone for a deleted list; its items go with it"""
+    from .sync import LIST_MODEL, record_changes
+    record_changes(LIST_MODEL, instance.family_id, [(instance.pk, instance.pk)], deleted=True)
+
+
+@receiver(post_save, sender=ShoppingListItem)
+def record_list_item_saved(sender, instance, raw=False, **kwargs):
+    """Add a saved list item to the offline sync change feed"""
+    if not raw:
+        from .sync import ITEM_MODEL, record_changes
+        record_changes(
+            ITEM_MODEL, instance.shopping_list.family_id, [(instance.pk, instance.shopping_list_id)]
+        )
+
+
+@receiver(post_delete, sender=ShoppingListItem)
+def record_list_item_deleted(sender, instance, origin=None, **kwargs):
+    """Leave a tombstone for a deleted list item"""
+    # The list's own tombstone covers its items
+    if isinstance(origin, ShoppingList) or getattr(origin, 'model', None) is ShoppingList:
+        return
+    
+    from .sync import ITEM_MODEL, record_changes
+    if sender._meta.get_field('shopping_list').is_cached(instance):
+        family_id = instance.shopping_list.family_id
+    else:
+        family_id = ShoppingList.objects.filter(
+            pk=instance.shopping_list_id
+        ).values_list('family_id', flat=True).first()
+    record_changes(ITEM_MODEL, family_id, [(instance.pk, instance.shopping_list_id)], deleted=True)
+
+
+class FamilyRecommendation(models.Model):
+    """Precomputed, ranked recommendations for a family (optionally per store)"""
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='recommendations')
+    store = models.ForeignKey(GroceryStore, on_delete=models.CASCADE, null=True, blank=True, related_name='family_recommendations')
+    item_ids = models.JSONField(default=list, help_text="Ranked GroceryItem IDs")
+    computed_at = models.DateTimeField(auto_now=True)
+    is_stale = models.BooleanField(default=False, help_text="Set when new purchase history makes this row outdated")
+    
+    class Meta:
+        unique_together = ('family', 'store')
+    
+    def __str__(self):
+        store_name = self.store.name if self.store else 'all stores'
+        return f"Recommendations for {self.family.name} ({store_name})"
+
+
+@receiver(post_save, sender=ShoppingListItem)
+def mark_recommendations_stale_on_item_added(sender, instance, created, **kwargs):
+    """New list items change the family's history, so its recommendations need a refresh"""
+    if created:
+        FamilyRecommendation.objects.filter(
+            family_id=instance.shopping_list.family_id
+        ).update(is_stale=True)
+
+
+@receiver(post_save, sender=ShoppingList)
+def mark_recommendations_stale_on_list_completed(sender, instance, raw=False, **kwargs):
+    """Completing a list feeds the replenishment model, so refresh the family's recommendations"""
+    if not raw and getattr(instance, 'just_completed', False):
+        FamilyRecommendation.objects.filter(family_id=instance.family_id).update(is_stale=True)
+
+
+class ItemCoOccurrence(models.Model):
+    """How often two items were bought on the same completed list.
+
+    Rows are stored in both directions so that the co-purchase score for a
+    set of items is a single indexed SUM over ``item``. Rows with no family
+    hold the global counts across all families.
+    """
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, null=True, blank=True, related_name='item_cooccurrences')
+    item = models.ForeignKey(GroceryItem, on_delete=models.CASCADE, related_name='+')
+    other_item = models.ForeignKey(GroceryItem, on_delete=models.CASCADE, related_name='+')
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('family', 'item', 'other_item')
+        constraints = [
+            # NULLs are distinct in unique_together, so the global rows need their own
+            models.UniqueConstraint(
+                fields=['item', 'other_item'], condition=Q(family__isnull=True),
+                name='unique_global_cooccurrence'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['family', 'item']),
+        ]
+    
+    def __str__(self):
+        return f"{self.item_id} with {self.other_item_id}: {self.count}"
+    
+    @classmethod
+    def record_list(cls, shopping_list, delta=1, include_global=True):
+        """Add (or with a negative delta, remove) a list's item pairs to the family and global counts"""
+        item_ids = sorted(set(shopping_list.items.values_list('item_id', flat=True)))
+        if len(item_ids) < 2:
+            return
+        
+        # Sorted, like the rows locked below, so lists sharing pairs (and every
+        # list shares the global rows) take them in the same order and can't deadlock
+        pairs = [(a, b) for a in item_ids for b in item_ids if a != b]
+        
+        with transaction.atomic():
+            scopes = (shopping_list.family_id, None) if include_global else (shopping_list.family_id,)
+            for family_id in scopes:
+                if delta > 0:
+                    # Make sure every pair has a row before locking them, so a list
+                    # completed at the same time with a new pair can't insert it too
+                    cls.objects.bulk_create(
+                        [cls(family_id=family_id, item_id=a, other_item_id=b, count=0) for a, b in pairs],
+                        batch_size=500,
+                        ignore_conflicts=True
+                    )
+                
+                rows = list(cls.objects.select_for_update().filter(
+                    family_id=family_id,
+                    item_id__in=item_ids,
+                    other_item_id__in=item_ids
+                ).order_by('pk'))
+                for row in rows:
+                    row.count = max(row.count + delta, 0)
+                
+                cls.objects.bulk_update(rows, ['count'], batch_size=500)
+
+
+class FamilyNeighbour(models.Model):
+    """Precomputed nearest-neighbour families by cosine similarity of item usage"""
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='neighbours')
+    neighbour = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='+')
+    similarity = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('family', 'neighbour')
+        ordering = ['family', '-similarity']
+    
+    def __str__(self):
+        return f"{self.family_id} ~ {self.neighbour_id} ({self.similarity:.3f})"
+
+
+class ItemPurchaseCadence(models.Model):
+    """Per-family purchase rhythm for an item, used for replenishment suggestions.
+
+    ``next_due`` is when the item should be suggested again: the last
+    purchase plus REPLENISH_THRESHOLD of the smoothed interval. Once it
+    is MAX_OVERDUE_CYCLES intervals past that (``overdue_until``) the family
+    has evidently stopped buying it, and it is no longer suggested.
+    """
+    EWMA_ALPHA = 0.3
+    REPLENISH_THRESHOLD = 0.8
+    MAX_OVERDUE_CYCLES = 3
+    
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='purchase_cadences')
+    item = models.ForeignKey(GroceryItem, on_delete=models.CASCADE, related_name='purchase_cadences')
+    last_purchased = models.DateTimeField()
+    purchase_count = models.IntegerField(default=1)
+    ewma_interval_days = models.FloatField(null=True, blank=True, help_text="Smoothed days between purchases")
+    next_due = models.DateTimeField(null=True, blank=True)
+    overdue_until = models.DateTimeField(null=True, blank=True, help_text="Suggested until this long overdue")
+    
+    class Meta:
+        unique_together = ('family', 'item')
+        indexes = [
+            models.Index(fields=['family', 'next_due']),
+        ]
+    
+    def __str__(self):
+        return f"{self.item_id} for family {self.family_id}, due {self.next_due}"
+    
+    def add_purchase(self, purchased_at):
+        """Fold a new purchase into the smoothed interval"""
+        interval_days = (purchased_at - self.last_purchased).total_seconds() / 86400
+        
+        # Repeat purchases on the same day (or replayed history) aren't a new cycle
+        if interval_days < 1:
+            return False
+        
+        if self.ewma_interval_days is None:
+            self.ewma_interval_days = interval_days
+        else:
+            self.ewma_interval_days = (
+                self.EWMA_ALPHA * interval_days + (1 - self.EWMA_ALPHA) * self.ewma_interval_days
+            )
+        
+        self.last_purchased = purchased_at
+        self.purchase_count += 1
+        self.next_due = purchased_at + timedelta(days=self.ewma_interval_days * self.REPLENISH_THRESHOLD)
+        self.overdue_until = self.next_due + timedelta(days=self.ewma_interval_days * self.MAX_OVERDUE_CYCLES)
+        return True
+    
+    @classmethod
+    def from_history(cls, purchases):
+        """
+        Build cadences by replaying purchases.
+        
+        Args:
+            purchases: (family_id, item_id, purchased_at) tuples ordered by
+                family, item and purchase time
+            
+        Returns:
+            List of unsaved ItemPurchaseCadence, one per (family, item)
+        """
+        cadences = []
+        current = None
+        for family_id, item_id, purchased_at in purchases:
+            if current is None or (current.family_id, current.item_id) != (family_id, item_id):
+                current = cls(family_id=family_id, item_id=item_id, last_purchased=purchased_at)
+                cadences.append(current)
+            else:
+                current.add_purchase(purchased_at)
+        return cadences
+    
+    @classmethod
+    def record_list(cls, shopping_list):
+        """Update the cadence of every item on a completed list"""
+        purchased_at = shopping_list.completed_at
+        item_ids = set(shopping_list.items.values_list('item_id', flat=True))
+        if not purchased_at or not item_ids:
+            return
+        
+        with transaction.atomic():
+            # Items bought for the first time start their cadence here. Rows another
+            # list created meanwhile are left alone and get this purchase folded in below
+            cls.objects.bulk_create(
+                [
+                    cls(family_id=shopping_list.family_id, item_id=item_id, last_purchased=purchased_at)
+                    for item_id in item_ids
+                ],
+                batch_size=500,
+                ignore_conflicts=True
+            )
+            
+            # Rows starting at this purchase are a zero interval, which add_purchase skips
+            to_update = [
+                cadence for cadence in cls.objects.select_for_update().filter(
+                    family_id=shopping_list.family_id,
+                    item_id__in=item_ids
+                )
+                if cadence.add_purchase(purchased_at)
+            ]
+            
+            cls.objects.bulk_update(
+                to_update,
+                ['last_purchased', 'purchase_count', 'ewma_interval_days', 'next_due', 'overdue_until'],
+                batch_size=500
+            )
+    
+    @classmethod
+    def remove_list(cls, shopping_list):
+        """
+        Take a reopened list's purchases back out of its items' cadence.
+        
+        The smoothed interval can't be unwound one purchase at a time, so
+        the items' cadence is replayed from the family's other completed lists.
+        """
+        item_ids = set(shopping_list.items.values_list('item_id', flat=True))
+        if not item_ids:
+            return
+        
+        history = ShoppingListItem.objects.filter(
+            shopping_list__family_id=shopping_list.family_id,
+            shopping_list__completed=True,
+            shopping_list__completed_at__isnull=False,
+            item_id__in=item_ids
+        ).exclude(
+            shopping_list_id=shopping_list.pk
+        ).order_by(
+            'item_id', 'shopping_list__completed_at'
+        ).values_list('shopping_list__family_id', 'item_id', 'shopping_list__completed_at')
+        
+        with transaction.atomic():
+            cadences = cls.objects.select_for_update().filter(
+                family_id=shopping_list.family_id,
+                item_id__in=item_ids
+            )
+            # Lock the rows so a list completed meanwhile waits for the replay
+            list(cadences)
+            rebuilt = cls.from_history(history)
+            cadences.delete()
+            cls.objects.bulk_create(rebuilt, batch_size=500)
 
 
 class SyncLog(models.Model):
@@ -311,9 +1643,49 @@ class SyncLog(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     synced = models.BooleanField(default=False)
     synced_at = models.DateTimeField(null=True, blank=True)
+    op_id = models.CharField(
+        max_length=64, null=True, blank=True,
+        help_text="Client-generated ID; a replayed op with the same ID is not applied twice"
+    )
     
     class Meta:
         ordering = ['timestamp']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'op_id'], name='unique_sync_op_per_user'),
+        ]
+    
+    def __str__(self):
+        return f"{self.operation} {self.model_name} #{self.record_id} by {self.user.username}"
+
+class SyncChange(models.Model):
+    """
+    Append-only feed of shopping list and list item changes for offline sync.
+    
+    The primary key is the sync cursor: a device that has seen every change up
+    to ``id`` only needs the rows changed after it. See shopping.sync.
+    """
+    MODEL_CHOICES = [
+        ('shopping_list', 'Shopping list'),
+        ('shopping_list_item', 'Shopping list item'),
+    ]
+    
+    # No database constraint so tombstones can outlive their family
+    family = models.ForeignKey(
+        Family, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    model_name = models.CharField(max_length=50, choices=MODEL_CHOICES)
+    record_id = models.IntegerField()
+    list_id = models.IntegerField(help_text="The list itself, or the list an item belongs to")
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['family', 'id']),
+            models.Index(fields=['list_id', 'id']),
+        ]
     
     def __str__(self):
-        return f"{self.operation} {self.model_name} #{self.record_id} by {self.user.username}"
\ No newline at end of file
+        action = 'deleted' if self.deleted else 'changed'
+        return f"#{self.id} {self.model_name} {self.record_id} {action}"
@@ -0,0 +1,152 @@
+"""
+ShopSmart Open Food Facts Lookup Cache
+
+Caching for OFF lookups (products by barcode, searches and categories):
+
+- Keys are SHA-1 digests of the lookup's parameters, so every worker (and
+  every restart) computes the same key for the same lookup and a shared Redis
+  cache is actually shared.
+- Lookups that found nothing are cached too ("negative caching"), for a
+  shorter time than hits, so scanning an unknown store-brand barcode doesn't
+  go to OFF every time. Failed requests are never cached.
+- Entries outlive their freshness by a stale window. A stale entry is still
+  served straight away while a background thread refreshes it, and only one
+  refresh per key runs across all workers.
+- Hits, negative hits, stale hits, misses, entries stored and bytes written
+  are counted in the cache (shared between workers with Redis) so the cache
+  can be sized; see the off_cache_stats command. Bytes written is a running
+  total, not the cache's current size: entries that expire or are
+  overwritten are not subtracted.
+"""
+
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'off:'
+METRICS_PREFIX = 'off:metrics:'
+
+OUTCOMES = ('hit', 'negative_hit', 'stale', 'miss', 'stored', 'bytes_written')
+
+# Longest a background refresh of a key may take before another can start
+REFRESH_LOCK_TIMEOUT = 60
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='off-refresh')
+
+
+def negative_timeout():
+    return getattr(settings, 'OFF_NEGATIVE_CACHE_TIMEOUT', 60 * 60)
+
+
+def stale_timeout():
+    return getattr(settings, 'OFF_STALE_TIMEOUT', 60 * 60 * 24 * 7)
+
+
+def digest_key(kind, *parts):
+    """Stable cache key for a lookup of ``kind`` with the given parameters"""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return f'{KEY_PREFIX}{kind}:{hashlib.sha1(payload.encode()).hexdigest()}'
+
+
+def record(kind, outcome, amount=1):
+    """Count a cache outcome; metrics must never break a lookup"""
+    key = f'{METRICS_PREFIX}{kind}:{outcome}'
+    try:
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.add(key, 0, timeout=None)
+            cache.incr(key, amount)
+    except Exception as e:
+        logger.debug(f"Error recording OFF cache metric {key}: {str(e)}")
+
+
+class LookupCache:
+    """
+    Cache for one kind of OFF lookup.
+
+    ``fetch`` callables return the value to cache (None for "not found") and
+    raise on failure, so failures are never cached.
+    """
+
+    def __init__(self, kind, timeout):
+        self.kind = kind
+        self.timeout = timeout
+
+    def key(self, *parts):
+        return digest_key(self.kind, *parts)
+
+    def peek(self, key, fetch):
+        """
+        Cached value for a key, refreshing it in the background if stale.
+
+        Returns:
+            (found, value): found is False on a miss
+        """
+        entry = cache.get(key)
+        if entry is None:
+            record(self.kind, 'miss')
+            return False, None
+
+        if entry['fresh_until'] > time.time():
+            record(self.kind, 'hit' if entry['value'] is not None else 'negative_hit')
+        else:
+            record(self.kind, 'stale')
+            self.refresh_later(key, fetch)
+        return True, entry['value']
+
+    def store(self, key, value):
+        fresh_for = self.timeout if value is not None else negative_timeout()
+        entry = {'value': value, 'fresh_until': time.time() + fresh_for}
+        cache.set(key, entry, fresh_for + stale_timeout())
+
+        record(self.kind, 'stored')
+        record(self.kind, 'bytes_written', len(json.dumps(value, default=str)))
+
+    def get_or_fetch(self, key, fetch):
+        found, value = self.peek(key, fetch)
+        if found:
+            return value
+        value = fetch()
+        self.store(key, value)
+        return value
+
+    def refresh_later(self, key, fetch):
+        # Only one worker refreshes a key; the others keep serving it stale
+        if cache.add(f'{key}:refreshing', 1, REFRESH_LOCK_TIMEOUT):
+            _executor.submit(self._refresh, key, fetch)
+
+    def _refresh(self, key, fetch):
+        try:
+            self.store(key, fetch())
+        except Exception as e:
+            # Keep serving the stale entry until a refresh succeeds
+            logger.warning(f"Error refreshing OFF cache entry {key}: {str(e)}")
+        finally:
+            cache.delete(f'{key}:refreshing')
+
+
+def cache_stats(kinds):
+    """Counted outcomes per lookup kind, with the hit ratio"""
+    keys = [f'{METRICS_PREFIX}{kind}:{outcome}' for kind in kinds for outcome in OUTCOMES]
+    counts = cache.get_many(keys)
+
+    stats = {}
+    for kind in kinds:
+        kind_stats = {outcome: counts.get(f'{METRICS_PREFIX}{kind}:{outcome}', 0) for outcome in OUTCOMES}
+        lookups = sum(kind_stats[outcome] for outcome in ('hit', 'negative_hit', 'stale', 'miss'))
+        served = lookups - kind_stats['miss']
+        kind_stats['hit_ratio'] = served / lookups if lookups else None
+        stats[kind] = kind_stats
+    return stats
+
+
+def reset_stats(kinds):
+    cache.delete_many([f'{METRICS_PREFIX}{kind}:{outcome}' for kind in kinds for outcome in OUTCOMES])
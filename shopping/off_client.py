@@ -0,0 +1,262 @@
+"""
+ShopSmart Open Food Facts HTTP Client
+
+Every request to Open Food Facts goes through one shared client, so an OFF
+slowdown or outage can't tie up the workers serving everything else:
+
+- A pooled requests.Session keeps connections to OFF alive between calls
+  instead of opening a new one (and doing a TLS handshake) per lookup.
+- Every request has a connect and a read timeout.
+- At most OPENFOODFACTS_MAX_CONNECTIONS requests are in flight per host.
+  Callers that can't get a slot quickly fail fast rather than queueing.
+- Concurrent lookups of the same barcode are coalesced: one request is made
+  and everyone waiting gets its result.
+- A circuit breaker stops calling OFF after OPENFOODFACTS_CIRCUIT_FAILURES
+  consecutive failures, failing immediately until
+  OPENFOODFACTS_CIRCUIT_RESET seconds have passed, then lets one trial
+  request through to see if it has recovered.
+
+Async callers (ASGI views) use the ``a``-prefixed methods, which run the same
+pooled, limited and coalesced requests in worker threads.
+
+Failures are raised as OpenFoodFactsUnavailable, a RequestException, so
+callers handle them like any other request error.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = 'https://world.openfoodfacts.org/api/v0'
+
+# Seconds to wait for a connection to OFF to open
+CONNECT_TIMEOUT = 3.05
+
+# Seconds to wait for a free per-host slot before giving up
+SLOT_TIMEOUT = 1
+
+
+def user_agent():
+    return getattr(settings, 'OPENFOODFACTS_USER_AGENT', 'ShopSmart - Django Shopping App')
+
+
+def max_connections():
+    return getattr(settings, 'OPENFOODFACTS_MAX_CONNECTIONS', 10)
+
+
+def circuit_failures():
+    return getattr(settings, 'OPENFOODFACTS_CIRCUIT_FAILURES', 5)
+
+
+def circuit_reset():
+    return getattr(settings, 'OPENFOODFACTS_CIRCUIT_RESET', 30)
+
+
+class OpenFoodFactsUnavailable(requests.exceptions.RequestException):
+    """OFF can't be reached right now (circuit open or host busy)"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker"""
+
+    def __init__(self, failure_threshold, reset_timeout, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Whether a request may be made now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            # Once the reset timeout has passed, let a single trial request through
+            if not self._trial_running and self.clock() - self._opened_at >= self.reset_timeout:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def cancel_trial(self):
+        """Let another trial through if one ended without an outcome"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Open Food Facts circuit opened after %s failures", self._failures)
+                self._opened_at = self.clock()
+                self._trial_running = False
+
+
+class _Call:
+    """A request in flight that other callers can wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class OpenFoodFactsClient:
+    """Pooled, rate limited and circuit broken HTTP access to Open Food Facts"""
+
+    def __init__(self, max_per_host=None, breaker=None):
+        self.max_per_host = max_per_host or max_connections()
+        self.breaker = breaker or CircuitBreaker(circuit_failures(), circuit_reset())
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_per_host)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._in_flight = {}
+        self._async_in_flight = {}
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_slots[host]
+
+    def get_json(self, url, params=None, timeout=10):
+        """
+        GET a JSON document from OFF.
+
+        Args:
+            url: Absolute URL
+            params: Optional query parameters
+            timeout: Seconds to wait for the response once connected
+
+        Returns:
+            The decoded JSON, or None if OFF answered 404
+
+        Raises:
+            OpenFoodFactsUnavailable: If the circuit is open or the host is busy
+            requests.exceptions.RequestException: If the request fails
+        """
+        slot = self._host_slot(url)
+        if not slot.acquire(timeout=SLOT_TIMEOUT):
+            # Not a failure of OFF itself, so the breaker isn't told
+            raise OpenFoodFactsUnavailable("Too many concurrent requests to Open Food Facts")
+
+        try:
+            # Asked only once a slot is held, so a trial request always gets made
+            if not self.breaker.allow():
+                raise OpenFoodFactsUnavailable("Open Food Facts is unavailable (circuit open)")
+            try:
+                response = self.session.get(url, params=params, timeout=(CONNECT_TIMEOUT, timeout))
+                if response.status_code == 404:
+                    self.breaker.record_success()
+                    return None
+                response.raise_for_status()
+                data = response.json()
+            except (requests.exceptions.RequestException, ValueError):
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # Says nothing about OFF, but a trial must not stay running forever
+                self.breaker.cancel_trial()
+                raise
+        finally:
+            slot.release()
+
+        self.breaker.record_success()
+        return data
+
+    def coalesce(self, key, func):
+        """Call func(), sharing the result with concurrent calls for the same key"""
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+
+        if not leader:
+            # The leader's request is bounded by its timeouts
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def fetch_product(self, barcode, timeout=5):
+        """
+        Raw product lookup response for a barcode.
+
+        Returns:
+            dict: The API response, or None if OFF doesn't know the barcode
+        """
+        url = f'{BASE_URL}/product/{barcode}.json'
+        return self.coalesce(('product', barcode), lambda: self.get_json(url, timeout=timeout))
+
+    async def aget_json(self, url, params=None, timeout=10):
+        """Async get_json"""
+        return await sync_to_async(self.get_json, thread_sensitive=False)(url, params, timeout)
+
+    async def afetch_product(self, barcode, timeout=5):
+        """Async fetch_product; concurrent awaits of a barcode share one request"""
+        loop = asyncio.get_running_loop()
+        key = (loop, barcode)
+        task = self._async_in_flight.get(key)
+        if task is None:
+            task = loop.create_task(
+                sync_to_async(self.fetch_product, thread_sensitive=False)(barcode, timeout)
+            )
+            self._async_in_flight[key] = task
+            task.add_done_callback(lambda _: self._async_in_flight.pop(key, None))
+        # Shielded so one cancelled caller doesn't cancel the others' lookup
+        return await asyncio.shield(task)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide client"""
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenFoodFactsClient()
+    return _client
@@ -0,0 +1,163 @@
+"""
+ShopSmart Open Food Facts Dump Import
+
+Loads products from the Open Food Facts bulk data dump into the local
+OpenFoodFactsProduct mirror, so OpenFoodFactsAPI.get_product can answer
+barcode lookups without calling the API.
+
+Both dump formats are supported, plain or gzipped:
+- JSONL (openfoodfacts-products.jsonl.gz): one product document per line,
+  in the same shape as the API returns.
+- CSV (en.openfoodfacts.org.products.csv.gz): tab separated, with list
+  fields comma separated and nutriments in ``*_100g`` columns.
+
+The dump is read one line at a time and written in batches, so memory use
+doesn't depend on the dump's size. Products whose last_modified_t is no
+newer than the imported copy are skipped, so re-running the import with a
+fresher dump only writes what changed.
+"""
+
+import csv
+import gzip
+import json
+import logging
+import sys
+
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+# CSV columns holding comma separated lists
+CSV_LIST_FIELDS = ('categories_tags', 'allergens_tags', 'ingredients_analysis_tags')
+
+
+def open_dump(path):
+    """Open a dump file as text, decompressing .gz files on the fly"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def product_from_csv_row(row):
+    """Turn a CSV dump row into a product document like the API's"""
+    product = {field: value for field, value in row.items() if field and value not in (None, '')}
+
+    # Recent dumps name the allergen column "allergens"
+    if 'allergens' in product and 'allergens_tags' not in product:
+        product['allergens_tags'] = product.pop('allergens')
+
+    for field in CSV_LIST_FIELDS:
+        if field in product:
+            product[field] = [tag.strip() for tag in product[field].split(',') if tag.strip()]
+    if 'categories_tags' in product:
+        product['categories_hierarchy'] = product['categories_tags']
+
+    nutriments = {}
+    for field in list(product):
+        if field.endswith('_100g'):
+            try:
+                nutriments[field] = float(product.pop(field))
+            except ValueError:
+                pass
+    product['nutriments'] = nutriments
+    return product
+
+
+def iter_products(path):
+    """
+    Yield product documents from a dump, one at a time.
+
+    Lines that can't be parsed are logged and skipped.
+    """
+    with open_dump(path) as dump:
+        if '.csv' in path:
+            csv.field_size_limit(sys.maxsize)
+            for row in csv.DictReader(dump, delimiter='\t', quoting=csv.QUOTE_NONE):
+                yield product_from_csv_row(row)
+            return
+
+        for line_number, line in enumerate(dump, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                logger.warning(f"Skipping unreadable line {line_number} of {path}: {str(e)}")
+
+
+def last_modified(product):
+    try:
+        return int(product.get('last_modified_t') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def import_products(products, batch_size=BATCH_SIZE):
+    """
+    Import product documents into the local mirror.
+
+    Args:
+        products: Iterable of product documents (e.g. from iter_products)
+        batch_size: Products written per transaction
+
+    Returns:
+        dict: Counts of ``created``, ``updated``, ``unchanged`` and
+        ``skipped`` (no barcode) products
+    """
+    stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+
+    batch = {}
+    for product in products:
+        code = str(product.get('code') or '').strip()
+        if not code:
+            stats['skipped'] += 1
+            continue
+
+        # A dump can list a barcode more than once; keep the newest
+        if code in batch and last_modified(batch[code]) >= last_modified(product):
+            stats['unchanged'] += 1
+            continue
+        batch[code] = product
+
+        if len(batch) >= batch_size:
+            _import_batch(batch, stats)
+            batch = {}
+
+    if batch:
+        _import_batch(batch, stats)
+    return stats
+
+
+def _import_batch(batch, stats):
+    from .food_api import OpenFoodFactsAPI
+    from .models import OpenFoodFactsProduct
+
+    existing = dict(
+        OpenFoodFactsProduct.objects.filter(code__in=batch).values_list('code', 'last_modified')
+    )
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    for code, product in batch.items():
+        modified = last_modified(product)
+        if code in existing and existing[code] >= modified:
+            stats['unchanged'] += 1
+            continue
+
+        row = OpenFoodFactsProduct(
+            code=code,
+            last_modified=modified,
+            data=OpenFoodFactsAPI._normalize_product_data(dict(product, code=code)),
+            imported_at=now,
+        )
+        (to_update if code in existing else to_create).append(row)
+
+    with transaction.atomic():
+        OpenFoodFactsProduct.objects.bulk_create(to_create)
+        OpenFoodFactsProduct.objects.bulk_update(to_update, ['last_modified', 'data', 'imported_at'])
+
+    stats['created'] += len(to_create)
+    stats['updated'] += len(to_update)
@@ -9,18 +9,133 @@ This module provides intelligent product recommendations based on:
 5. Collaborative filtering (similar families)
 """
 
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from django.core.cache import cache
+from django.db import connection, transaction
 from django.db.models import Count, F, Q, Sum
 from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Number of ranked items stored per precomputed FamilyRecommendation row.
+# Requests for more items than this bypass the store and compute live.
+PRECOMPUTED_LIMIT = 20
+
+# Candidates computed live per item asked for when a safety mask will drop some
+SAFETY_OVERFETCH = 3
+
+# Longest a background refresh of a family's rows may take before another can start
+REFRESH_LOCK_TIMEOUT = 5 * 60
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='recommendation-refresh')
+
 class ShoppingRecommender:
     """Provides smart product recommendations for ShopSmart users"""
     
     @classmethod
-    def get_recommendations_for_family(cls, family, store=None, limit=10):
+    def get_recommendations_for_family(cls, family, store=None, limit=10, exclude_flags=0):
+        """
+        Get recommendations for a family from the precomputed store.
+
+        Reads the FamilyRecommendation row for (family, store). A stale row
+        is still served while it is recomputed in the background (see
+        refresh_later); when nothing has been computed yet this falls back
+        to compute_recommendations_for_family.
+
+        Args:
+            family: The Family object to get recommendations for
+            store: Optional GroceryStore to filter recommendations by
+            limit: Maximum number of recommendations to return
+            exclude_flags: Safety mask of the member asking (see
+                UserProfile.get_safety_mask); the stored ranking is shared
+                by the family, so unsafe items are dropped when loading it
+
+        Returns:
+            List of recommended GroceryItems
+        """
+        from .models import FamilyRecommendation
+
+        if limit <= PRECOMPUTED_LIMIT:
+            stored = FamilyRecommendation.objects.filter(family=family, store=store).first()
+            if stored is not None:
+                if stored.is_stale:
+                    cls.refresh_later(family.id, store.id if store else None)
+                if exclude_flags:
+                    return cls._load_ranked_items(stored.item_ids, exclude_flags)[:limit]
+                return cls._load_ranked_items(stored.item_ids[:limit])
+
+        if exclude_flags:
+            items = cls.compute_recommendations_for_family(family, store, limit * SAFETY_OVERFETCH)
+            return cls._load_ranked_items([item.id for item in items], exclude_flags)[:limit]
+        return cls.compute_recommendations_for_family(family, store, limit)
+
+    @classmethod
+    def refresh_family_recommendations(cls, family, store=None):
+        """
+        Recompute and save the ranked recommendations for a family and store.
+
+        Returns:
+            The saved FamilyRecommendation
+        """
+        from .models import FamilyRecommendation
+
+        items = cls.compute_recommendations_for_family(family, store, PRECOMPUTED_LIMIT)
+        stored, _ = FamilyRecommendation.objects.update_or_create(
+            family=family,
+            store=store,
+            defaults={
+                'item_ids': [item.id for item in items],
+                'is_stale': False,
+            }
+        )
+        return stored
+
+    @classmethod
+    def refresh_later(cls, family_id, store_id=None):
+        """
+        Recompute a family's stored ranking in a background thread once the
+        current transaction commits. Only one refresh per (family, store)
+        runs at a time across all workers.
+        """
+        lock_key = f'shopping:recommendations:refreshing:{family_id}:{store_id}'
+
+        def submit():
+            if cache.add(lock_key, 1, REFRESH_LOCK_TIMEOUT):
+                _executor.submit(cls._refresh_in_background, family_id, store_id, lock_key)
+
+        transaction.on_commit(submit)
+
+    @classmethod
+    def _refresh_in_background(cls, family_id, store_id, lock_key):
+        from .models import Family, GroceryStore
+
+        try:
+            family = Family.objects.get(pk=family_id)
+            store = GroceryStore.objects.get(pk=store_id) if store_id else None
+            cls.refresh_family_recommendations(family, store)
+        except Exception as e:
+            # The stale ranking keeps being served until a refresh succeeds
+            logger.warning(f"Error refreshing recommendations for family {family_id}: {str(e)}")
+        finally:
+            cache.delete(lock_key)
+            # This thread's connection isn't managed by the request cycle
+            connection.close()
+
+    @classmethod
+    def _load_ranked_items(cls, item_ids, exclude_flags=0):
+        """Load GroceryItems in one query, keeping the stored ranking"""
+        from .allergens import safe_items_filter
+        from .models import GroceryItem
+
+        items_by_id = GroceryItem.objects.select_related('category').filter(
+            safe_items_filter(exclude_flags)
+        ).in_bulk(item_ids)
+        return [items_by_id[item_id] for item_id in item_ids if item_id in items_by_id]
+
+    @classmethod
+    def compute_recommendations_for_family(cls, family, store=None, limit=10):
         """
         Generate personalized recommendations for a family, optionally filtered by store.
 
@@ -154,7 +269,7 @@ class ShoppingRecommender:
             return list(GroceryItem.objects.order_by('-global_popularity')[:limit])
     
     @classmethod
-    def get_recommendations_based_on_list(cls, shopping_list, limit=10):
+    def get_recommendations_based_on_list(cls, shopping_list, limit=10, exclude_flags=0):
         """
         Generate recommendations based on current items in a shopping list.
 
@@ -166,12 +281,16 @@ class ShoppingRecommender:
         Args:
             shopping_list: The ShoppingList object to generate recommendations for
             limit: Maximum number of recommendations to return
+            exclude_flags: Safety mask; items with any of these flags are left out
 
         Returns:
             QuerySet of recommended GroceryItems
         """
         from .models import GroceryItem, FamilyItemUsage
         
+        # Only passed on when set, so unfiltered calls stay as they were
+        safety = {'exclude_flags': exclude_flags} if exclude_flags else {}
+        
         try:
             # Check if the shopping list has any items
             item_count = shopping_list.items.count()
@@ -181,7 +300,8 @@ class ShoppingRecommender:
                 return cls.get_recommendations_for_family(
                     shopping_list.family, 
                     shopping_list.store, 
-                    limit
+                    limit,
+                    **safety
                 )
             
             # Get items already in the list
@@ -195,7 +315,8 @@ class ShoppingRecommender:
                 family, 
                 existing_items, 
                 store=shopping_list.store,
-                limit=limit
+                limit=limit,
+                **safety
             )
             
             # Convert to list immediately to avoid the slice has been taken error
@@ -210,7 +331,8 @@ class ShoppingRecommender:
                 recipe_items = cls._get_recipe_complements(
                     existing_items,
                     store=shopping_list.store,
-                    limit=remaining_limit
+                    limit=remaining_limit,
+                    **safety
                 )
                 
                 # Convert to list and exclude items we already have in co_purchased_list
@@ -241,7 +363,8 @@ class ShoppingRecommender:
             return cls.get_recommendations_for_family(
                 shopping_list.family, 
                 shopping_list.store, 
-                limit
+                limit,
+                **safety
             )
 
     @classmethod
@@ -341,57 +464,25 @@ class ShoppingRecommender:
     
     @classmethod
     def _get_replenishment_suggestions(cls, family, store=None, limit=5):
-        """Suggest items that might need replenishment based on purchase frequency"""
-        from .models import GroceryItem, ShoppingListItem, ShoppingList
-        
-        # Calculate average days between purchases for each item
-        thirty_days_ago = timezone.now() - timedelta(days=30)
+        """
+        Suggest items that might need replenishment based on purchase frequency.
+
+        Reads the ItemPurchaseCadence rows whose next_due has passed but
+        that aren't so overdue the family has stopped buying them; the
+        cadence is kept up to date as lists are completed, so this is an
+        indexed range query however long the family's history is.
+        """
+        from .models import GroceryItem, ItemPurchaseCadence
         
-        # Get completed lists from the past month
-        recent_lists = ShoppingList.objects.filter(
+        now = timezone.now()
+        due_item_ids = ItemPurchaseCadence.objects.filter(
             family=family,
-            completed=True,
-            completed_at__gte=thirty_days_ago
-        )
-        
-        # Get items from these lists with their purchase dates
-        recent_items = ShoppingListItem.objects.filter(
-            shopping_list__in=recent_lists
-        ).select_related('shopping_list', 'item')
-        
-        # Group by item and calculate average interval
-        item_purchase_dates = {}
-        for list_item in recent_items:
-            item_id = list_item.item_id
-            purchase_date = list_item.shopping_list.completed_at
-            
-            if item_id not in item_purchase_dates:
-                item_purchase_dates[item_id] = []
-                
-            item_purchase_dates[item_id].append(purchase_date)
-        
-        # Calculate average purchase interval and estimate replenishment date
-        items_to_replenish = []
-        today = timezone.now()
-        
-        for item_id, dates in item_purchase_dates.items():
-            if len(dates) > 1:
-                # Calculate average interval
-                sorted_dates = sorted(dates)
-                intervals = [(sorted_dates[i+1] - sorted_dates[i]).days 
-                             for i in range(len(sorted_dates)-1)]
-                
-                if intervals:
-                    avg_interval = sum(intervals) / len(intervals)
-                    last_purchase = max(sorted_dates)
-                    days_since_purchase = (today - last_purchase).days
-                    
-                    # If we're at least 80% through the average interval, suggest replenishment
-                    if days_since_purchase >= (avg_interval * 0.8):
-                        items_to_replenish.append(item_id)
+            next_due__lte=now,
+            overdue_until__gt=now
+        ).values('item_id')
         
         # Query these items
-        replenishment_items = GroceryItem.objects.filter(id__in=items_to_replenish)
+        replenishment_items = GroceryItem.objects.filter(id__in=due_item_ids)
         
         # Filter by store if specified
         if store:
@@ -401,7 +492,23 @@ class ShoppingRecommender:
     
     @classmethod
     def _get_collaborative_recommendations(cls, family, store=None, limit=5):
-        """Get recommendations based on similar families' purchases"""
+        """
+        Get recommendations based on similar families' purchases.
+
+        Uses the precomputed FamilyNeighbour index when it has rows for this
+        family, otherwise falls back to the on-the-fly common-items query.
+        """
+        from .collaborative import recommend_from_neighbours
+
+        neighbour_items = recommend_from_neighbours(family, store, limit)
+        if neighbour_items is not None:
+            return neighbour_items
+
+        return cls._get_collaborative_recommendations_orm(family, store, limit)
+
+    @classmethod
+    def _get_collaborative_recommendations_orm(cls, family, store=None, limit=5):
+        """Find similar families by shared items directly in the database"""
         from .models import Family, FamilyItemUsage, GroceryItem
         
         # Find other families with similar purchase patterns
@@ -440,40 +547,59 @@ class ShoppingRecommender:
         return collaborative_items[:limit]
     
     @classmethod
-    def _get_co_purchased_items(cls, family, item_ids, store=None, limit=10):
-        """Find items that are frequently purchased together with the given items"""
-        from .models import ShoppingList, ShoppingListItem, GroceryItem
+    def _get_co_purchased_items(cls, family, item_ids, store=None, limit=10, exclude_flags=0):
+        """
+        Find items that are frequently purchased together with the given items.
+
+        Scores each candidate by summing its ItemCoOccurrence counts over the
+        items already on the list, using the family's counts when it has any
+        and the global counts otherwise.
+        """
+        from .allergens import safe_items_filter
+        from .models import GroceryItem, ItemCoOccurrence
         
-        # Get all lists that contain at least one of the specified items
-        lists_with_items = ShoppingList.objects.filter(
-            family=family,
-            items__item_id__in=item_ids
-        )
+        family_id = family.id if family else None
+        if family_id and not ItemCoOccurrence.objects.filter(family_id=family_id).exists():
+            family_id = None
         
-        # Get items that frequently appear in these lists
-        co_purchased = GroceryItem.objects.filter(
-            shoppinglistitem__shopping_list__in=lists_with_items
+        scores = ItemCoOccurrence.objects.filter(
+            family_id=family_id,
+            item_id__in=item_ids,
+            count__gt=0
         ).exclude(
-            id__in=item_ids
-        ).annotate(
-            purchase_count=Count('shoppinglistitem')
-        ).order_by('-purchase_count')
+            other_item_id__in=item_ids
+        ).filter(
+            safe_items_filter(exclude_flags, 'other_item__safety_flags')
+        )
         
         # Filter by store if specified
         if store:
-            co_purchased = co_purchased.filter(store_info__store=store)
-            
-        return co_purchased[:limit]
+            scores = scores.filter(other_item__store_info__store=store)
+        
+        ranked = list(scores.values('other_item_id').annotate(
+            purchase_count=Sum('count')
+        ).order_by('-purchase_count').values_list('other_item_id', 'purchase_count')[:limit])
+        
+        items_by_id = GroceryItem.objects.in_bulk([item_id for item_id, _ in ranked])
+        co_purchased = []
+        for item_id, purchase_count in ranked:
+            item = items_by_id.get(item_id)
+            if item:
+                item.purchase_count = purchase_count
+                co_purchased.append(item)
+        
+        return co_purchased
     
     @classmethod
-    def _get_recipe_complements(cls, item_ids, store=None, limit=5):
+    def _get_recipe_complements(cls, item_ids, store=None, limit=5, exclude_flags=0):
         """
         Suggest complementary items based on common recipes
         
         This is a simplified implementation. In a real system, this would 
         connect to a recipe database or use more sophisticated food pairing logic.
         """
-        from .models import GroceryItem, ProductCategory
+        from .allergens import safe_items_filter
+        from .models import GroceryItem
         from django.db.models import Q
         
         # Get categories and names of the items
@@ -482,13 +608,13 @@ class ShoppingRecommender:
             category__isnull=False
         ).select_related('category')
         
-        # Create two lists - one for category IDs, one for item names
+        # Create two lists - one for categories, one for item names
         item_categories = []
         item_names = []
         item_category_names = []
         
         for item in items_with_categories:
-            item_categories.append(item.category_id)
+            item_categories.append(item.category)
             item_names.append(item.name.lower())
             if item.category:
                 item_category_names.append(item.category.name.lower())
@@ -546,14 +672,10 @@ class ShoppingRecommender:
         complementary_categories = []
         
         # First try to find complements based on categories
-        for category_id in item_categories:
-            try:
-                category = ProductCategory.objects.get(id=category_id)
-                for main_category, complements in recipe_pairings.items():
-                    if main_category.lower() in category.name.lower():
-                        complementary_categories.extend(complements)
-            except ProductCategory.DoesNotExist:
-                pass
+        for category in item_categories:
+            for main_category, complements in recipe_pairings.items():
+                if main_category.lower() in category.name.lower():
+                    complementary_categories.extend(complements)
                 
         # Also try to find complements based on item names
         direct_complements = []
@@ -590,6 +712,8 @@ class ShoppingRecommender:
         # Filter by store if specified
         if store:
             query = query.filter(store_info__store=store)
+        
+        query = query.filter(safe_items_filter(exclude_flags))
             
         # Convert to list immediately to avoid the "Cannot filter a query once a slice has been taken" error
         return list(query[:limit])
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+ShopSmart Aisle Routes
+
+Orders a shopping list the way a shopper walks the store.
+
+A store's route is its locations in walk order (sort_order, then name).
+Locations only carry a sort order, so the route is a single path through
+the store rather than a graph. Routes are built once per store and kept
+in the cache.
+
+A list's walk order places each line at its ItemStoreInfo location at
+the list's store or, failing that, the location its category maps to
+(store_utils.match_category_locations, resolved for the whole list at
+once). Unchecked lines come first and lines with nowhere to go come last
+in each group. The order is cached per (store, list version), so
+refreshing a list while shopping doesn't resolve or sort it again.
+
+Every cached route and walk order carries its store's generation, bumped
+whenever one of the store's locations or an item's location there
+changes, or an item on one of the store's lists changes category. A
+global generation covers category renames, which can move items at any
+store. Generations live in the cache, so every worker must share it
+(settings require REDIS_URL outside DEBUG).
+"""
+
+from django.core.cache import cache
+from django.db.models import FilteredRelation, Q
+
+# Bumped when every cached route and walk order is stale; each store also
+# has its own generation under this key plus the store id
+ROUTE_GENERATION_CACHE_KEY = 'shopping:route_generation'
+
+ROUTE_CACHE_TIMEOUT = 60 * 60 * 24
+
+WALK_ORDER_CACHE_TIMEOUT = 60 * 60
+
+
+def _store_generation_key(store_id):
+    return f'{ROUTE_GENERATION_CACHE_KEY}:{store_id}'
+
+
+def _route_generation(store_id):
+    """The global and store generations a store's cached routes are keyed on"""
+    store_key = _store_generation_key(store_id)
+    generations = cache.get_many([ROUTE_GENERATION_CACHE_KEY, store_key])
+    return f'{generations.get(ROUTE_GENERATION_CACHE_KEY, 0)}.{generations.get(store_key, 0)}'
+
+
+def invalidate_store_routes(store_ids=None):
+    """Mark the cached routes and walk orders of these stores (or every store) as stale"""
+    if store_ids is None:
+        keys = [ROUTE_GENERATION_CACHE_KEY]
+    else:
+        keys = [_store_generation_key(store_id) for store_id in set(store_ids)]
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def invalidate_item_routes(item_ids):
+    """Mark the walk orders at every store with these items on a list as stale"""
+    from .models import ShoppingListItem
+
+    store_ids = set(ShoppingListItem.objects.filter(
+        item_id__in=item_ids
+    ).values_list('shopping_list__store_id', flat=True).distinct())
+    if store_ids:
+        invalidate_store_routes(store_ids)
+
+
+def store_route(store_id):
+    """
+    A store's locations in walk order.
+
+    Returns:
+        Dict mapping location id to (position, name)
+    """
+    from .models import StoreLocation
+
+    key = f'shopping:route:{store_id}:{_route_generation(store_id)}'
+    route = cache.get(key)
+    if route is None:
+        locations = StoreLocation.objects.filter(store_id=store_id).order_by(
+            'sort_order', 'name', 'id'
+        ).values_list('id', 'name')
+        route = {location_id: (position, name) for position, (location_id, name) in enumerate(locations)}
+        cache.set(key, route, ROUTE_CACHE_TIMEOUT)
+    return route
+
+
+def walk_order(shopping_list, lines=None):
+    """
+    A list's lines in walk order, cached per (store, list version).
+
+    Args:
+        shopping_list: The ShoppingList to order
+        lines: Optional rows the caller has already loaded, as
+            (id, checked, sort_order, item name, category name, location id)
+            tuples. Loaded with one query when omitted.
+
+    Returns:
+        List of (list_item_id, location_id) in walk order; location_id is
+        None for lines with no location
+    """
+    key = (
+        f'shopping:walk:{shopping_list.store_id}:{shopping_list.pk}:'
+        f'{shopping_list.version}:{_route_generation(shopping_list.store_id)}'
+    )
+    order = cache.get(key)
+    if order is not None:
+        return order
+
+    if lines is None:
+        lines = shopping_list.items.annotate(
+            current_info=FilteredRelation(
+                'item__store_info',
+                condition=Q(item__store_info__store_id=shopping_list.store_id)
+            )
+        ).values_list(
+            'id', 'checked', 'sort_order', 'item__name', 'item__category__name', 'current_info__location_id'
+        )
+
+    from .store_utils import match_category_locations
+
+    lines = list(lines)
+    fallback = match_category_locations(shopping_list.store_id, {
+        category_name for _, _, _, _, category_name, location_id in lines
+        if location_id is None and category_name
+    })
+
+    route = store_route(shopping_list.store_id)
+    placed = []
+    for line_id, checked, sort_order, name, category_name, location_id in lines:
+        if location_id is None and category_name in fallback:
+            location_id = fallback[category_name].id
+        position = route[location_id][0] if location_id in route else len(route)
+        placed.append(((checked, position, sort_order, name, line_id), line_id, location_id))
+
+    order = [(line_id, location_id) for _, line_id, location_id in sorted(placed)]
+    cache.set(key, order, WALK_ORDER_CACHE_TIMEOUT)
+    return order
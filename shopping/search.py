@@ -0,0 +1,310 @@
+"""
+ShopSmart Item Search
+
+Full-text and fuzzy search over GroceryItems.
+
+On PostgreSQL items carry a weighted ``search_vector`` (name, brand,
+category, description) kept up to date on save, and matching uses the
+tsvector GIN index plus pg_trgm similarity on the name when the extension
+is installed (see the setup_search_index command). Other databases (SQLite in
+tests and local development) use an in-process character trigram index
+that is rebuilt lazily whenever any item changes.
+
+Results are ranked by relevance, then the family's usage of the item,
+then global popularity.
+"""
+
+import logging
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Exists, F, FloatField, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever a GroceryItem is saved or deleted so every worker
+# process knows its in-memory index is out of date
+INDEX_GENERATION_CACHE_KEY = 'shopping:item_index_generation'
+
+# Minimum share of the query's trigrams a document needs in the fallback index
+NGRAM_MIN_SCORE = 0.5
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def is_postgres():
+    """Whether the default database supports tsvector/pg_trgm search"""
+    return connection.vendor == 'postgresql'
+
+
+def normalize_text(text):
+    """Lowercase and split text into alphanumeric words"""
+    return _WORD_RE.findall((text or '').lower())
+
+
+def text_ngrams(text, n=3, prefix=False):
+    """
+    Return the set of padded character n-grams for a piece of text.
+
+    Words are padded with a space on both sides so short words and word
+    boundaries still produce n-grams. With ``prefix=True`` the last word is
+    only padded on the left, so a partially typed word matches longer ones.
+    """
+    words = normalize_text(text)
+    grams = set()
+    for position, word in enumerate(words):
+        is_last = position == len(words) - 1
+        padded = f' {word}' if prefix and is_last else f' {word} '
+        for start in range(len(padded) - n + 1):
+            grams.add(padded[start:start + n])
+    return grams
+
+
+class NgramIndex:
+    """Character n-gram inverted index mapping grams to document IDs"""
+
+    def __init__(self, n=3):
+        self.n = n
+        self.postings = defaultdict(set)
+
+    def add(self, doc_id, text):
+        for gram in text_ngrams(text, self.n):
+            self.postings[gram].add(doc_id)
+
+    def scores(self, query, prefix=False):
+        """Return {doc_id: share of the query's n-grams the document contains}"""
+        grams = text_ngrams(query, self.n, prefix=prefix)
+        if not grams:
+            return {}
+
+        hits = Counter()
+        for gram in grams:
+            hits.update(self.postings.get(gram, ()))
+
+        total = len(grams)
+        return {doc_id: count / total for doc_id, count in hits.items()}
+
+    def search(self, query, limit=50, min_score=NGRAM_MIN_SCORE, prefix=False):
+        """Return up to ``limit`` (doc_id, score) pairs, best first"""
+        ranked = [
+            (doc_id, score) for doc_id, score in self.scores(query, prefix=prefix).items()
+            if score >= min_score
+        ]
+        ranked.sort(key=lambda pair: (-pair[1], pair[0]))
+        return ranked[:limit]
+
+
+class ItemIndex:
+    """In-process trigram indexes over every GroceryItem"""
+
+    def __init__(self, rows):
+        self.names = NgramIndex()
+        self.text = NgramIndex()
+        self.size = 0
+
+        for item_id, name, brand, description, category_name in rows:
+            self.names.add(item_id, f'{name} {brand or ""}')
+            self.text.add(item_id, f'{description or ""} {category_name or ""}')
+            self.size += 1
+
+    def search(self, query, limit=200, prefix=True):
+        """
+        Rank items for a free-text query.
+
+        Name and brand matches count fully; description and category
+        matches count half.
+        """
+        name_scores = self.names.scores(query, prefix=prefix)
+        text_scores = self.text.scores(query, prefix=prefix)
+
+        combined = {}
+        for item_id in set(name_scores) | set(text_scores):
+            name_score = name_scores.get(item_id, 0.0)
+            text_score = text_scores.get(item_id, 0.0)
+            if name_score >= NGRAM_MIN_SCORE or text_score >= NGRAM_MIN_SCORE:
+                combined[item_id] = name_score + 0.5 * text_score
+
+        ranked = sorted(combined.items(), key=lambda pair: (-pair[1], pair[0]))
+        return ranked[:limit]
+
+
+_index_lock = threading.Lock()
+_item_index = None
+_item_index_generation = None
+
+
+def get_item_index():
+    """Return the process-wide ItemIndex, rebuilding it if any item changed"""
+    global _item_index, _item_index_generation
+    from .models import GroceryItem
+
+    generation = cache.get(INDEX_GENERATION_CACHE_KEY, 0)
+    if _item_index is not None and _item_index_generation == generation:
+        return _item_index
+
+    with _index_lock:
+        if _item_index is None or _item_index_generation != generation:
+            rows = GroceryItem.objects.order_by().values_list(
+                'id', 'name', 'brand', 'description', 'category__name'
+            ).iterator(chunk_size=5000)
+            _item_index = ItemIndex(rows)
+            _item_index_generation = generation
+            logger.info(f"Built in-memory item index for {_item_index.size} items")
+
+    return _item_index
+
+
+def invalidate_item_index():
+    """Mark every process's in-memory item index as stale"""
+    try:
+        cache.incr(INDEX_GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.set(INDEX_GENERATION_CACHE_KEY, 1, timeout=None)
+
+
+_trigram_available = None
+
+
+def has_trigram_extension():
+    """Whether pg_trgm is installed (checked once per process)"""
+    global _trigram_available
+
+    if _trigram_available is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_available = cursor.fetchone() is not None
+    return _trigram_available
+
+
+def search_vector_expression():
+    """Weighted tsvector over an item's name, brand, category and description"""
+    from django.contrib.postgres.search import SearchVector
+    from .models import ProductCategory
+
+    category_name = Subquery(
+        ProductCategory.objects.filter(pk=OuterRef('category_id')).values('name')[:1]
+    )
+    return (
+        SearchVector('name', weight='A', config='simple') +
+        SearchVector('brand', weight='B', config='simple') +
+        SearchVector(category_name, weight='C', config='simple') +
+        SearchVector('description', weight='D', config='simple')
+    )
+
+
+def update_search_vectors(queryset=None):
+    """Recompute search_vector for the given items (all items by default)"""
+    from .models import GroceryItem
+
+    if not is_postgres():
+        return 0
+
+    if queryset is None:
+        queryset = GroceryItem.objects.all()
+    return queryset.order_by().update(search_vector=search_vector_expression())
+
+
+def _prefix_tsquery(query):
+    """Turn user input into a raw tsquery where every word is a prefix match"""
+    words = normalize_text(query)
+    return ' & '.join(f'{word}:*' for word in words)
+
+
+def search_items(query, family=None, store=None, limit=20, exclude_flags=0):
+    """
+    Search grocery items for a query.
+
+    Args:
+        query: The user's search text
+        family: Optional Family whose usage is the secondary sort key
+        store: Optional GroceryStore; items stocked elsewhere but not at
+            this store are excluded, items without any store info are kept
+        limit: Maximum number of items to return
+        exclude_flags: Safety mask (see UserProfile.get_safety_mask); items
+            with any of these allergen or diet flags are excluded
+
+    Returns:
+        List of GroceryItems, best match first
+    """
+    from .allergens import safe_items_filter
+    from .models import FamilyItemUsage, GroceryItem, ItemStoreInfo
+
+    items = GroceryItem.objects.select_related('category').filter(safe_items_filter(exclude_flags))
+
+    if store:
+        items = items.filter(
+            Q(Exists(ItemStoreInfo.objects.filter(item=OuterRef('pk'), store=store))) |
+            ~Q(Exists(ItemStoreInfo.objects.filter(item=OuterRef('pk'))))
+        )
+
+    if family:
+        family_usage = Coalesce(
+            Subquery(
+                FamilyItemUsage.objects.filter(
+                    family=family, item=OuterRef('pk')
+                ).values('usage_count')[:1]
+            ),
+            Value(0),
+            output_field=IntegerField()
+        )
+    else:
+        family_usage = Value(0, output_field=IntegerField())
+    items = items.annotate(family_usage_count=family_usage)
+
+    if is_postgres():
+        return _search_postgres(items, query, limit)
+    return _search_ngram(items, query, limit)
+
+
+def _search_postgres(items, query, limit):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+
+    tsquery = _prefix_tsquery(query)
+    if not tsquery:
+        return []
+
+    search_query = SearchQuery(tsquery, search_type='raw', config='simple')
+    matches = Q(search_vector=search_query)
+
+    if has_trigram_extension():
+        # Typo tolerance on the name. The % operator can use the pg_trgm GIN
+        # index (a similarity() comparison can't), and matches names at least
+        # pg_trgm.similarity_threshold (0.3 by default) similar to the query
+        matches |= Q(name__trigram_similar=query)
+        similarity = TrigramSimilarity('name', query)
+    else:
+        similarity = Value(0.0, output_field=FloatField())
+
+    # Filtered first, so the rank is only computed for the matched items
+    items = items.filter(
+        matches
+    ).annotate(
+        relevance=SearchRank(F('search_vector'), search_query) + similarity
+    ).order_by('-relevance', '-family_usage_count', '-global_popularity')
+
+    return list(items[:limit])
+
+
+def _search_ngram(items, query, limit):
+    if len(query.strip()) < 2:
+        # Too short for trigrams; a plain prefix match is cheap enough here
+        return list(items.filter(name__istartswith=query.strip()).order_by(
+            '-family_usage_count', '-global_popularity'
+        )[:limit])
+
+    ranked = get_item_index().search(query)
+    if not ranked:
+        return []
+
+    relevance = dict(ranked)
+    candidates = list(items.filter(id__in=relevance))
+    candidates.sort(key=lambda item: (
+        -round(relevance[item.id], 3),
+        -item.family_usage_count,
+        -item.global_popularity,
+    ))
+    return candidates[:limit]
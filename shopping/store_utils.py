@@ -1,6 +1,7 @@
-from .models import GroceryStore, StoreLocation
+from .models import GroceryStore, ProductCategory, StoreLocation
 import os
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 import urllib.request
@@ -306,86 +307,214 @@ def search_store_info(query):
             "address": ""
         }
 
-def find_matching_store_location(item, store):
+# Map of category names to common store section names
+CATEGORY_LOCATION_NAMES = {
+    # Produce-related
+    'Vegetables': ['Vegetables', 'Produce', 'Fruits & Vegetables', 'Fresh Produce'],
+    'Fruits': ['Fruits', 'Produce', 'Fruits & Vegetables', 'Fresh Produce'],
+    
+    # Dairy-related
+    'Dairy': ['Dairy', 'Refrigerated'],
+    
+    # Meat & Seafood
+    'Meat': ['Meat', 'Meat & Seafood'],
+    'Seafood': ['Seafood', 'Fish', 'Meat & Seafood'],
+    
+    # Bakery-related
+    'Bakery': ['Bakery', 'Bread', 'Baked Goods'],
+    
+    # Pantry-related
+    'Pantry': ['Dry Goods', 'Canned Goods', 'Pasta & Rice'],
+    
+    # Spices-related
+    'Spices': ['Spices', 'Seasonings', 'Spices & Seasonings', 'Baking', 'Condiments'],
+    
+    # Snacks-related
+    'Snacks': ['Snacks', 'Chips & Crackers'],
+    
+    # Beverages-related
+    'Beverages': ['Beverages', 'Drinks', 'Soda & Water'],
+    
+    # Frozen-related
+    'Frozen': ['Frozen Foods', 'Frozen'],
+    
+    # Household-related
+    'Household': ['Household', 'Cleaning Supplies', 'Home'],
+    
+    # Personal Care-related
+    'Personal Care': ['Health & Beauty', 'Personal Care', 'Pharmacy'],
+    
+    # Baby & Pet-related
+    'Baby & Pet': ['Baby Products', 'Pet Supplies', 'Pet Food']
+}
+
+# Store location tables are rebuilt when one of the store's locations changes
+LOCATION_TABLE_CACHE_TIMEOUT = 60 * 60 * 24
+
+def normalize_location_name(name):
+    """Lowercase a category or location name and collapse its whitespace for matching."""
+    return ' '.join((name or '').lower().split())
+
+# CATEGORY_LOCATION_NAMES with normalized keys and section names
+NORMALIZED_CATEGORY_LOCATION_NAMES = {
+    normalize_location_name(category_name): [normalize_location_name(name) for name in location_names]
+    for category_name, location_names in CATEGORY_LOCATION_NAMES.items()
+}
+
+def _match_location(category_name, location_names):
     """
-    Find the appropriate store location for an item based on its category.
+    Index of the first location whose name contains one of the category's section names.
     
     Args:
-        item: GroceryItem object
-        store: GroceryStore object
+        category_name: Normalized category name
+        location_names: Normalized names of the store's locations, in store order
         
     Returns:
-        StoreLocation object or None if no matching location found
+        Index into location_names, or None if nothing matches
     """
-    from .models import ProductCategory
-    
-    # If item has no category, return None
-    if not item.category:
-        return None
-        
-    # Get a list of all store locations
-    store_locations = StoreLocation.objects.filter(store=store)
-    if not store_locations.exists():
+    if not category_name:
         return None
-        
-    # Get item category name
-    category_name = item.category.name
     
-    # Map of category names to common store section names
-    category_to_location_map = {
-        # Produce-related
-        'Vegetables': ['Vegetables', 'Produce', 'Fruits & Vegetables', 'Fresh Produce'],
-        'Fruits': ['Fruits', 'Produce', 'Fruits & Vegetables', 'Fresh Produce'],
-        
-        # Dairy-related
-        'Dairy': ['Dairy', 'Refrigerated'],
-        
-        # Meat & Seafood
-        'Meat': ['Meat', 'Meat & Seafood'],
-        'Seafood': ['Seafood', 'Fish', 'Meat & Seafood'],
-        
-        # Bakery-related
-        'Bakery': ['Bakery', 'Bread', 'Baked Goods'],
-        
-        # Pantry-related
-        'Pantry': ['Dry Goods', 'Canned Goods', 'Pasta & Rice'],
-        
-        # Spices-related
-        'Spices': ['Spices', 'Seasonings', 'Spices & Seasonings', 'Baking', 'Condiments'],
-        
-        # Snacks-related
-        'Snacks': ['Snacks', 'Chips & Crackers'],
+    # The category name itself is the last resort
+    for section_name in NORMALIZED_CATEGORY_LOCATION_NAMES.get(category_name, []) + [category_name]:
+        for index, location_name in enumerate(location_names):
+            if section_name in location_name:
+                return index
+    return None
+
+def _location_table_key(store_id):
+    return f'shopping:location_table:{store_id}'
+
+def invalidate_location_table(store_id):
+    """Drop a store's cached location table so it is rebuilt on next use."""
+    cache.delete(_location_table_key(store_id))
+
+def store_location_table(store_id):
+    """
+    A store's category to location lookup table, built once and cached
+    until one of the store's locations changes.
+    
+    Every known category name (the mapped ones and every ProductCategory)
+    is matched against the store's locations up front, so resolving a
+    category is a dictionary lookup. Matches depend only on the category's
+    name, so categories added or renamed since the table was built are
+    matched against the cached locations on lookup instead.
+    
+    Args:
+        store_id: GroceryStore id
         
-        # Beverages-related
-        'Beverages': ['Beverages', 'Drinks', 'Soda & Water'],
+    Returns:
+        Dict with 'locations', the store's (id, name, sort_order) in store
+        order, and 'categories', mapping normalized category names to an
+        index into 'locations' or None
+    """
+    key = _location_table_key(store_id)
+    table = cache.get(key)
+    if table is None:
+        locations = list(StoreLocation.objects.filter(store_id=store_id).order_by(
+            'sort_order', 'name', 'id'
+        ).values_list('id', 'name', 'sort_order'))
         
-        # Frozen-related
-        'Frozen': ['Frozen Foods', 'Frozen'],
+        categories = {}
+        if locations:
+            location_names = [normalize_location_name(name) for _, name, _ in locations]
+            category_names = set(NORMALIZED_CATEGORY_LOCATION_NAMES)
+            category_names.update(
+                normalize_location_name(name) for name in ProductCategory.objects.values_list('name', flat=True)
+            )
+            categories = {name: _match_location(name, location_names) for name in category_names}
         
-        # Household-related
-        'Household': ['Household', 'Cleaning Supplies', 'Home'],
+        table = {'locations': locations, 'categories': categories}
+        cache.set(key, table, LOCATION_TABLE_CACHE_TIMEOUT)
+    return table
+
+def match_category_locations(store, category_names):
+    """
+    Find the store location for each of several category names at once.
+    
+    Resolved from the store's cached location table, so this costs at most
+    the queries to build the table however many categories are asked for.
+    
+    Args:
+        store: GroceryStore object or id
+        category_names: Iterable of category names
         
-        # Personal Care-related
-        'Personal Care': ['Health & Beauty', 'Personal Care', 'Pharmacy'],
+    Returns:
+        Dict mapping each category name with a match to its StoreLocation
+    """
+    category_names = set(category_names)
+    if not category_names:
+        return {}
+    
+    store_id = getattr(store, 'pk', store)
+    table = store_location_table(store_id)
+    locations = table['locations']
+    if not locations:
+        return {}
+    
+    location_names = None
+    matches = {}
+    for category_name in category_names:
+        normalized = normalize_location_name(category_name)
+        if normalized in table['categories']:
+            index = table['categories'][normalized]
+        else:
+            # A category newer than the table
+            if location_names is None:
+                location_names = [normalize_location_name(name) for _, name, _ in locations]
+            index = _match_location(normalized, location_names)
         
-        # Baby & Pet-related
-        'Baby & Pet': ['Baby Products', 'Pet Supplies', 'Pet Food']
-    }
+        if index is not None:
+            location_id, name, sort_order = locations[index]
+            matches[category_name] = StoreLocation(
+                id=location_id, name=name, sort_order=sort_order, store_id=store_id
+            )
     
-    # Find the matching location names for this category
-    potential_location_names = category_to_location_map.get(category_name, [])
+    return matches
+
+def resolve_item_locations(items, stores):
+    """
+    Find the category-based location of several items at several stores.
     
-    # Add the category name itself as a potential match
-    potential_location_names.append(category_name)
+    Each store's table is looked up once, however many items are resolved.
+    Items should have their category loaded (select_related('category')).
     
-    # Try to find a matching location in the store
-    for location_name in potential_location_names:
-        for store_location in store_locations:
-            if location_name.lower() in store_location.name.lower():
-                return store_location
+    Args:
+        items: Iterable of GroceryItem objects
+        stores: Iterable of GroceryStore objects or ids
+        
+    Returns:
+        Dict mapping (item_id, store_id) to StoreLocation for each pair with a match
+    """
+    category_names = {item.id: item.category.name for item in items if item.category_id}
+    if not category_names:
+        return {}
     
-    # If no match found, return None
-    return None
+    resolved = {}
+    for store in stores:
+        store_id = getattr(store, 'pk', store)
+        matches = match_category_locations(store_id, category_names.values())
+        for item_id, category_name in category_names.items():
+            if category_name in matches:
+                resolved[(item_id, store_id)] = matches[category_name]
+    return resolved
+
+def find_matching_store_location(item, store):
+    """
+    Find the appropriate store location for an item based on its category.
+    
+    Args:
+        item: GroceryItem object
+        store: GroceryStore object
+        
+    Returns:
+        StoreLocation object or None if no matching location found
+    """
+    # If item has no category, return None
+    if not item.category:
+        return None
+    
+    return match_category_locations(store, [item.category.name]).get(item.category.name)
 
 def save_store_logo_from_url(store, logo_url):
     """
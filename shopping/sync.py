@@ -0,0 +1,474 @@
+"""
+ShopSmart Offline Sync
+
+Devices keep shopping lists in IndexedDB and queue the edits made while
+offline (static/js/offline-data-manager.js). This is the server side:
+
+- Every saved or deleted ShoppingList and ShoppingListItem appends a
+  SyncChange row once its transaction commits. The row IDs form a monotonic
+  change sequence, so a device that remembers the last ID it has seen pulls
+  only what changed after it (changes_since) instead of refetching lists.
+- Queued client ops are applied in bulk by apply_client_ops. Each op carries
+  a client-generated op_id that is stored on a SyncLog row, so a batch that
+  is retried after a lost response is not applied twice.
+- Item edits carry the hybrid logical clock they were made at and are
+  merged field by field (see shopping.hlc), so the queues of devices that
+  edited the same list offline converge in one pass.
+
+Change rows are written after commit, so a change is never visible in the
+feed before the data it points at. Their IDs are allocated as they are
+inserted, so two commits can land out of order: a pull never moves the
+cursor past a missing ID until it has had SETTLE_TIME to commit.
+"""
+
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .hlc import Timestamp, server_clock
+
+LIST_MODEL = 'shopping_list'
+ITEM_MODEL = 'shopping_list_item'
+SYNC_MODELS = (LIST_MODEL, ITEM_MODEL)
+
+OPERATIONS = ('create', 'update', 'delete')
+
+# Maximum number of change rows read per pull; clients page with has_more
+PAGE_SIZE = 500
+
+# How long a change row can take from taking its ID to committing. Missing
+# IDs younger than this may still be in flight, so pulls stop short of them;
+# older ones were rolled back.
+SETTLE_TIME = timedelta(seconds=10)
+
+
+def record_changes(model_name, family_id, records, deleted=False):
+    """
+    Append rows to the change feed, and push them to anyone viewing the
+    lists (see shopping.live), once the current transaction commits.
+
+    Args:
+        model_name: LIST_MODEL or ITEM_MODEL
+        family_id: Family that owns the records
+        records: Iterable of (record_id, list_id) pairs
+        deleted: Whether the records were deleted
+    """
+    from .models import SyncChange
+
+    if not family_id:
+        return
+    rows = [
+        SyncChange(
+            family_id=family_id, model_name=model_name,
+            record_id=record_id, list_id=list_id, deleted=deleted
+        )
+        for record_id, list_id in records
+    ]
+    if rows:
+        transaction.on_commit(lambda: _commit_changes(rows))
+
+
+def _commit_changes(rows):
+    from .live import publish_changes
+    from .models import SyncChange
+
+    SyncChange.objects.bulk_create(rows)
+    publish_changes(rows)
+
+
+def latest_cursor():
+    """ID of the newest change row, or 0"""
+    from .models import SyncChange
+
+    return SyncChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def cursor_expired(since, latest=None):
+    """
+    Whether changes after ``since`` may have been pruned from the feed (or the
+    cursor is from another database), so the client needs a full snapshot.
+    """
+    from .models import SyncChange
+
+    oldest = SyncChange.objects.order_by('id').values_list('id', flat=True).first()
+    if latest is None:
+        latest = latest_cursor()
+    return since > latest or (oldest is not None and since < oldest - 1)
+
+
+def settled_cursor(since):
+    """
+    The highest ID a pull from ``since`` may move the cursor to without
+    skipping a change still being committed, or None if nothing is in flight.
+
+    Only IDs newer than the last row older than SETTLE_TIME can be in
+    flight, so only that tail of the feed is checked for gaps.
+    """
+    from .models import SyncChange
+
+    cutoff = timezone.now() - SETTLE_TIME
+    settled = SyncChange.objects.filter(created_at__lt=cutoff).order_by('-id').values_list('id', flat=True).first()
+    expected = max(since, settled or 0) + 1
+    for change_id in SyncChange.objects.filter(id__gte=expected).order_by('id').values_list('id', flat=True):
+        if change_id != expected:
+            return expected - 1
+        expected += 1
+    return None
+
+
+def serialize_list(shopping_list):
+    return {
+        'id': shopping_list.id,
+        'name': shopping_list.name,
+        'store_id': shopping_list.store_id,
+        'family_id': shopping_list.family_id,
+        'completed': shopping_list.completed,
+        'completed_at': shopping_list.completed_at.isoformat() if shopping_list.completed_at else None,
+        'updated_at': shopping_list.updated_at.isoformat(),
+        'total_items': shopping_list.item_count,
+        'checked_items': shopping_list.checked_count,
+        'estimated_total': str(shopping_list.estimated_total),
+        'version': shopping_list.version,
+    }
+
+
+def serialize_item(list_item):
+    return {
+        'id': list_item.id,
+        'shopping_list_id': list_item.shopping_list_id,
+        'item_id': list_item.item_id,
+        'name': list_item.item.name,
+        'brand': list_item.item.brand,
+        'quantity': str(list_item.quantity),
+        'unit': list_item.unit,
+        'checked': list_item.checked,
+        'actual_price': None if list_item.actual_price is None else str(list_item.actual_price),
+        'note': list_item.note,
+        'sort_order': list_item.sort_order,
+        'field_clocks': list_item.field_clocks,
+    }
+
+
+def _user_family_ids(user):
+    from .models import FamilyMember
+
+    return set(FamilyMember.objects.filter(user=user).values_list('family_id', flat=True))
+
+
+def changes_since(user, since=0, limit=PAGE_SIZE):
+    """
+    Return the lists and items changed since a cursor for the user's families.
+
+    Only the current state of each changed row is returned, however many
+    times it changed. Lists whose items changed are included too, since
+    their counters and version moved. A cursor of 0, or one whose changes
+    have been pruned, gets a snapshot of every list plus the items of the
+    active ones, with ``reset`` set so the client replaces its copy.
+
+    Returns:
+        Dict with ``cursor`` (pass back as ``since`` next time),
+        ``has_more``, ``reset``, ``lists``, ``items`` and ``deleted``
+        (``{'lists': [...], 'items': [...]}`` IDs)
+    """
+    from .models import ShoppingList, ShoppingListItem, SyncChange
+
+    family_ids = _user_family_ids(user)
+    latest = latest_cursor()
+
+    if since <= 0 or cursor_expired(since, latest):
+        lists = ShoppingList.objects.filter(family_id__in=family_ids)
+        items = ShoppingListItem.objects.filter(
+            shopping_list__family_id__in=family_ids, shopping_list__completed=False
+        ).select_related('item')
+        return {
+            'cursor': latest,
+            'has_more': False,
+            'reset': True,
+            'lists': [serialize_list(shopping_list) for shopping_list in lists],
+            'items': [serialize_item(list_item) for list_item in items],
+            'deleted': {'lists': [], 'items': []},
+        }
+
+    changes = SyncChange.objects.filter(family_id__in=family_ids, id__gt=since)
+    safe = settled_cursor(since)
+    if safe is not None:
+        changes = changes.filter(id__lte=safe)
+    changes = list(changes.order_by('id').values_list('id', 'model_name', 'record_id', 'list_id', 'deleted')[:limit + 1])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    # Later changes to the same row supersede earlier ones
+    latest_changes = {}
+    for _, model_name, record_id, list_id, deleted in changes:
+        latest_changes[(model_name, record_id)] = (list_id, deleted)
+
+    list_ids, item_ids = set(), set()
+    deleted_lists, deleted_items = set(), set()
+    for (model_name, record_id), (list_id, deleted) in latest_changes.items():
+        if model_name == LIST_MODEL:
+            (deleted_lists if deleted else list_ids).add(record_id)
+        else:
+            (deleted_items if deleted else item_ids).add(record_id)
+            list_ids.add(list_id)
+    list_ids -= deleted_lists
+
+    lists = list(ShoppingList.objects.filter(pk__in=list_ids, family_id__in=family_ids))
+    items = list(ShoppingListItem.objects.filter(
+        pk__in=item_ids, shopping_list__family_id__in=family_ids
+    ).select_related('item'))
+
+    # Rows that have gone since they changed; their tombstones may be on a later page
+    deleted_lists |= list_ids - {shopping_list.id for shopping_list in lists}
+    deleted_items |= item_ids - {list_item.id for list_item in items}
+
+    return {
+        'cursor': changes[-1][0] if changes else max(since, 0),
+        'has_more': has_more,
+        'reset': False,
+        'lists': [serialize_list(shopping_list) for shopping_list in lists],
+        'items': [serialize_item(list_item) for list_item in items],
+        'deleted': {'lists': sorted(deleted_lists), 'items': sorted(deleted_items)},
+    }
+
+
+class SyncBatch:
+    """State shared by the ops of one ingest request"""
+
+    def __init__(self, user, model_name):
+        self.user = user
+        self.model_name = model_name
+        self.family_ids = _user_family_ids(user)
+        # (model_name, temporary id) -> server id
+        self.temp_ids = {}
+
+    def resolve_id(self, model_name, record_id):
+        """Map a record ID to a server ID; negative IDs are offline temporary IDs"""
+        from .models import SyncLog
+
+        try:
+            record_id = int(record_id)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid record id: {record_id!r}")
+        if record_id >= 0:
+            return record_id
+
+        key = (model_name, record_id)
+        if key not in self.temp_ids:
+            self.temp_ids[key] = SyncLog.objects.filter(
+                user=self.user, model_name=model_name, operation='create',
+                synced=True, data__temp_id=record_id
+            ).values_list('record_id', flat=True).first()
+        if self.temp_ids[key] is None:
+            raise ValueError(f"Unknown temporary id: {record_id}")
+        return self.temp_ids[key]
+
+
+def apply_client_ops(user, model_name, ops):
+    """
+    Apply a batch of queued offline ops for one model.
+
+    Each op is ``{operation, record_id, data, op_id, clock, timestamp}``,
+    as queued by OfflineDataManager.addToSyncLog. Ops are applied in order, each in its
+    own savepoint so one bad op doesn't lose the rest of the batch. An op
+    whose op_id was already applied is skipped and reported as a duplicate.
+    Records created offline carry a negative ``temp_id`` in their data;
+    later ops may refer to them by it.
+
+    Returns:
+        Tuple of (per-op results, current state of every record touched)
+
+    Raises:
+        ValueError: If the model isn't synced
+    """
+    if model_name not in SYNC_MODELS:
+        raise ValueError(f"Unsupported sync model: {model_name!r}")
+
+    batch = SyncBatch(user, model_name)
+    results = []
+    records = {}
+    for op in ops:
+        result, record = _apply_op(batch, op)
+        results.append(result)
+        if record is not None:
+            serialized = serialize_list(record) if model_name == LIST_MODEL else serialize_item(record)
+            if result.get('temp_id') is not None:
+                serialized['temp_id'] = result['temp_id']
+            records[record.pk] = serialized
+    return results, list(records.values())
+
+
+def _apply_op(batch, op):
+    from .models import SyncLog
+
+    if not isinstance(op, dict) or op.get('operation') not in OPERATIONS:
+        return {'status': 'rejected', 'error': f"Unknown operation: {op!r}"}, None
+
+    operation = op['operation']
+    data = dict(op.get('data') or {})
+    data.pop('csrf_token', None)
+    op_id = str(op.get('op_id') or '')[:64] or None
+    result = {'op_id': op_id, 'temp_id': data.get('temp_id')}
+
+    if op_id:
+        done = SyncLog.objects.filter(user=batch.user, op_id=op_id, synced=True).first()
+        if done:
+            result.update(status='duplicate', record_id=done.record_id)
+            return result, _current_record(batch, done.record_id)
+
+    try:
+        clock = _op_clock(op, op_id)
+        with transaction.atomic():
+            log = SyncLog.objects.create(
+                user=batch.user, operation=operation, model_name=batch.model_name,
+                record_id=op.get('record_id') if isinstance(op.get('record_id'), int) else None,
+                data=data, op_id=op_id
+            )
+            if batch.model_name == LIST_MODEL:
+                record, record_id = _apply_list_op(batch, operation, op.get('record_id'), data)
+            else:
+                record, record_id = _apply_item_op(batch, operation, op.get('record_id'), data, clock)
+
+            log.record_id = record_id
+            log.synced = True
+            log.synced_at = timezone.now()
+            log.save(update_fields=['record_id', 'synced', 'synced_at'])
+    except IntegrityError as e:
+        done = SyncLog.objects.filter(user=batch.user, op_id=op_id).first() if op_id else None
+        if done is None:
+            result.update(status='rejected', error=str(e))
+            return result, None
+        # The same op arrived concurrently on another request
+        result.update(status='duplicate', record_id=done.record_id)
+        return result, _current_record(batch, done.record_id)
+    except (ValueError, InvalidOperation, ObjectDoesNotExist) as e:
+        result.update(status='rejected', error=str(e))
+        return result, None
+
+    if result['temp_id'] is not None and operation == 'create':
+        batch.temp_ids[(batch.model_name, int(result['temp_id']))] = record_id
+    result.update(status='applied' if record is not None or operation == 'delete' else 'gone',
+                  record_id=record_id)
+    return result, record
+
+
+def _op_clock(op, op_id):
+    """
+    The clock an op was made at, as a string: its ``clock``, or failing that
+    its queue timestamp with the op ID as the node. None if it has neither.
+    """
+    if op.get('clock'):
+        timestamp = Timestamp.parse(op['clock'])
+    elif isinstance(op.get('timestamp'), (int, float)) and op['timestamp'] >= 0:
+        timestamp = Timestamp(int(op['timestamp']), 0, op_id or 'client')
+    else:
+        return None
+    server_clock().observe(timestamp)
+    return str(timestamp)
+
+
+def _current_record(batch, record_id):
+    from .models import ShoppingList, ShoppingListItem
+
+    if record_id is None:
+        return None
+    if batch.model_name == LIST_MODEL:
+        return ShoppingList.objects.filter(pk=record_id, family_id__in=batch.family_ids).first()
+    return ShoppingListItem.objects.filter(
+        pk=record_id, shopping_list__family_id__in=batch.family_ids
+    ).select_related('item').first()
+
+
+def _apply_list_op(batch, operation, record_id, data):
+    """Returns (list or None if it no longer exists, list id)"""
+    from .models import GroceryStore, ShoppingList
+
+    fields = data.get('list_data', data)
+
+    if operation == 'create':
+        family_id = fields.get('family_id') or fields.get('family')
+        if family_id is None:
+            profile = getattr(batch.user, 'profile', None)
+            family_id = getattr(profile, 'default_family_id', None)
+        if family_id is None and len(batch.family_ids) == 1:
+            family_id = next(iter(batch.family_ids))
+        if family_id is None or int(family_id) not in batch.family_ids:
+            raise ValueError("A family you belong to is required")
+        store = GroceryStore.objects.get(pk=fields.get('store_id') or fields.get('store'))
+        name = (fields.get('name') or '').strip()
+        if not name:
+            raise ValueError("List name is required")
+
+        shopping_list = ShoppingList.objects.create(
+            name=name[:100], store=store, family_id=int(family_id), created_by=batch.user
+        )
+        return shopping_list, shopping_list.id
+
+    list_id = batch.resolve_id(LIST_MODEL, record_id)
+    shopping_list = ShoppingList.objects.filter(pk=list_id, family_id__in=batch.family_ids).first()
+    if shopping_list is None:
+        return None, list_id
+
+    if operation == 'delete':
+        shopping_list.delete()
+        return None, list_id
+
+    if fields.get('name'):
+        shopping_list.name = str(fields['name']).strip()[:100]
+    shopping_list.set_completed(
+        bool(fields['completed']) if 'completed' in fields else shopping_list.completed
+    )
+
+    return shopping_list, list_id
+
+
+def _apply_item_op(batch, operation, record_id, data, clock=None):
+    """Returns (list item or None if it no longer exists, list item id)"""
+    from .models import GroceryItem, ShoppingList, ShoppingListItem
+
+    fields = data.get('item_data', data)
+
+    if operation == 'create':
+        list_id = batch.resolve_id(LIST_MODEL, data.get('list_id', fields.get('shopping_list_id')))
+        shopping_list = ShoppingList.objects.get(pk=list_id, family_id__in=batch.family_ids)
+        item = GroceryItem.objects.get(pk=fields.get('item_id') or fields.get('item'))
+        quantity = Decimal(str(fields.get('quantity') or 1))
+        if not quantity.is_finite() or quantity <= 0:
+            raise ValueError(f"Invalid quantity: {fields.get('quantity')!r}")
+
+        list_item = ShoppingListItem.objects.create(
+            shopping_list=shopping_list,
+            item=item,
+            quantity=quantity,
+            unit=fields.get('unit') or '',
+            note=fields.get('note') or '',
+            field_clocks={
+                field: clock for field in ('quantity', 'unit', 'note') if clock and field in fields
+            }
+        )
+        return list_item, list_item.id
+
+    item_id = batch.resolve_id(ITEM_MODEL, record_id)
+    list_item = ShoppingListItem.objects.filter(
+        pk=item_id, shopping_list__family_id__in=batch.family_ids
+    ).select_related('shopping_list', 'item').first()
+    if list_item is None:
+        return None, item_id
+
+    if operation == 'delete':
+        list_item.delete()
+        return None, item_id
+
+    # Merged field by field with the op's clock, through the same path as in-store edits
+    item_ops = []
+    for kind, field in ShoppingList.ITEM_OPS.items():
+        if field in fields:
+            value_key = 'price' if kind == 'price' else field
+            item_ops.append({'op': kind, 'id': item_id, value_key: fields[field], 'clock': clock})
+    if item_ops:
+        list_item.shopping_list.apply_item_ops(item_ops)
+        list_item = ShoppingListItem.objects.select_related('item').get(pk=item_id)
+
+    return list_item, item_id
@@ -1,5 +1,7 @@
+from io import StringIO
+from django.core.management import call_command
 from django.test import TestCase
-from shopping.allergens import AllergenDetector, COMMON_ALLERGENS, DIETARY_PREFERENCES
+from shopping.allergens import AllergenDetector, COMMON_ALLERGENS, DIETARY_PREFERENCES, KeywordMatcher, ingredient_matches
 
 
 class AllergenDetectorTests(TestCase):
@@ -182,4 +184,80 @@ class AllergenDetectorTests(TestCase):
         
         # Mystery product should have unknown safety
         self.assertEqual(len(unknown), 1)
-        self.assertTrue(any(p['name'] == 'Mystery Product' for p in unknown))
\ No newline at end of file
+        self.assertTrue(any(p['name'] == 'Mystery Product' for p in unknown))
+
+
+class KeywordMatcherTests(TestCase):
+    """Tests for the compiled allergen and diet keyword matcher"""
+    
+    def test_matches_respect_word_boundaries(self):
+        """Keywords inside longer words are not matches"""
+        detected = AllergenDetector.detect_allergens({'ingredients': 'Eggplant, peppercorns, goats cheese'})
+        self.assertNotIn('eggs', detected)
+        self.assertNotIn('gluten', detected)
+        self.assertEqual(detected['dairy'], ['cheese'])
+        
+        conflicts = AllergenDetector.check_dietary_preferences({'ingredients': 'Eggplant, peppercorns'})
+        self.assertNotIn('keto', conflicts)
+        self.assertNotIn('vegan', conflicts)
+        
+    def test_keywords_inside_compound_words(self):
+        """Keywords are found inside longer words unless they're ambiguous"""
+        detected = AllergenDetector.detect_allergens(
+            {'ingredients': 'Buttermilk, milkfat, soymilk, oatmeal, wholewheat flour, cornstarch'}
+        )
+        self.assertEqual(detected['dairy'], ['butter', 'milk'])
+        self.assertEqual(detected['soy'], ['soy'])
+        self.assertEqual(detected['gluten'], ['oats', 'wheat'])
+        
+        conflicts = AllergenDetector.check_dietary_preferences({'ingredients': 'Cornstarch, licorice'})
+        self.assertEqual(conflicts['keto'], ['corn', 'starch'])
+        
+        detected = AllergenDetector.detect_allergens({'ingredients': 'Peanuts, coconut, nutmeg, tree nuts'})
+        self.assertEqual(detected['nuts'], ['nuts'])
+        
+    def test_plurals_and_phrases(self):
+        """Plurals match their keyword and multi-word keywords match as phrases"""
+        detected = AllergenDetector.detect_allergens({'ingredients': 'Roasted peanuts, brazil nuts, sesame seeds'})
+        self.assertEqual(detected['peanuts'], ['peanut'])
+        self.assertEqual(detected['nuts'], ['brazil nut', 'nuts'])
+        self.assertEqual(detected['sesame'], ['sesame', 'sesame seed'])
+        
+        conflicts = AllergenDetector.check_dietary_preferences({'ingredients': 'Refined sugar, eggs'})
+        self.assertEqual(conflicts['paleo'], ['refined sugar'])
+        self.assertEqual(conflicts['vegan'], ['egg'])
+        
+    def test_allergen_tags_are_matched(self):
+        """Open Food Facts style tags are matched by their words"""
+        product = {'ingredients': 'Water', 'allergens': ['en:sulphur-dioxide-and-sulphites', 'en:milk']}
+        detected = AllergenDetector.detect_allergens(product)
+        self.assertEqual(detected['sulfites'], ['en:sulphur-dioxide-and-sulphites'])
+        self.assertEqual(detected['dairy'], ['en:milk'])
+        
+    def test_overlapping_keywords_are_all_found(self):
+        """Every keyword is found in one pass, including ones inside other keywords"""
+        matcher = KeywordMatcher([('soy', 'soy'), ('soy lecithin', 'lecithin'), ('lecithin', 'e322')])
+        self.assertEqual(matcher.scan('Emulsifier: soy lecithin'), ['soy', 'lecithin', 'e322'])
+        self.assertEqual(matcher.scan('soybean oil'), ['soy'])
+        
+        bounded = KeywordMatcher([('soy', 'soy')], bounded={'soy': 'word'})
+        self.assertEqual(bounded.scan('soybean oil'), [])
+        self.assertEqual(bounded.scan('Soys, soy-sauce'), ['soy', 'soy'])
+        
+    def test_results_are_cached_by_ingredients(self):
+        """Scanning the same ingredients again is served from the cache"""
+        ingredient_matches.cache_clear()
+        product = {'ingredients': 'Oats, water, salt'}
+        
+        AllergenDetector.detect_allergens(product)
+        AllergenDetector.check_dietary_preferences(dict(product, name='Another Oat Drink'))
+        
+        info = ingredient_matches.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 1))
+        
+    def test_benchmark_command(self):
+        """The benchmark compares the compiled matcher with substring checks"""
+        out = StringIO()
+        call_command('benchmark_allergens', '--count', '20', '--rounds', '1', stdout=out)
+        self.assertIn('Scanning 20 products', out.getvalue())
+        self.assertIn('Compiled matcher, cached:', out.getvalue())
\ No newline at end of file
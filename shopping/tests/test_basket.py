@@ -0,0 +1,126 @@
+from decimal import Decimal
+
+import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from shopping.basket import compute_basket
+from shopping.models import (
+    Family, FamilyMember, GroceryItem, GroceryStore, ItemStoreInfo, ShoppingList, ShoppingListItem
+)
+
+
+class BasketPricingTests(TestCase):
+    """Tests for pricing a whole list across the family's stores"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+
+        self.a, self.b, self.c = (GroceryStore.objects.create(name=name) for name in ('Aldi', 'Budgens', 'Co-op'))
+        self.family.stores.add(self.a, self.b, self.c)
+        GroceryStore.objects.create(name='Elsewhere')
+
+        self.shopping_list = ShoppingList.objects.create(
+            name='Weekly', store=self.a, family=self.family, created_by=self.user
+        )
+        # None = no price at that store
+        prices = {
+            'Milk': ('1.00', '0.80', None),
+            'Bread': ('2.00', '2.50', '1.50'),
+            'Eggs': ('3.00', None, '3.20'),
+            'Caviar': (None, None, None),
+        }
+        for name, store_prices in prices.items():
+            item = GroceryItem.objects.create(name=name)
+            ShoppingListItem.objects.create(
+                shopping_list=self.shopping_list, item=item, quantity=2 if name == 'Milk' else 1
+            )
+            for store, price in zip((self.a, self.b, self.c), store_prices):
+                if price:
+                    ItemStoreInfo.objects.create(item=item, store=store, typical_price=Decimal(price))
+
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_store_totals_impute_missing_prices(self):
+        """A store without a price is charged the median of the others"""
+        basket = compute_basket(self.shopping_list)
+
+        self.assertEqual(
+            [(store['name'], store['total'], store['imputed_items']) for store in basket['stores']],
+            [('Co-op', '6.50', 1), ('Aldi', '7.00', 0), ('Budgens', '7.20', 1)]
+        )
+        self.assertEqual(basket['cheapest_store_id'], self.c.id)
+        self.assertEqual(basket['unpriced_items'], ['Caviar'])
+
+    def test_split_plan_buys_where_prices_are_known(self):
+        plan = compute_basket(self.shopping_list)['split_plan']
+
+        self.assertEqual((plan['total'], plan['savings']), ('6.30', '0.70'))
+        self.assertEqual(
+            [(trip['name'], [item['name'] for item in trip['items']]) for trip in plan['stores']],
+            [('Budgens', ['Milk']), ('Co-op', ['Bread', 'Eggs'])]
+        )
+
+        one_trip = compute_basket(self.shopping_list, max_stores=1)['split_plan']
+        self.assertEqual((one_trip['total'], one_trip['savings']), ('7.00', '0.00'))
+
+    def test_price_on_the_list_wins_at_its_store(self):
+        ShoppingListItem.objects.filter(item__name='Bread').update(actual_price=Decimal('1.00'))
+
+        totals = {store['name']: store['total'] for store in compute_basket(self.shopping_list)['stores']}
+        self.assertEqual(totals['Aldi'], '6.00')
+
+    def test_endpoint_is_cached_per_version_and_prices(self):
+        url = reverse('groceries:list_basket', args=[self.shopping_list.id])
+
+        with mock.patch('shopping.basket.compute_basket', wraps=compute_basket) as compute:
+            first = self.client.get(url).json()
+            self.assertEqual(self.client.get(url).json(), first)
+            self.assertEqual(compute.call_count, 1)
+
+            # Editing the list bumps its version
+            ShoppingListItem.objects.filter(item__name='Caviar').delete()
+            self.assertEqual(self.client.get(url).json()['unpriced_items'], [])
+
+            ItemStoreInfo.record_prices(self.b.id, {GroceryItem.objects.get(name='Eggs').id: '0.50'})
+            self.assertEqual(self.client.get(url).json()['cheapest_store_id'], self.b.id)
+            self.assertEqual(compute.call_count, 3)
+
+            # Prices at stores the family doesn't use leave its baskets alone
+            elsewhere = GroceryStore.objects.get(name='Elsewhere')
+            other_family = Family.objects.create(name='Other Family', created_by=self.user)
+            other_family.stores.add(elsewhere)
+            ItemStoreInfo.record_prices(elsewhere.id, {GroceryItem.objects.get(name='Eggs').id: '0.10'})
+            self.client.get(url)
+            self.assertEqual(compute.call_count, 3)
+
+        self.assertEqual(self.client.get(url, {'max_stores': 9}).status_code, 400)
+
+    def test_moving_the_list_to_another_store_reprices_it(self):
+        # Neither store has a price generation yet
+        cache.clear()
+        url = reverse('groceries:list_basket', args=[self.shopping_list.id])
+        self.assertEqual(
+            [store['id'] for store in self.client.get(url).json()['stores'] if store['is_list_store']], [self.a.id]
+        )
+        version = self.shopping_list.version
+
+        response = self.client.post(reverse('groceries:edit_list', args=[self.shopping_list.id]), {
+            'name': 'Weekly', 'store': self.c.id, 'family': self.family.id,
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.shopping_list.refresh_from_db()
+        self.assertEqual(self.shopping_list.version, version)
+        stores = {store['id']: store for store in self.client.get(url).json()['stores']}
+        self.assertTrue(stores[self.c.id]['is_list_store'])
+        self.assertFalse(stores[self.a.id]['is_list_store'])
+        self.client.logout()
+        User.objects.create_user(username='other', password='otherpassword')
+        self.client.login(username='other', password='otherpassword')
+        self.assertEqual(self.client.get(url).status_code, 404)
@@ -0,0 +1,113 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from shopping.models import (
+    CheapestItemPrice, Family, FamilyItemUsage, FamilyMember, GroceryItem, GroceryStore, ItemStoreInfo
+)
+
+
+class CheapestItemPriceTests(TestCase):
+    """Tests for maintaining the per-family cheapest item prices"""
+
+    def setUp(self):
+        self.family = Family.objects.create(name='Test Family')
+        self.corner = GroceryStore.objects.create(name='Corner Shop')
+        self.market = GroceryStore.objects.create(name='Market')
+        self.family.stores.add(self.corner, self.market)
+        self.milk = GroceryItem.objects.create(name='Milk')
+
+    def cheapest(self):
+        return CheapestItemPrice.objects.filter(family=self.family, item=self.milk).values_list('store', 'price').first()
+
+    def test_saved_prices_are_ranked(self):
+        """The typical price wins over the last price, which is the fallback"""
+        ItemStoreInfo.objects.create(item=self.milk, store=self.corner, typical_price=Decimal('1.20'), last_price=Decimal('0.50'))
+        ItemStoreInfo.objects.create(item=self.milk, store=self.market, last_price=Decimal('1.10'))
+        ItemStoreInfo.objects.create(item=self.milk, store=GroceryStore.objects.create(name='Elsewhere'), typical_price=Decimal('0.10'))
+
+        self.assertEqual(self.cheapest(), (self.market.id, Decimal('1.10')))
+
+        ItemStoreInfo.objects.filter(store=self.market).get().delete()
+        self.assertEqual(self.cheapest(), (self.corner.id, Decimal('1.20')))
+
+    def test_refresh_locks_the_families_in_scope(self):
+        """Concurrent refreshes of a family wait for each other instead of inserting the same rows"""
+        ItemStoreInfo.objects.create(item=self.milk, store=self.corner, typical_price=Decimal('1.20'))
+
+        with CaptureQueriesContext(connection) as context:
+            CheapestItemPrice.refresh(item_ids=[self.milk.id], store_ids=[self.corner.id])
+
+        locks = [query['sql'] for query in context.captured_queries if 'shopping_family' in query['sql']]
+        if connection.features.has_select_for_update:
+            self.assertTrue(any('FOR UPDATE' in sql for sql in locks))
+        self.assertEqual(self.cheapest(), (self.corner.id, Decimal('1.20')))
+
+    def test_recorded_prices_refresh(self):
+        ItemStoreInfo.objects.create(item=self.milk, store=self.corner, typical_price=Decimal('1.20'))
+        ItemStoreInfo.record_prices(self.market.id, {self.milk.id: '0.95'})
+
+        self.assertEqual(self.cheapest(), (self.market.id, Decimal('0.95')))
+
+    def test_store_links_refresh(self):
+        ItemStoreInfo.objects.create(item=self.milk, store=self.corner, typical_price=Decimal('1.20'))
+        ItemStoreInfo.objects.create(item=self.milk, store=self.market, typical_price=Decimal('0.90'))
+
+        self.family.stores.remove(self.market)
+        self.assertEqual(self.cheapest(), (self.corner.id, Decimal('1.20')))
+
+        self.market.families.add(self.family)
+        self.assertEqual(self.cheapest(), (self.market.id, Decimal('0.90')))
+
+        self.market.delete()
+        self.assertEqual(self.cheapest(), (self.corner.id, Decimal('1.20')))
+
+        self.corner.families.clear()
+        self.assertIsNone(self.cheapest())
+
+    def test_full_rebuild(self):
+        ItemStoreInfo.objects.bulk_create([
+            ItemStoreInfo(item=self.milk, store=self.corner, typical_price=Decimal('1.20')),
+            ItemStoreInfo(item=GroceryItem.objects.create(name='Bread'), store=self.market, average_price=Decimal('2.00')),
+        ])
+
+        self.assertEqual(CheapestItemPrice.refresh(batch_size=1), 2)
+        self.assertEqual(self.cheapest(), (self.corner.id, Decimal('1.20')))
+
+
+class GroceryItemListViewTests(TestCase):
+    """Tests for the lowest prices on the item catalogue page"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.home = Family.objects.create(name='Home', created_by=self.user)
+        self.cottage = Family.objects.create(name='Cottage', created_by=self.user)
+        for family in (self.home, self.cottage):
+            FamilyMember.objects.create(user=self.user, family=family)
+        self.corner = GroceryStore.objects.create(name='Corner Shop')
+        self.market = GroceryStore.objects.create(name='Market')
+        self.corner.families.add(self.home)
+        self.market.families.add(self.cottage)
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_lowest_price_across_the_users_families(self):
+        milk = GroceryItem.objects.create(name='Milk')
+        GroceryItem.objects.create(name='Bread', created_by=self.user)
+        GroceryItem.objects.create(name='Not mine')
+        for family in (self.home, self.cottage):
+            FamilyItemUsage.objects.create(family=family, item=milk)
+        ItemStoreInfo.objects.create(item=milk, store=self.corner, typical_price=Decimal('1.20'))
+        ItemStoreInfo.objects.create(item=milk, store=self.market, typical_price=Decimal('0.90'))
+
+        response = self.client.get(reverse('groceries:items'))
+
+        items = list(response.context['items'])
+        self.assertEqual([item.name for item in items], ['Bread', 'Milk'])
+        self.assertIsNone(items[0].lowest_price)
+        self.assertEqual((items[1].lowest_price, items[1].lowest_price_store_name), (Decimal('0.90'), 'Market'))
+        self.assertContains(response, '$0.90')
@@ -0,0 +1,83 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from shopping.models import Family, GroceryItem, FamilyItemUsage, FamilyNeighbour
+from shopping.collaborative import (
+    build_usage_matrix, compute_neighbours, rebuild_neighbours, recommend_from_neighbours
+)
+from shopping.recommender import ShoppingRecommender
+
+
+class UsageMatrixTests(TestCase):
+    """Tests for the family x item matrix and neighbour search"""
+    
+    def test_rows_are_normalised(self):
+        """Every family row has unit length so dot products are cosine similarities"""
+        family_ids, item_ids, matrix = build_usage_matrix([(1, 10, 3), (1, 11, 1), (2, 10, 5)])
+        
+        self.assertEqual(list(family_ids), [1, 2])
+        self.assertEqual(list(item_ids), [10, 11])
+        norms = matrix.multiply(matrix).sum(axis=1)
+        self.assertAlmostEqual(float(norms[0, 0]), 1.0, places=5)
+        self.assertAlmostEqual(float(norms[1, 0]), 1.0, places=5)
+        
+    def test_neighbours_sorted_and_exclude_self(self):
+        """Neighbours are ordered by similarity, capped at k and never include the family itself"""
+        rows = [
+            (1, 10, 1), (1, 11, 1), (1, 12, 1),
+            (2, 10, 1), (2, 11, 1), (2, 12, 1), (2, 13, 1),
+            (3, 10, 1),
+            (4, 99, 1),
+        ]
+        family_ids, _, matrix = build_usage_matrix(rows)
+        neighbours = {
+            int(family_ids[row]): [int(family_ids[col]) for col in cols]
+            for row, cols, _ in compute_neighbours(matrix, k=1, batch_size=2)
+        }
+        
+        self.assertEqual(neighbours[1], [2])
+        self.assertEqual(neighbours[3], [1])
+        self.assertEqual(neighbours[4], [])
+        
+    def test_empty_matrix(self):
+        """No usage rows gives an empty matrix rather than an error"""
+        family_ids, item_ids, matrix = build_usage_matrix([])
+        
+        self.assertEqual(len(family_ids), 0)
+        self.assertEqual(list(compute_neighbours(matrix)), [])
+
+
+class NeighbourRecommendationTests(TestCase):
+    """Tests for recommendations served from the persisted neighbour index"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Us', created_by=self.user)
+        self.similar = Family.objects.create(name='Similar')
+        self.other = Family.objects.create(name='Other')
+        
+        self.milk = GroceryItem.objects.create(name='Milk')
+        self.bread = GroceryItem.objects.create(name='Bread')
+        self.eggs = GroceryItem.objects.create(name='Eggs')
+        self.tofu = GroceryItem.objects.create(name='Tofu')
+        
+        for item in (self.milk, self.bread):
+            FamilyItemUsage.objects.create(family=self.family, item=item, usage_count=3)
+        for item in (self.milk, self.bread, self.eggs):
+            FamilyItemUsage.objects.create(family=self.similar, item=item, usage_count=3)
+        FamilyItemUsage.objects.create(family=self.other, item=self.tofu, usage_count=3)
+        
+    def test_no_index_returns_none(self):
+        """Without persisted neighbours the caller is told to fall back"""
+        self.assertIsNone(recommend_from_neighbours(self.family))
+        
+    def test_rebuild_and_recommend(self):
+        """Items from similar families the family hasn't bought are recommended"""
+        rebuild_neighbours(k=5)
+        
+        self.assertTrue(FamilyNeighbour.objects.filter(family=self.family, neighbour=self.similar).exists())
+        self.assertFalse(FamilyNeighbour.objects.filter(family=self.family, neighbour=self.other).exists())
+        self.assertEqual(
+            ShoppingRecommender._get_collaborative_recommendations(self.family, limit=5),
+            [self.eggs]
+        )
@@ -0,0 +1,153 @@
+import mock
+from django.contrib.auth.models import User
+from django.db import DatabaseError, models, transaction
+from django.test import TestCase, override_settings
+
+from shopping import counters
+from shopping.models import (
+    Family, GroceryStore, GroceryItem, FamilyItemUsage, ShoppingList, ShoppingListItem
+)
+
+
+@override_settings(POPULARITY_FLUSH_INTERVAL=3600, POPULARITY_FLUSH_THRESHOLD=1000)
+class PopularityCounterTests(TestCase):
+    """Tests for buffered popularity counters"""
+    
+    def setUp(self):
+        counters.get_buffer().drain()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        self.other_family = Family.objects.create(name='Other Family', created_by=self.user)
+        store = GroceryStore.objects.create(name='Test Store')
+        self.list = ShoppingList.objects.create(
+            name='Weekly', store=store, family=self.family, created_by=self.user
+        )
+        self.other_list = ShoppingList.objects.create(
+            name='Other', store=store, family=self.other_family, created_by=self.user
+        )
+        self.milk = GroceryItem.objects.create(name='Milk', global_popularity=5)
+        self.eggs = GroceryItem.objects.create(name='Eggs')
+        FamilyItemUsage.objects.create(family=self.family, item=self.milk, usage_count=2)
+        
+    def add_items(self, *pairs):
+        with self.captureOnCommitCallbacks(execute=True):
+            for shopping_list, item in pairs:
+                ShoppingListItem.objects.create(shopping_list=shopping_list, item=item)
+                
+    def usage(self, family, item):
+        return FamilyItemUsage.objects.get(family=family, item=item).usage_count
+    
+    def test_increments_are_buffered_until_flush(self):
+        """Adding items doesn't touch the counters until the buffer is flushed"""
+        self.add_items((self.list, self.milk), (self.list, self.milk), (self.other_list, self.milk),
+                       (self.list, self.eggs))
+        
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.global_popularity, 5)
+        
+        self.assertEqual(counters.flush(), (2, 3))
+        
+        self.milk.refresh_from_db()
+        self.eggs.refresh_from_db()
+        self.assertEqual(self.milk.global_popularity, 8)
+        self.assertEqual(self.eggs.global_popularity, 1)
+        self.assertEqual(self.usage(self.family, self.milk), 4)
+        self.assertEqual(self.usage(self.other_family, self.milk), 1)
+        self.assertEqual(self.usage(self.family, self.eggs), 1)
+        
+    def test_flush_matches_immediate_increments(self):
+        """A flush leaves the same counts as calling increment_popularity per add"""
+        self.add_items((self.list, self.milk), (self.other_list, self.eggs))
+        counters.flush()
+        
+        self.milk.increment_popularity(family=self.family)
+        self.eggs.increment_popularity(family=self.other_family)
+        
+        self.milk.refresh_from_db()
+        self.eggs.refresh_from_db()
+        self.assertEqual((self.milk.global_popularity, self.eggs.global_popularity), (7, 2))
+        self.assertEqual(self.usage(self.family, self.milk), 4)
+        self.assertEqual(self.usage(self.other_family, self.eggs), 2)
+        
+    def test_threshold_triggers_flush(self):
+        """Reaching the threshold flushes without waiting for the interval"""
+        with self.settings(POPULARITY_FLUSH_THRESHOLD=2):
+            self.add_items((self.list, self.eggs), (self.list, self.eggs))
+        
+        self.eggs.refresh_from_db()
+        self.assertEqual(self.eggs.global_popularity, 2)
+        
+    def test_rolled_back_adds_are_not_counted(self):
+        """Increments from a rolled back transaction never reach the buffer"""
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    ShoppingListItem.objects.create(shopping_list=self.list, item=self.eggs)
+                    raise ValueError
+            except ValueError:
+                pass
+        
+        self.assertEqual(counters.flush(), (0, 0))
+        
+    def test_copied_list_counts_each_item(self):
+        """Copying a list buffers one increment per copied item"""
+        self.add_items((self.list, self.milk), (self.list, self.eggs))
+        counters.flush()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.list.duplicate()
+        counters.flush()
+        
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.global_popularity, 7)
+        self.assertEqual(self.usage(self.family, self.milk), 4)
+        self.assertEqual(self.usage(self.family, self.eggs), 2)
+        
+    def test_failed_insert_is_not_counted(self):
+        """An add whose insert fails never reaches the buffer"""
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch.object(models.Model, 'save_base', side_effect=DatabaseError):
+                with self.assertRaises(DatabaseError):
+                    ShoppingListItem.objects.create(shopping_list=self.list, item=self.eggs)
+        
+        self.assertEqual(counters.flush(), (0, 0))
+        
+    def test_failed_flush_keeps_increments(self):
+        """Increments drained by a flush that fails are applied by the next one"""
+        self.add_items((self.list, self.milk), (self.list, self.eggs))
+        
+        with mock.patch('shopping.counters.apply_increments', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                counters.flush()
+        
+        self.assertEqual(counters.flush(), (2, 2))
+        self.milk.refresh_from_db()
+        self.assertEqual(self.milk.global_popularity, 6)
+        self.assertEqual(self.usage(self.family, self.eggs), 1)
+        
+    def test_increments_for_deleted_families_are_dropped(self):
+        """A family deleted before the flush doesn't fail the rest of the batch"""
+        self.add_items((self.list, self.milk))
+        gone_id = Family.objects.create(name='Gone', created_by=self.user).id
+        counters.get_buffer().add({self.eggs.id: 1}, gone_id)
+        Family.objects.filter(id=gone_id).delete()
+        
+        counters.flush()
+        
+        self.assertEqual(self.usage(self.family, self.milk), 3)
+        self.assertFalse(FamilyItemUsage.objects.filter(family_id=gone_id).exists())
+        self.assertEqual(counters.flush(), (0, 0))
+        
+    def test_idle_buffer_is_flushed_in_background(self):
+        """The background loop flushes once the interval passes without an add"""
+        self.add_items((self.list, self.eggs))
+        
+        with self.settings(POPULARITY_FLUSH_INTERVAL=0), \
+                mock.patch('shopping.counters.connection') as thread_connection, \
+                mock.patch('shopping.counters.time.sleep', side_effect=[None, SystemExit]):
+            with self.assertRaises(SystemExit):
+                counters._flush_periodically()
+        
+        thread_connection.close.assert_called_once()
+        self.eggs.refresh_from_db()
+        self.assertEqual(self.eggs.global_popularity, 1)
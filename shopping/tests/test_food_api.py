@@ -4,6 +4,7 @@ import mock
 import json
 from requests.exceptions import RequestException
 
+from shopping import off_client
 from shopping.food_api import OpenFoodFactsAPI
 
 
@@ -28,6 +29,8 @@ class OpenFoodFactsAPITests(TestCase):
     def setUp(self):
         # Clear cache before each test
         cache.clear()
+        # Start with a fresh client (and a closed circuit)
+        off_client._client = None
         
         # Sample product data for testing
         self.sample_product_data = {
@@ -107,7 +110,7 @@ class OpenFoodFactsAPITests(TestCase):
             ]
         }
     
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_get_product_success(self, mock_get):
         """Test successful product retrieval"""
         # Configure mock
@@ -119,8 +122,8 @@ class OpenFoodFactsAPITests(TestCase):
         # Check that the request was made correctly
         mock_get.assert_called_once_with(
             "https://world.openfoodfacts.org/api/v0/product/123456789012.json",
-            headers={"User-Agent": OpenFoodFactsAPI.USER_AGENT},
-            timeout=5
+            params=None,
+            timeout=(off_client.CONNECT_TIMEOUT, 5)
         )
         
         # Check returned data
@@ -132,7 +135,7 @@ class OpenFoodFactsAPITests(TestCase):
         self.assertEqual(product["allergens"], ["milk", "nuts"])
         self.assertEqual(product["nutrition_data"]["energy"], 250)
         
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_get_product_not_found(self, mock_get):
         """Test product not found"""
         # Configure mock
@@ -147,7 +150,7 @@ class OpenFoodFactsAPITests(TestCase):
         # Check that None is returned
         self.assertIsNone(product)
         
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_get_product_request_error(self, mock_get):
         """Test handling of request errors"""
         # Configure mock to raise an exception
@@ -159,7 +162,7 @@ class OpenFoodFactsAPITests(TestCase):
         # Check that None is returned on error
         self.assertIsNone(product)
         
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_get_product_caching(self, mock_get):
         """Test that product data is cached"""
         # Configure mock
@@ -176,7 +179,7 @@ class OpenFoodFactsAPITests(TestCase):
         # Check that both calls returned the same data
         self.assertEqual(product1, product2)
         
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_search_products_success(self, mock_get):
         """Test successful product search"""
         # Configure mock
@@ -196,7 +199,7 @@ class OpenFoodFactsAPITests(TestCase):
         self.assertEqual(results["products"][0]["name"], "Test Product 1")
         self.assertEqual(results["products"][1]["name"], "Test Product 2")
         
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_search_products_with_filters(self, mock_get):
         """Test search with category and brand filters"""
         # Configure mock
@@ -217,7 +220,7 @@ class OpenFoodFactsAPITests(TestCase):
         self.assertEqual(kwargs["params"]["tagtype_1"], "brands")
         self.assertEqual(kwargs["params"]["tag_1"], "Test Brand")
         
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_search_products_error(self, mock_get):
         """Test handling of search errors"""
         # Configure mock to raise an exception
@@ -230,7 +233,7 @@ class OpenFoodFactsAPITests(TestCase):
         self.assertEqual(len(results["products"]), 0)
         self.assertEqual(results["total"], 0)
         
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_get_categories_success(self, mock_get):
         """Test successful category retrieval"""
         # Configure mock
@@ -242,8 +245,8 @@ class OpenFoodFactsAPITests(TestCase):
         # Check that the request was made correctly
         mock_get.assert_called_once_with(
             "https://world.openfoodfacts.org/api/v0/categories.json",
-            headers={"User-Agent": OpenFoodFactsAPI.USER_AGENT},
-            timeout=10
+            params=None,
+            timeout=(off_client.CONNECT_TIMEOUT, 10)
         )
         
         # Check returned data
@@ -254,7 +257,7 @@ class OpenFoodFactsAPITests(TestCase):
         # Check that categories are sorted by product count
         self.assertTrue(categories[0]["products"] >= categories[1]["products"])
         
-    @mock.patch('shopping.food_api.requests.get')
+    @mock.patch('shopping.off_client.requests.Session.get')
     def test_get_categories_error(self, mock_get):
         """Test handling of category retrieval errors"""
         # Configure mock to raise an exception
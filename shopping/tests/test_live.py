@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import mock
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from shopping import live
+from shopping.models import (
+    Family, FamilyMember, GroceryStore, GroceryItem, ShoppingList, ShoppingListItem
+)
+
+
+class ListEventsTests(TestCase):
+    """Tests for live list updates over Server-Sent Events"""
+
+    def setUp(self):
+        # The in-process broker stands in for Redis
+        live._broker = live.MemoryBroker()
+
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+        store = GroceryStore.objects.create(name='Test Store')
+        self.list = ShoppingList.objects.create(
+            name='Weekly', store=store, family=self.family, created_by=self.user
+        )
+        self.milk = GroceryItem.objects.create(name='Milk')
+        self.eggs = GroceryItem.objects.create(name='Eggs')
+        self.milk_line = ShoppingListItem.objects.create(shopping_list=self.list, item=self.milk)
+        self.url = reverse('groceries:list_events', args=[self.list.id])
+
+    def tearDown(self):
+        live._broker = None
+
+    def toggle_milk_and_add_eggs(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.list.apply_item_ops([{'op': 'toggle', 'id': self.milk_line.id, 'checked': True}])
+            ShoppingListItem.objects.create(shopping_list=self.list, item=self.eggs)
+
+    async def open_stream(self, headers=None):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url, headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        # The retry hint is sent once the stream is subscribed
+        self.assertIn(b'retry:', await anext(stream))
+        return stream
+
+    def parse_event(self, chunk):
+        fields = dict(line.split(': ', 1) for line in chunk.decode().strip().split('\n'))
+        self.assertEqual(fields['event'], 'changes')
+        return int(fields['id']), json.loads(fields['data'])
+
+    async def test_changes_are_pushed_to_viewers(self):
+        stream = await self.open_stream()
+
+        await sync_to_async(self.toggle_milk_and_add_eggs)()
+
+        _, toggled = self.parse_event(await asyncio.wait_for(anext(stream), 5))
+        self.assertEqual([item['id'] for item in toggled['items']], [self.milk_line.id])
+        self.assertTrue(toggled['items'][0]['checked'])
+        self.assertEqual(toggled['list']['checked_items'], 1)
+
+        _, added = self.parse_event(await asyncio.wait_for(anext(stream), 5))
+        self.assertEqual([item['name'] for item in added['items']], ['Eggs'])
+        self.assertEqual(added['list']['total_items'], 2)
+
+    async def test_reconnect_catches_up_from_last_event_id(self):
+        await sync_to_async(self.toggle_milk_and_add_eggs)()
+        eggs_line_id = await sync_to_async(
+            lambda: self.list.items.get(item=self.eggs).id
+        )()
+
+        stream = await self.open_stream(headers={'Last-Event-ID': '0'})
+        cursor, missed = self.parse_event(await asyncio.wait_for(anext(stream), 5))
+        self.assertEqual(
+            {item['id'] for item in missed['items']}, {self.milk_line.id, eggs_line_id}
+        )
+        self.assertGreater(cursor, 0)
+
+    async def test_reconnect_replays_every_missed_page(self):
+        await sync_to_async(self.toggle_milk_and_add_eggs)()
+
+        with mock.patch('shopping.sync.PAGE_SIZE', 1):
+            stream = await self.open_stream(headers={'Last-Event-ID': '0'})
+            first_cursor, toggled = self.parse_event(await asyncio.wait_for(anext(stream), 5))
+            second_cursor, added = self.parse_event(await asyncio.wait_for(anext(stream), 5))
+
+        self.assertEqual([item['id'] for item in toggled['items']], [self.milk_line.id])
+        self.assertEqual([item['name'] for item in added['items']], ['Eggs'])
+        self.assertGreater(second_cursor, first_cursor)
+        # Caught up, the stream goes back to waiting for live changes
+        with mock.patch('shopping.live.KEEPALIVE_SECONDS', 0):
+            self.assertEqual(await asyncio.wait_for(anext(stream), 5), b': keepalive\n\n')
+
+    def test_nothing_is_published_without_viewers(self):
+        """Deltas are only built for lists somebody is watching"""
+        with self.assertNumQueries(0):
+            live.publish_changes([])
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingListItem.objects.create(shopping_list=self.list, item=self.eggs)
+        self.assertEqual(live.get_broker().watched([live.channel_name(self.list.id)]), set())
+
+    def test_other_families_cannot_subscribe(self):
+        outsider = User.objects.create_user(username='outsider', password='testpassword')
+        self.client.force_login(outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
@@ -395,4 +395,93 @@ class ShoppingListTests(TestCase):
         
         eggs_item = duplicated_items.filter(item=self.item2).first()
         self.assertEqual(eggs_item.quantity, Decimal('12'))
-        self.assertEqual(eggs_item.unit, 'count')
\ No newline at end of file
+        self.assertEqual(eggs_item.unit, 'count')
+        
+    def test_duplicate_copies_in_bulk(self):
+        """Duplicating runs the same number of queries however long the list is"""
+        ItemStoreInfo.objects.create(item=self.item1, store=self.store, typical_price=Decimal('3.00'))
+        self.list_item1.checked = True
+        self.list_item1.save()
+        
+        with self.captureQueries() as small_list_queries:
+            duplicate = self.shopping_list.duplicate()
+        
+        for position in range(20):
+            item = GroceryItem.objects.create(name=f'Item {position}')
+            ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=item)
+        
+        with self.captureQueries() as long_list_queries:
+            self.shopping_list.duplicate()
+        
+        self.assertEqual(len(long_list_queries), len(small_list_queries))
+        duplicate.refresh_from_db()
+        self.assertEqual((duplicate.item_count, duplicate.checked_count), (2, 0))
+        self.assertEqual(duplicate.estimated_total, Decimal('3.00'))
+        self.assertFalse(duplicate.items.filter(checked=True).exists())
+    
+    def captureQueries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        return CaptureQueriesContext(connection)
+
+class ShoppingListCounterTests(TestCase):
+    """Tests for the stored item/checked/cost counters on ShoppingList"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.shopping_list = ShoppingList.objects.create(
+            name='Test List', store=self.store, family=self.family, created_by=self.user
+        )
+        self.milk = GroceryItem.objects.create(name='Milk')
+        self.eggs = GroceryItem.objects.create(name='Eggs')
+        ItemStoreInfo.objects.create(item=self.milk, store=self.store, typical_price=Decimal('2.50'))
+        
+    def assertCounters(self, item_count, checked_count, estimated_total):
+        stored = ShoppingList.objects.get(pk=self.shopping_list.pk)
+        self.assertEqual(
+            (stored.item_count, stored.checked_count, stored.estimated_total),
+            (item_count, checked_count, Decimal(estimated_total))
+        )
+        
+    def test_counters_follow_item_changes(self):
+        """Creating, toggling, pricing and removing items keeps the counters exact"""
+        milk = ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=self.milk, quantity=2)
+        eggs = ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=self.eggs, quantity=12)
+        self.assertCounters(2, 0, '5.00')
+        
+        eggs = ShoppingListItem.objects.get(pk=eggs.pk)
+        eggs.checked = True
+        eggs.actual_price = 0.25
+        eggs.save()
+        self.assertCounters(2, 1, '8.00')
+        
+        ShoppingListItem.objects.get(pk=milk.pk).delete()
+        self.assertCounters(1, 1, '3.00')
+        
+    def test_stale_list_save_keeps_counters(self):
+        """Saving an outdated copy of the list doesn't overwrite its counters"""
+        stale = ShoppingList.objects.get(pk=self.shopping_list.pk)
+        ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=self.eggs)
+        
+        stale.name = 'Renamed'
+        stale.save()
+        
+        self.assertCounters(1, 0, '0.00')
+        self.assertEqual(ShoppingList.objects.get(pk=stale.pk).name, 'Renamed')
+        
+    def test_reconcile_command_fixes_drift(self):
+        """The reconcile command rewrites counters that no longer match the items"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=self.milk)
+        ShoppingListItem.objects.filter(shopping_list=self.shopping_list).update(checked=True)
+        self.assertCounters(1, 0, '2.50')
+        
+        out = StringIO()
+        call_command('reconcile_list_counters', stdout=out)
+        
+        self.assertCounters(1, 1, '2.50')
+        self.assertIn('fixed counters on 1', out.getvalue())
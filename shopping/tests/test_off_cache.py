@@ -0,0 +1,132 @@
+import time
+from io import StringIO
+
+import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from requests.exceptions import ConnectionError
+
+from shopping import off_cache, off_client
+from shopping.food_api import CACHE_KINDS, CACHE_TIMEOUT, OpenFoodFactsAPI
+from shopping.tests.test_food_api import MockResponse
+
+
+def product_response(name):
+    return MockResponse({'status': 1, 'product': {'code': '5000000000001', 'product_name': name}})
+
+
+class ImmediateExecutor:
+    """Runs background refreshes inline so tests can see their result"""
+
+    def submit(self, func, *args):
+        func(*args)
+
+
+class LookupCacheTests(TestCase):
+    """Tests for negative caching, stable keys and stale-while-revalidate"""
+
+    def setUp(self):
+        cache.clear()
+        off_client._client = None
+        patcher = mock.patch.object(off_cache, '_executor', ImmediateExecutor())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stats(self, kind='product'):
+        return off_cache.cache_stats(CACHE_KINDS)[kind]
+
+    def test_keys_are_stable_digests(self):
+        # Python's hash() is salted per process, so keys use a digest instead
+        key = off_cache.digest_key('search', 'milk', 1, 20, [], [])
+        self.assertEqual(key, 'off:search:45437a51e277406a0abcca57ccd14ce2c4c254f5')
+        self.assertNotEqual(key, off_cache.digest_key('search', 'milk', 2, 20, [], []))
+        self.assertNotEqual(
+            off_cache.digest_key('search', 'a_b', 1, 20, [], []),
+            off_cache.digest_key('search', 'a', 1, 20, ['b'], []),
+        )
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_unknown_barcodes_are_cached(self, mock_get):
+        mock_get.return_value = MockResponse({'status': 0, 'status_verbose': 'product not found'})
+
+        self.assertIsNone(OpenFoodFactsAPI.get_product('0000000000000'))
+        self.assertIsNone(OpenFoodFactsAPI.get_product('0000000000000'))
+
+        self.assertEqual(mock_get.call_count, 1)
+        stats = self.stats()
+        self.assertEqual((stats['miss'], stats['negative_hit']), (1, 1))
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_unknown_barcodes_are_retried_sooner_than_known_ones(self, mock_get):
+        mock_get.return_value = MockResponse({'status': 0})
+        OpenFoodFactsAPI.get_product('0000000000000')
+
+        later = time.time() + off_cache.negative_timeout() + 1
+        self.assertLess(off_cache.negative_timeout(), CACHE_TIMEOUT)
+        mock_get.return_value = product_response('New Store Brand')
+        with mock.patch('shopping.off_cache.time.time', return_value=later):
+            # Served stale while the refresh finds the product
+            self.assertIsNone(OpenFoodFactsAPI.get_product('0000000000000'))
+            self.assertEqual(OpenFoodFactsAPI.get_product('0000000000000')['name'], 'New Store Brand')
+        self.assertEqual(mock_get.call_count, 2)
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_failures_are_not_cached(self, mock_get):
+        mock_get.side_effect = ConnectionError('down')
+        self.assertIsNone(OpenFoodFactsAPI.get_product('5000000000001'))
+
+        mock_get.side_effect = None
+        mock_get.return_value = product_response('Oat Drink')
+        self.assertEqual(OpenFoodFactsAPI.get_product('5000000000001')['name'], 'Oat Drink')
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_stale_entries_are_served_while_refreshing(self, mock_get):
+        mock_get.return_value = product_response('Oat Drink')
+        OpenFoodFactsAPI.get_product('5000000000001')
+
+        mock_get.return_value = product_response('Oat Drink Barista')
+        later = time.time() + CACHE_TIMEOUT + 1
+        with mock.patch('shopping.off_cache.time.time', return_value=later):
+            self.assertEqual(OpenFoodFactsAPI.get_product('5000000000001')['name'], 'Oat Drink')
+            self.assertEqual(OpenFoodFactsAPI.get_product('5000000000001')['name'], 'Oat Drink Barista')
+
+        stats = self.stats()
+        self.assertEqual((stats['miss'], stats['stale'], stats['hit']), (1, 1, 1))
+        self.assertEqual(stats['stored'], 2)
+        # Both writes count, though the second replaced the first
+        self.assertGreater(stats['bytes_written'], len('Oat Drink Barista') + len('Oat Drink'))
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_failed_refresh_keeps_serving_stale(self, mock_get):
+        mock_get.return_value = product_response('Oat Drink')
+        OpenFoodFactsAPI.get_product('5000000000001')
+
+        mock_get.side_effect = ConnectionError('down')
+        later = time.time() + CACHE_TIMEOUT + 1
+        with mock.patch('shopping.off_cache.time.time', return_value=later):
+            for _ in range(2):
+                self.assertEqual(OpenFoodFactsAPI.get_product('5000000000001')['name'], 'Oat Drink')
+
+    def test_only_one_refresh_per_key_at_a_time(self):
+        lookups = off_cache.LookupCache('product', 60)
+        key = lookups.key('5000000000001')
+        lookups.store(key, {'name': 'Oat Drink'})
+
+        submitted = []
+        with mock.patch.object(off_cache, '_executor', mock.Mock(submit=lambda *args: submitted.append(args))), \
+                mock.patch('shopping.off_cache.time.time', return_value=time.time() + 61):
+            for _ in range(3):
+                lookups.peek(key, lambda: {'name': 'Oat Drink Barista'})
+        self.assertEqual(len(submitted), 1)
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_stats_command(self, mock_get):
+        mock_get.return_value = product_response('Oat Drink')
+        OpenFoodFactsAPI.get_product('5000000000001')
+        OpenFoodFactsAPI.get_product('5000000000001')
+
+        out = StringIO()
+        call_command('off_cache_stats', '--reset', stdout=out)
+        self.assertIn('product: 1 hits, 0 negative hits, 0 stale, 1 misses (hit ratio 50.0%)', out.getvalue())
+        self.assertEqual(self.stats()['hit'], 0)
@@ -0,0 +1,215 @@
+import asyncio
+import threading
+import time
+
+import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from requests.exceptions import ConnectionError
+
+from shopping import off_client
+from shopping.models import GroceryItem
+from shopping.off_client import CircuitBreaker, OpenFoodFactsClient, OpenFoodFactsUnavailable
+from shopping.tests.test_food_api import MockResponse
+
+PRODUCT = {
+    'status': 1,
+    'code': '5000000000001',
+    'product': {
+        'code': '5000000000001',
+        'product_name': 'Oat Drink',
+        'brands': 'Oatly',
+        'categories_hierarchy': ['en:beverages', 'en:plant-based-foods', 'en:oat-milks'],
+        'image_url': 'https://example.com/oat.jpg',
+    },
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(TestCase):
+    """Tests for the consecutive-failure circuit breaker"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.is_open)
+        self.assertFalse(self.breaker.allow())
+
+    def test_single_trial_request_after_reset_timeout(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+
+        self.clock.now = 30
+        self.assertTrue(self.breaker.allow())
+        # Only one trial at a time
+        self.assertFalse(self.breaker.allow())
+
+        # A failed trial opens the circuit for another reset timeout
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.clock.now = 60
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertFalse(self.breaker.is_open)
+        self.assertTrue(self.breaker.allow())
+
+
+class OpenFoodFactsClientTests(TestCase):
+    """Tests for pooled, coalesced and limited OFF requests"""
+
+    def setUp(self):
+        self.client_ = OpenFoodFactsClient(
+            max_per_host=2, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        )
+
+    def test_open_circuit_fails_fast(self):
+        with mock.patch.object(self.client_.session, 'get', side_effect=ConnectionError('down')) as get:
+            for _ in range(2):
+                with self.assertRaises(ConnectionError):
+                    self.client_.fetch_product('1')
+            with self.assertRaises(OpenFoodFactsUnavailable):
+                self.client_.fetch_product('1')
+        self.assertEqual(get.call_count, 2)
+
+    def test_unknown_barcode_is_not_a_failure(self):
+        with mock.patch.object(self.client_.session, 'get', return_value=MockResponse({}, status_code=404)):
+            for _ in range(3):
+                self.assertIsNone(self.client_.fetch_product('1'))
+        self.assertFalse(self.client_.breaker.is_open)
+
+    def test_concurrent_lookups_of_a_barcode_share_one_request(self):
+        release = threading.Event()
+
+        def slow_get(*args, **kwargs):
+            release.wait(5)
+            return MockResponse(PRODUCT)
+
+        results = []
+        with mock.patch.object(self.client_.session, 'get', side_effect=slow_get) as get:
+            threads = [
+                threading.Thread(target=lambda: results.append(self.client_.fetch_product('5000000000001')))
+                for _ in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            while not get.called:
+                time.sleep(0.01)
+            # Let the other threads join the request in flight
+            time.sleep(0.1)
+            release.set()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(results, [PRODUCT] * 5)
+
+    def test_busy_host_fails_fast(self):
+        release = threading.Event()
+
+        def slow_get(*args, **kwargs):
+            release.wait(5)
+            return MockResponse(PRODUCT)
+
+        with mock.patch.object(self.client_.session, 'get', side_effect=slow_get) as get, \
+                mock.patch.object(off_client, 'SLOT_TIMEOUT', 0.01):
+            # Different barcodes, so nothing is coalesced
+            threads = [threading.Thread(target=self.client_.fetch_product, args=(str(n),)) for n in range(2)]
+            for thread in threads:
+                thread.start()
+            while get.call_count < 2:
+                time.sleep(0.01)
+            with self.assertRaises(OpenFoodFactsUnavailable):
+                self.client_.fetch_product('3')
+            release.set()
+            for thread in threads:
+                thread.join()
+        # Being busy says nothing about OFF's health
+        self.assertFalse(self.client_.breaker.is_open)
+
+    def test_trial_request_survives_a_busy_host_or_a_crash(self):
+        clock = FakeClock()
+        self.client_.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+        self.client_.breaker.record_failure()
+        clock.now = 30
+
+        # Busy: the trial isn't started, so it isn't left running
+        slot = self.client_._host_slot(off_client.BASE_URL)
+        for _ in range(2):
+            slot.acquire()
+        with mock.patch.object(off_client, 'SLOT_TIMEOUT', 0.01), self.assertRaises(OpenFoodFactsUnavailable):
+            self.client_.fetch_product('1')
+        for _ in range(2):
+            slot.release()
+
+        # A trial that ends in neither success nor failure lets the next one through
+        with mock.patch.object(self.client_.session, 'get', side_effect=RuntimeError('bug')):
+            with self.assertRaises(RuntimeError):
+                self.client_.fetch_product('1')
+
+        with mock.patch.object(self.client_.session, 'get', return_value=MockResponse(PRODUCT)):
+            self.assertEqual(self.client_.fetch_product('1'), PRODUCT)
+        self.assertFalse(self.client_.breaker.is_open)
+
+    async def test_async_lookups_of_a_barcode_share_one_request(self):
+        with mock.patch.object(self.client_.session, 'get', return_value=MockResponse(PRODUCT)) as get:
+            results = await asyncio.gather(*[
+                self.client_.afetch_product('5000000000001') for _ in range(5)
+            ])
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(results, [PRODUCT] * 5)
+
+
+class BarcodeSearchViewTests(TestCase):
+    """BarcodeSearchView looks products up through the shared client"""
+
+    def setUp(self):
+        cache.clear()
+        off_client._client = None
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+
+    def tearDown(self):
+        off_client._client = None
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_unknown_barcode_is_imported_from_open_food_facts(self, mock_get):
+        mock_get.return_value = MockResponse(PRODUCT)
+
+        response = self.client.get('/api/items/barcode/5000000000001/')
+
+        data = response.json()
+        self.assertTrue(data['found'])
+        self.assertEqual(data['name'], 'Oat Drink')
+        self.assertEqual(data['category'], 'Oat Milks')
+        item = GroceryItem.objects.get(barcode='5000000000001')
+        self.assertEqual(item.off_id, '5000000000001')
+        self.assertEqual(mock_get.call_args.kwargs['timeout'], (off_client.CONNECT_TIMEOUT, 5))
+
+    def test_open_food_facts_outage_does_not_hold_the_request(self):
+        off_client.get_client().breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        off_client.get_client().breaker.record_failure()
+
+        with mock.patch('shopping.off_client.requests.Session.get') as mock_get:
+            response = self.client.get('/api/items/barcode/5000000000001/')
+
+        mock_get.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['found'])
@@ -0,0 +1,97 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+import mock
+from django.core.management import call_command
+from django.test import TestCase
+
+from shopping.food_api import OpenFoodFactsAPI
+from shopping.models import OpenFoodFactsProduct
+from shopping.off_dump import import_products, iter_products
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+JSONL_DUMP = os.path.join(FIXTURES, 'off_products.jsonl')
+CSV_DUMP = os.path.join(FIXTURES, 'off_products.csv')
+
+
+class OpenFoodFactsDumpImportTests(TestCase):
+    """Tests for importing the Open Food Facts data dump into the local mirror"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def import_dump(self, path, *args):
+        out = StringIO()
+        call_command('import_off_dump', path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_jsonl_dump_is_imported(self):
+        output = self.import_dump(JSONL_DUMP)
+
+        self.assertIn('Imported 2 new and 0 updated products (1 unchanged, 1 without a barcode)', output)
+        oat_drink = OpenFoodFactsProduct.objects.get(pk='5000000000001')
+        # The older duplicate later in the dump doesn't win
+        self.assertEqual(oat_drink.data['name'], 'Oat Drink')
+        self.assertEqual(oat_drink.data['category'], 'Oat Milks')
+        self.assertEqual(oat_drink.data['allergens'], ['gluten'])
+        self.assertEqual(oat_drink.last_modified, 1700000000)
+
+    def test_csv_dump_is_imported(self):
+        gzipped = os.path.join(self.tmp, 'products.csv.gz')
+        with open(CSV_DUMP, 'rb') as source, gzip.open(gzipped, 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+        self.import_dump(gzipped)
+
+        yogurt = OpenFoodFactsProduct.objects.get(pk='5000000000003').data
+        self.assertEqual(yogurt['name'], 'Greek Yogurt')
+        self.assertEqual(yogurt['category'], 'Yogurts')
+        self.assertEqual(yogurt['allergens'], ['milk'])
+        self.assertEqual(yogurt['nutrition_data']['energy'], 97.0)
+        self.assertIsNone(OpenFoodFactsProduct.objects.get(pk='5000000000004').data['brand'])
+
+    def test_reimport_only_writes_newer_products(self):
+        self.import_dump(JSONL_DUMP)
+
+        newer = os.path.join(self.tmp, 'newer.jsonl')
+        with open(newer, 'w') as dump:
+            for product in [
+                {'code': '5000000000001', 'product_name': 'Oat Drink Barista', 'last_modified_t': 1800000000},
+                {'code': '5000000000002', 'product_name': 'Store Brand Cornflakes', 'last_modified_t': 1700000100},
+                {'code': '5000000000009', 'product_name': 'Rice Cakes', 'last_modified_t': 1800000000},
+            ]:
+                dump.write(json.dumps(product) + '\n')
+
+        output = self.import_dump(newer)
+
+        self.assertIn('Imported 1 new and 1 updated products (1 unchanged', output)
+        self.assertEqual(OpenFoodFactsProduct.objects.get(pk='5000000000001').data['name'], 'Oat Drink Barista')
+
+    def test_import_is_streamed_in_batches(self):
+        products = ({'code': str(n), 'product_name': f'Product {n}', 'last_modified_t': 1} for n in range(25))
+
+        with self.assertNumQueries(4 * 3):
+            # One lookup, one insert and a savepoint pair per batch of 10
+            stats = import_products(products, batch_size=10)
+
+        self.assertEqual(stats['created'], 25)
+        self.assertEqual(OpenFoodFactsProduct.objects.count(), 25)
+
+    def test_unreadable_lines_are_skipped(self):
+        products = list(iter_products(JSONL_DUMP))
+        self.assertEqual(len(products), 4)
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_get_product_resolves_mirrored_barcodes_locally(self, mock_get):
+        self.import_dump(JSONL_DUMP)
+
+        product = OpenFoodFactsAPI.get_product('5000000000002')
+
+        mock_get.assert_not_called()
+        self.assertEqual(product['name'], 'Store Brand Cornflakes')
+        self.assertEqual(product['category'], 'Cereals')
@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from io import StringIO
+
+import mock
+from django.core.management import call_command
+from django.test import TestCase
+
+from shopping import off_client
+from shopping.management.commands.populate_products import Command, RateLimiter
+from shopping.models import GroceryItem, GroceryStore, ItemStoreInfo
+from shopping.search import is_postgres
+from shopping.tests.test_food_api import MockResponse
+
+
+def search_page(first_code, count, name='Product'):
+    return {'products': [
+        {'code': str(first_code + n), 'id': str(first_code + n), 'product_name': f'{name} {n}', 'brands': 'Acme'}
+        for n in range(count)
+    ]}
+
+
+class PopulateProductsTests(TestCase):
+    """Tests for the concurrent, resumable Open Food Facts importer"""
+
+    def setUp(self):
+        off_client._client = None
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.checkpoint = os.path.join(self.tmp, 'checkpoint.json')
+        self.store = GroceryStore.objects.create(name='Test Store')
+
+    def populate(self, *args):
+        out = StringIO()
+        call_command(
+            'populate_products', '--checkpoint', self.checkpoint, '--wait', '0', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def fake_search(self, failing_pages=()):
+        """Search API stand-in with two pages (of 5 products) per category"""
+        def get(url, params=None, timeout=None):
+            page, category = params['page'], params['tag_0']
+            if (category, page) in failing_pages:
+                return MockResponse({}, status_code=503)
+            if page > 2:
+                return MockResponse({'products': []})
+            offset = {'dairy': 1000, 'snacks': 2000}[category] + page * 10
+            return MockResponse(search_page(offset, 5, name=category))
+        return get
+
+    def test_dry_run_benchmarks_the_sample_and_writes_nothing(self):
+        output = self.populate('--dry-run')
+
+        self.assertIn('products/s', output)
+        self.assertIn('Dry run: all changes rolled back', output)
+        self.assertIn('282 imported', output)
+        self.assertEqual(GroceryItem.objects.count(), 0)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_pages_are_imported_with_bulk_writes(self, mock_get):
+        mock_get.side_effect = self.fake_search()
+
+        output = self.populate('--categories', 'dairy', 'snacks', '--count', '200', '--store', self.store.slug)
+
+        self.assertEqual(GroceryItem.objects.count(), 20)
+        self.assertEqual(ItemStoreInfo.objects.filter(store=self.store).count(), 20)
+        self.assertIn('4 pages, 20 products', output)
+        item = GroceryItem.objects.get(barcode='1010')
+        self.assertEqual((item.name, item.brand, item.category.name), ('dairy 0', 'Acme', 'Dairy'))
+
+    def test_writes_per_page_do_not_grow_with_page_size(self):
+        command = Command(stdout=StringIO())
+        command.country, command.fixture = 'us', None
+        command.stats = {'pages': 0, 'imported': 0, 'updated': 0, 'skipped': 0, 'fetch_time': 0.0, 'write_time': 0.0}
+        category = command._get_category('dairy')
+
+        # Existing barcodes, one insert and the savepoint around them, plus
+        # the search vector update on PostgreSQL
+        with self.assertNumQueries(5 if is_postgres() else 4):
+            command._write_page('dairy', 1, search_page(5000, 50)['products'], category, None, False)
+        self.assertEqual(GroceryItem.objects.count(), 50)
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_interrupted_import_resumes_from_the_checkpoint(self, mock_get):
+        mock_get.side_effect = self.fake_search(failing_pages={('snacks', 2)})
+        self.populate('--categories', 'dairy', 'snacks', '--count', '200')
+        self.assertEqual(GroceryItem.objects.count(), 15)
+
+        mock_get.reset_mock()
+        mock_get.side_effect = self.fake_search()
+        self.populate('--categories', 'dairy', 'snacks', '--count', '200')
+
+        # Only the failed page was fetched again
+        self.assertEqual(
+            [(call.kwargs['params']['tag_0'], call.kwargs['params']['page']) for call in mock_get.call_args_list],
+            [('snacks', 2)]
+        )
+        self.assertEqual(GroceryItem.objects.count(), 20)
+
+        output = self.populate('--categories', 'dairy', 'snacks', '--count', '200')
+        self.assertIn('Skipping category dairy: already imported', output)
+
+        self.populate('--categories', 'dairy', '--count', '200', '--restart')
+        self.assertEqual(GroceryItem.objects.count(), 20)
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_existing_products_are_updated_only_when_asked(self, mock_get):
+        GroceryItem.objects.create(name='Old name', barcode='1010')
+        mock_get.side_effect = self.fake_search()
+
+        self.populate('--categories', 'dairy', '--count', '200')
+        self.assertEqual(GroceryItem.objects.get(barcode='1010').name, 'Old name')
+
+        self.populate('--categories', 'dairy', '--count', '200', '--restart', '--update')
+        self.assertEqual(GroceryItem.objects.get(barcode='1010').name, 'dairy 0')
+        self.assertEqual(GroceryItem.objects.filter(barcode='1010').count(), 1)
+
+    @mock.patch('shopping.off_client.requests.Session.get')
+    def test_results_end_at_the_first_empty_page(self, mock_get):
+        mock_get.side_effect = self.fake_search()
+
+        self.populate('--categories', 'dairy', '--count', '300', '--concurrency', '1')
+
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['us/dairy/100'], {'pages': [1, 2], 'last_page': 2})
+        self.assertEqual(GroceryItem.objects.count(), 10)
+
+    def test_rate_limiter_spaces_calls_across_threads(self):
+        limiter = RateLimiter(0.05)
+        sleeps = []
+
+        # The clock stands still, so each caller sleeps until its own slot
+        with mock.patch('shopping.management.commands.populate_products.time') as clock:
+            clock.monotonic.return_value = 100
+            clock.sleep.side_effect = sleeps.append
+            threads = [threading.Thread(target=limiter.wait) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sorted(round(sleep, 2) for sleep in sleeps), [0.05, 0.1, 0.15])
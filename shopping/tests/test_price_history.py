@@ -0,0 +1,141 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from shopping.models import (
+    Family, FamilyMember, GroceryItem, GroceryStore, ItemStoreInfo, PriceObservation,
+    ShoppingList, ShoppingListItem
+)
+
+
+class PriceStatisticsTests(TestCase):
+    """Tests for the running price statistics on ItemStoreInfo"""
+
+    def setUp(self):
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.milk = GroceryItem.objects.create(name='Milk')
+
+    def info(self):
+        return ItemStoreInfo.objects.get(item=self.milk, store=self.store)
+
+    def test_statistics_are_exact(self):
+        """The mean is over every price, not a pairwise average of the last two"""
+        for price in ('1.00', '2.00', '3.00', '6.00'):
+            ItemStoreInfo.record_prices(self.store.id, {self.milk.id: price})
+
+        info = self.info()
+        self.assertEqual(info.price_count, 4)
+        self.assertEqual(info.average_price, Decimal('3.00'))
+        self.assertEqual((info.min_price, info.max_price, info.last_price), (Decimal('1.00'), Decimal('6.00'), Decimal('6.00')))
+        self.assertEqual(info.median_price, Decimal('2.50'))
+        self.assertEqual(info.price_percentile(100), Decimal('6.00'))
+        # Seeded with the first price: 1 -> 1.3 -> 1.81 -> 0.3 * 6 + 0.7 * 1.81
+        self.assertEqual(info.ewma_price, Decimal('3.0670'))
+
+    def test_recent_prices_are_capped(self):
+        info = ItemStoreInfo(item=self.milk, store=self.store)
+        now = timezone.now()
+        for cents in range(100, 100 + ItemStoreInfo.RECENT_PRICES + 5):
+            info.add_price(Decimal(cents) / 100, now)
+
+        self.assertEqual(len(info.recent_prices), ItemStoreInfo.RECENT_PRICES)
+        self.assertEqual(info.recent_prices[0], '1.05')
+        self.assertEqual(info.price_count, ItemStoreInfo.RECENT_PRICES + 5)
+
+    def test_every_price_is_kept(self):
+        earlier = timezone.now() - timedelta(days=7)
+        ItemStoreInfo.record_prices(self.store.id, {self.milk.id: '1.20'})
+        created = ItemStoreInfo.record_prices(self.store.id, {self.milk.id: '0.90'}, observed_at=earlier)
+
+        self.assertEqual(created, [])
+        self.assertEqual(
+            list(PriceObservation.objects.order_by('observed_at').values_list('price', flat=True)),
+            [Decimal('0.90'), Decimal('1.20')]
+        )
+        # An older observation doesn't replace the last price
+        self.assertEqual(self.info().last_price, Decimal('1.20'))
+
+
+class PriceHistoryRecordingTests(TestCase):
+    """Tests for recording prices entered on shopping lists"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.shopping_list = ShoppingList.objects.create(
+            name='Weekly', store=self.store, family=self.family, created_by=self.user
+        )
+        self.milk = GroceryItem.objects.create(name='Milk')
+        self.list_item = ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=self.milk)
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_price_view_replaces_the_list_items_observation(self):
+        """Correcting a list item's price doesn't count it twice, and clearing it retracts it"""
+        ItemStoreInfo.record_prices(self.store.id, {self.milk.id: '1.00'})
+        url = reverse('groceries:update_item_price', args=[self.shopping_list.id, self.list_item.id])
+        for price in ('2.00', '40.00', '4.00'):
+            self.client.post(url, {'price': price})
+
+        info = ItemStoreInfo.objects.get(item=self.milk, store=self.store)
+        self.assertEqual((info.price_count, info.average_price), (2, Decimal('2.50')))
+        self.assertEqual((info.max_price, info.last_price), (Decimal('4.00'), Decimal('4.00')))
+        self.assertEqual(
+            list(PriceObservation.objects.order_by('id').values_list('list_item_id', 'price')),
+            [(None, Decimal('1.00')), (self.list_item.id, Decimal('4.00'))]
+        )
+
+        response = self.client.post(url, {'price': ''})
+        self.assertEqual(response.status_code, 200)
+        info.refresh_from_db()
+        self.assertEqual((info.price_count, info.average_price, info.last_price), (1, Decimal('1.00'), Decimal('1.00')))
+        self.assertIsNone(ShoppingListItem.objects.get(pk=self.list_item.pk).actual_price)
+
+    def test_price_ops_replace_and_clear(self):
+        self.shopping_list.apply_item_ops([{'op': 'price', 'id': self.list_item.id, 'price': '3.00'}])
+        self.shopping_list.apply_item_ops([{'op': 'price', 'id': self.list_item.id, 'price': '5.00'}])
+        self.assertEqual(ItemStoreInfo.objects.get(item=self.milk, store=self.store).average_price, Decimal('5.00'))
+
+        self.shopping_list.apply_item_ops([{'op': 'price', 'id': self.list_item.id, 'price': None}])
+        info = ItemStoreInfo.objects.get(item=self.milk, store=self.store)
+        self.assertEqual((info.price_count, info.average_price), (0, None))
+        self.assertFalse(PriceObservation.objects.exists())
+
+    def test_backfill_command(self):
+        """Existing list prices become history once, and the statistics are rebuilt from it"""
+        other_list = ShoppingList.objects.create(
+            name='Last week', store=self.store, family=self.family, created_by=self.user,
+            completed=True, completed_at=timezone.now() - timedelta(days=7)
+        )
+        ShoppingListItem.objects.create(shopping_list=other_list, item=self.milk, actual_price=Decimal('1.00'))
+        ShoppingListItem.objects.filter(pk=self.list_item.pk).update(actual_price=Decimal('2.00'))
+        ShoppingListItem.objects.create(shopping_list=other_list, item=GroceryItem.objects.create(name='Bread'))
+
+        out = StringIO()
+        call_command('backfill_price_history', stdout=out)
+        self.assertIn('Recorded 2 list prices; rebuilt price statistics for 1 store items', out.getvalue())
+
+        info = ItemStoreInfo.objects.get(item=self.milk, store=self.store)
+        self.assertEqual((info.price_count, info.average_price, info.last_price), (2, Decimal('1.50'), Decimal('2.00')))
+
+        out = StringIO()
+        call_command('backfill_price_history', stdout=out)
+        self.assertIn('Recorded 0 list prices', out.getvalue())
+        self.assertEqual(ItemStoreInfo.objects.get(pk=info.pk).price_count, 2)
+
+    def test_admin_reads_price_statistics(self):
+        User.objects.create_superuser(username='admin', password='adminpassword')
+        ItemStoreInfo.record_prices(self.store.id, {self.milk.id: '2.00'})
+        self.client.login(username='admin', password='adminpassword')
+
+        for name in ('shopmartadmin:shopping_groceryitem_changelist', 'shopmartadmin:shopping_itemstoreinfo_changelist'):
+            response = self.client.get(reverse(name))
+            self.assertContains(response, '$2.00')
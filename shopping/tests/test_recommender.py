@@ -1,12 +1,16 @@
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
 import mock
 
 from shopping.models import (
     Family, GroceryStore, ProductCategory, GroceryItem, 
-    ShoppingList, ShoppingListItem, FamilyItemUsage
+    ShoppingList, ShoppingListItem, FamilyItemUsage, FamilyRecommendation,
+    ItemCoOccurrence, ItemPurchaseCadence
 )
 from shopping.recommender import ShoppingRecommender
 
@@ -195,16 +199,20 @@ class ShoppingRecommenderTests(TestCase):
         ShoppingListItem.objects.create(shopping_list=list1, item=self.eggs, quantity=1)
         ShoppingListItem.objects.create(shopping_list=list3, item=self.eggs, quantity=1)
         
-        # Mock current date to be 9 days after the last purchase (just before milk would be needed)
+        # Completing each list updates the purchase cadence
+        for completed_list in (list1, list2, list3):
+            ItemPurchaseCadence.record_list(completed_list)
+        
+        # Mock current date to be 7 days after the last purchase (just before milk would be needed)
         with mock.patch('shopping.recommender.timezone.now') as mock_now:
-            mock_now.return_value = ten_days_ago + timedelta(days=9)
+            mock_now.return_value = ten_days_ago + timedelta(days=7)
             replenish_items = ShoppingRecommender._get_replenishment_suggestions(self.family, limit=5)
             
-            # Milk should not yet be suggested (9 days passed out of 10 day average = 90%)
+            # Milk should not yet be suggested (7 days passed out of 10 day average = 70%)
             self.assertEqual(replenish_items.count(), 0)
             
-            # Move one more day forward (now at 100% of the average interval)
-            mock_now.return_value = ten_days_ago + timedelta(days=10)
+            # Move two days forward (now past 80% of the average interval)
+            mock_now.return_value = ten_days_ago + timedelta(days=9)
             replenish_items = ShoppingRecommender._get_replenishment_suggestions(self.family, limit=5)
             
             # Now milk should be suggested
@@ -308,4 +316,297 @@ class ShoppingRecommenderTests(TestCase):
             mock_family_recs.assert_called_once_with(self.family, self.store, 5)
             self.assertEqual(recommendations.count(), 2)
             self.assertIn(self.milk, recommendations)
-            self.assertIn(self.eggs, recommendations)
\ No newline at end of file
+            self.assertIn(self.eggs, recommendations)
+
+
+class PrecomputedRecommendationTests(TestCase):
+    """Tests for the precomputed FamilyRecommendation store"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        category = ProductCategory.objects.create(name='Dairy')
+        self.milk = GroceryItem.objects.create(name='Milk', category=category, global_popularity=10)
+        self.eggs = GroceryItem.objects.create(name='Eggs', category=category, global_popularity=8)
+        FamilyItemUsage.objects.create(family=self.family, item=self.milk, usage_count=5)
+        
+    def test_falls_back_to_live_computation(self):
+        """Without a stored row, recommendations are computed live and nothing is saved"""
+        recommendations = ShoppingRecommender.get_recommendations_for_family(self.family, limit=5)
+        
+        self.assertIn(self.milk, recommendations)
+        self.assertFalse(FamilyRecommendation.objects.exists())
+        
+    def test_reads_precomputed_row(self):
+        """A fresh stored row is served in its stored order without recomputing"""
+        FamilyRecommendation.objects.create(
+            family=self.family,
+            item_ids=[self.eggs.id, self.milk.id]
+        )
+        
+        with mock.patch.object(ShoppingRecommender, 'compute_recommendations_for_family') as compute:
+            recommendations = ShoppingRecommender.get_recommendations_for_family(self.family, limit=1)
+            compute.assert_not_called()
+        
+        self.assertEqual(recommendations, [self.eggs])
+        
+    def test_refresh_saves_row(self):
+        """Refreshing stores the ranked item IDs for the family and store"""
+        stored = ShoppingRecommender.refresh_family_recommendations(self.family)
+        
+        self.assertIn(self.milk.id, stored.item_ids)
+        self.assertFalse(stored.is_stale)
+        self.assertIsNone(stored.store)
+        
+    def test_new_list_item_marks_row_stale(self):
+        """Adding an item to one of the family's lists marks its rows stale"""
+        stored = ShoppingRecommender.refresh_family_recommendations(self.family)
+        shopping_list = ShoppingList.objects.create(
+            name='List', store=self.store, family=self.family, created_by=self.user
+        )
+        ShoppingListItem.objects.create(shopping_list=shopping_list, item=self.eggs)
+        
+        stored.refresh_from_db()
+        self.assertTrue(stored.is_stale)
+        
+    def test_stale_row_is_served_while_refreshed_in_background(self):
+        """A stale row keeps its ranking until the refresh after commit replaces it"""
+        FamilyRecommendation.objects.create(family=self.family, item_ids=[self.eggs.id], is_stale=True)
+        
+        with mock.patch('shopping.recommender._executor') as executor:
+            with mock.patch.object(ShoppingRecommender, 'compute_recommendations_for_family') as compute:
+                with self.captureOnCommitCallbacks(execute=True):
+                    recommendations = ShoppingRecommender.get_recommendations_for_family(self.family, limit=5)
+                    # A second read while the refresh is pending doesn't queue another
+                    ShoppingRecommender.get_recommendations_for_family(self.family, limit=5)
+                compute.assert_not_called()
+            
+            self.assertEqual(recommendations, [self.eggs])
+            executor.submit.assert_called_once()
+            refresh, *args = executor.submit.call_args[0]
+        
+        with mock.patch('shopping.recommender.connection'):
+            refresh(*args)
+        stored = FamilyRecommendation.objects.get(family=self.family)
+        self.assertFalse(stored.is_stale)
+        self.assertIn(self.milk.id, stored.item_ids)
+        
+    def test_only_completing_a_list_marks_rows_stale(self):
+        """Saving an already completed list again leaves the rows alone"""
+        stored = ShoppingRecommender.refresh_family_recommendations(self.family)
+        shopping_list = ShoppingList.objects.create(
+            name='List', store=self.store, family=self.family, created_by=self.user
+        )
+        self.assertFalse(FamilyRecommendation.objects.get(pk=stored.pk).is_stale)
+        
+        shopping_list = ShoppingList.objects.get(pk=shopping_list.pk)
+        shopping_list.completed = True
+        shopping_list.completed_at = timezone.now()
+        shopping_list.save()
+        self.assertTrue(FamilyRecommendation.objects.get(pk=stored.pk).is_stale)
+        
+        FamilyRecommendation.objects.filter(pk=stored.pk).update(is_stale=False)
+        shopping_list.name = 'Renamed'
+        shopping_list.save()
+        ShoppingList.objects.get(pk=shopping_list.pk).save()
+        self.assertFalse(FamilyRecommendation.objects.get(pk=stored.pk).is_stale)
+
+
+class ItemCoOccurrenceTests(TestCase):
+    """Tests for the persisted co-purchase counts"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.milk = GroceryItem.objects.create(name='Milk')
+        self.cereal = GroceryItem.objects.create(name='Cereal')
+        self.bread = GroceryItem.objects.create(name='Bread')
+        
+    def _completed_list(self, *items):
+        shopping_list = ShoppingList.objects.create(
+            name='List', store=self.store, family=self.family, created_by=self.user
+        )
+        for item in items:
+            ShoppingListItem.objects.create(shopping_list=shopping_list, item=item)
+        ItemCoOccurrence.record_list(shopping_list)
+        return shopping_list
+        
+    def test_record_list_counts_pairs_both_ways(self):
+        """Each pair is counted in both directions for the family and globally"""
+        self._completed_list(self.milk, self.cereal)
+        self._completed_list(self.milk, self.cereal, self.bread)
+        
+        family_row = ItemCoOccurrence.objects.get(family=self.family, item=self.milk, other_item=self.cereal)
+        global_row = ItemCoOccurrence.objects.get(family=None, item=self.cereal, other_item=self.milk)
+        self.assertEqual(family_row.count, 2)
+        self.assertEqual(global_row.count, 2)
+        
+    def test_negative_delta_removes_list(self):
+        """Reopening a list subtracts its pairs again"""
+        shopping_list = self._completed_list(self.milk, self.cereal)
+        ItemCoOccurrence.record_list(shopping_list, delta=-1)
+        
+        self.assertFalse(ItemCoOccurrence.objects.filter(count__gt=0).exists())
+        
+    def test_pairs_created_elsewhere_are_incremented(self):
+        """Rows another list inserted first are counted, not inserted again"""
+        shopping_list = ShoppingList.objects.create(
+            name='List', store=self.store, family=self.family, created_by=self.user
+        )
+        for item in (self.milk, self.cereal):
+            ShoppingListItem.objects.create(shopping_list=shopping_list, item=item)
+        ItemCoOccurrence.objects.create(family=None, item=self.milk, other_item=self.cereal, count=1)
+        
+        ItemCoOccurrence.record_list(shopping_list)
+        
+        self.assertEqual(ItemCoOccurrence.objects.filter(family=None).count(), 2)
+        self.assertEqual(ItemCoOccurrence.objects.get(family=None, item=self.milk).count, 2)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ItemCoOccurrence.objects.create(family=None, item=self.cereal, other_item=self.milk)
+        
+    def test_rows_are_locked_in_a_fixed_order(self):
+        """Lists sharing pairs lock them in the same order, so they can't deadlock"""
+        shopping_list = ShoppingList.objects.create(
+            name='List', store=self.store, family=self.family, created_by=self.user
+        )
+        for item in (self.bread, self.milk, self.cereal):
+            ShoppingListItem.objects.create(shopping_list=shopping_list, item=item)
+        
+        with CaptureQueriesContext(connection) as context:
+            ItemCoOccurrence.record_list(shopping_list)
+        
+        locks = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT') and 'shopping_itemcooccurrence' in query['sql']
+        ]
+        self.assertEqual(len(locks), 2)
+        for sql in locks:
+            self.assertIn('ORDER BY "shopping_itemcooccurrence"."id" ASC', sql)
+            if connection.features.has_select_for_update:
+                self.assertIn('FOR UPDATE', sql)
+        
+    def test_co_purchased_items_ranked_by_summed_counts(self):
+        """Candidates are scored by the sum of their counts over the list's items"""
+        self._completed_list(self.milk, self.cereal, self.bread)
+        self._completed_list(self.milk, self.cereal)
+        
+        co_purchased = ShoppingRecommender._get_co_purchased_items(self.family, [self.milk.id], limit=5)
+        
+        self.assertEqual(co_purchased, [self.cereal, self.bread])
+        self.assertEqual(co_purchased[0].purchase_count, 2)
+        
+    def test_admin_actions_keep_the_counts(self):
+        """Completing and reopening lists from the admin does the same bookkeeping as the views"""
+        User.objects.create_superuser(username='admin', password='adminpassword')
+        self.client.login(username='admin', password='adminpassword')
+        url = reverse('shopmartadmin:shopping_shoppinglist_changelist')
+        shopping_list = ShoppingList.objects.create(
+            name='List', store=self.store, family=self.family, created_by=self.user
+        )
+        for item in (self.milk, self.cereal):
+            ShoppingListItem.objects.create(shopping_list=shopping_list, item=item)
+        recommendation = FamilyRecommendation.objects.create(family=self.family, item_ids=[self.bread.id])
+        
+        self.client.post(url, {'action': 'mark_completed', '_selected_action': [shopping_list.id]})
+        
+        self.assertEqual(ItemCoOccurrence.objects.get(family=self.family, item=self.milk).count, 1)
+        self.assertTrue(ItemPurchaseCadence.objects.filter(family=self.family, item=self.milk).exists())
+        recommendation.refresh_from_db()
+        self.assertTrue(recommendation.is_stale)
+        
+        self.client.post(url, {'action': 'mark_active', '_selected_action': [shopping_list.id]})
+        
+        shopping_list.refresh_from_db()
+        self.assertFalse(shopping_list.completed)
+        self.assertFalse(ItemCoOccurrence.objects.filter(count__gt=0).exists())
+        self.assertFalse(ItemPurchaseCadence.objects.filter(family=self.family).exists())
+
+
+class ItemPurchaseCadenceTests(TestCase):
+    """Tests for the persisted purchase cadence model"""
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.milk = GroceryItem.objects.create(name='Milk')
+        self.start = timezone.now() - timedelta(days=100)
+        
+    def _complete(self, days_after_start):
+        shopping_list = ShoppingList.objects.create(
+            name='List', store=self.store, family=self.family, created_by=self.user,
+            completed=True, completed_at=self.start + timedelta(days=days_after_start)
+        )
+        ShoppingListItem.objects.create(shopping_list=shopping_list, item=self.milk)
+        ItemPurchaseCadence.record_list(shopping_list)
+        
+    def test_ewma_interval_and_next_due(self):
+        """The interval is smoothed and next_due leads it by the replenish threshold"""
+        self._complete(0)
+        self._complete(10)
+        self._complete(30)
+        
+        cadence = ItemPurchaseCadence.objects.get(family=self.family, item=self.milk)
+        expected_interval = 0.3 * 20 + 0.7 * 10
+        self.assertEqual(cadence.purchase_count, 3)
+        self.assertAlmostEqual(cadence.ewma_interval_days, expected_interval, places=3)
+        self.assertEqual(cadence.last_purchased, self.start + timedelta(days=30))
+        self.assertEqual(
+            cadence.next_due,
+            self.start + timedelta(days=30) + timedelta(days=expected_interval * 0.8)
+        )
+        
+    def test_history_older_than_thirty_days_counts(self):
+        """Cadence built from purchases months ago still produces suggestions"""
+        self._complete(0)
+        self._complete(40)
+        
+        suggestions = ShoppingRecommender._get_replenishment_suggestions(self.family)
+        self.assertIn(self.milk, suggestions)
+        
+    def test_long_overdue_items_are_not_suggested(self):
+        """An item not bought for several of its intervals has dropped out of the family's shopping"""
+        self._complete(0)
+        self._complete(10)
+        
+        cadence = ItemPurchaseCadence.objects.get(family=self.family, item=self.milk)
+        self.assertEqual(cadence.overdue_until, cadence.next_due + timedelta(days=30))
+        suggestions = ShoppingRecommender._get_replenishment_suggestions(self.family)
+        self.assertNotIn(self.milk, suggestions)
+        
+    def test_remove_list_replays_the_remaining_history(self):
+        """Reopening a list takes its purchase back out of the cadence"""
+        self._complete(0)
+        self._complete(10)
+        expected = ItemPurchaseCadence.objects.get(family=self.family, item=self.milk)
+        self._complete(30)
+        
+        reopened = ShoppingList.objects.order_by('-completed_at').first()
+        reopened.completed = False
+        reopened.completed_at = None
+        reopened.save()
+        ItemPurchaseCadence.remove_list(reopened)
+        
+        cadence = ItemPurchaseCadence.objects.get(family=self.family, item=self.milk)
+        self.assertEqual(
+            (cadence.last_purchased, cadence.purchase_count, cadence.next_due),
+            (expected.last_purchased, expected.purchase_count, expected.next_due)
+        )
+        
+    def test_rebuild_command_matches_incremental_updates(self):
+        """Rebuilding from history gives the same cadence as live updates"""
+        from django.core.management import call_command
+        from io import StringIO
+        
+        self._complete(0)
+        self._complete(10)
+        self._complete(30)
+        live = ItemPurchaseCadence.objects.get(family=self.family, item=self.milk)
+        
+        call_command('rebuild_purchase_cadence', stdout=StringIO())
+        rebuilt = ItemPurchaseCadence.objects.get(family=self.family, item=self.milk)
+        
+        self.assertEqual(rebuilt.next_due, live.next_due)
+        self.assertEqual(rebuilt.purchase_count, live.purchase_count)
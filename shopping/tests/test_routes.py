@@ -0,0 +1,100 @@
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from shopping.models import (
+    Family, FamilyMember, GroceryItem, GroceryStore, ItemStoreInfo, ProductCategory, ShoppingList,
+    ShoppingListItem, StoreLocation
+)
+from shopping.routes import store_route, walk_order
+
+
+class WalkOrderTests(TestCase):
+    """Tests for ordering lists the way the store is walked"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.produce = StoreLocation.objects.create(store=self.store, name='Produce', sort_order=10)
+        self.dairy = StoreLocation.objects.create(store=self.store, name='Dairy', sort_order=20)
+        self.bakery = StoreLocation.objects.create(store=self.store, name='Bakery', sort_order=50)
+
+        self.shopping_list = ShoppingList.objects.create(
+            name='Weekly', store=self.store, family=self.family, created_by=self.user
+        )
+        self.lines = {}
+        for name, category in (('Soap', None), ('Bread', 'Bakery'), ('Milk', None), ('Apples', 'Fruits')):
+            item = GroceryItem.objects.create(
+                name=name, category=ProductCategory.objects.create(name=category) if category else None
+            )
+            self.lines[name] = ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=item)
+        ItemStoreInfo.objects.create(item=self.lines['Milk'].item, store=self.store, location=self.dairy)
+
+        self.client.login(username='testuser', password='testpassword')
+
+    def order(self):
+        self.shopping_list.refresh_from_db()
+        return [line_id for line_id, _ in walk_order(self.shopping_list)]
+
+    def ids(self, *names):
+        return [self.lines[name].id for name in names]
+
+    def test_store_route(self):
+        self.assertEqual(
+            store_route(self.store.id),
+            {self.produce.id: (0, 'Produce'), self.dairy.id: (1, 'Dairy'), self.bakery.id: (2, 'Bakery')}
+        )
+
+    def test_category_fallback_and_unplaced_last(self):
+        self.assertEqual(self.order(), self.ids('Apples', 'Milk', 'Bread', 'Soap'))
+        self.assertIn((self.lines['Apples'].id, self.produce.id), walk_order(self.shopping_list))
+
+    def test_order_is_cached_per_version(self):
+        self.order()
+        with self.assertNumQueries(0):
+            walk_order(self.shopping_list)
+
+        # Checking an item off bumps the list version
+        self.lines['Apples'].checked = True
+        self.lines['Apples'].save()
+        self.assertEqual(self.order(), self.ids('Milk', 'Bread', 'Soap', 'Apples'))
+
+    def test_layout_changes_reorder(self):
+        self.order()
+
+        self.bakery.sort_order = 1
+        self.bakery.save()
+        self.assertEqual(self.order(), self.ids('Bread', 'Apples', 'Milk', 'Soap'))
+
+        ItemStoreInfo.objects.filter(item=self.lines['Milk'].item).update(location=None)
+        ItemStoreInfo.objects.get(item=self.lines['Milk'].item).save()
+        self.assertEqual(self.order(), self.ids('Bread', 'Apples', 'Milk', 'Soap'))
+        self.assertEqual(dict(walk_order(self.shopping_list))[self.lines['Milk'].id], None)
+
+    def test_only_the_changed_store_is_invalidated(self):
+        other_store = GroceryStore.objects.create(name='Other Store')
+        other_aisle = StoreLocation.objects.create(store=other_store, name='Aisle 1', sort_order=1)
+        self.order()
+
+        ItemStoreInfo.objects.create(item=self.lines['Soap'].item, store=other_store, location=other_aisle)
+        other_aisle.sort_order = 2
+        other_aisle.save()
+        with self.assertNumQueries(0):
+            walk_order(self.shopping_list)
+
+        # Moving an item on this store's list to another category reorders it
+        bread = self.lines['Bread'].item
+        bread.category = ProductCategory.objects.create(name='Dairy')
+        bread.save()
+        self.assertEqual(self.order(), self.ids('Apples', 'Bread', 'Milk', 'Soap'))
+        self.assertEqual(dict(walk_order(self.shopping_list))[self.lines['Bread'].id], self.dairy.id)
+
+    def test_detail_view_lists_items_in_walk_order(self):
+        response = self.client.get(reverse('groceries:list_detail', args=[self.shopping_list.id]))
+
+        items = response.context['all_items']
+        self.assertEqual([item.item.name for item in items], ['Apples', 'Milk', 'Bread', 'Soap'])
+        self.assertEqual([item.route_location_name for item in items], ['Produce', 'Dairy', 'Bakery', None])
@@ -0,0 +1,213 @@
+from io import StringIO
+
+import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from shopping.allergens import ALLERGEN_BITS, DIET_BITS, UNANALYSED, AllergenDetector
+from shopping.management.commands.populate_products import Command as PopulateCommand
+from shopping.models import (
+    Family, FamilyItemUsage, FamilyMember, FamilyRecommendation, GroceryItem, GroceryStore, ItemCoOccurrence,
+    ItemStoreInfo, OpenFoodFactsProduct, ProductCategory, ShoppingList, ShoppingListItem
+)
+from shopping.recommender import ShoppingRecommender
+from shopping.search import search_items, update_search_vectors
+
+DAIRY = ALLERGEN_BITS['dairy']
+VEGAN = DIET_BITS['vegan']
+DIET_FLAGS = sum(DIET_BITS.values())
+
+
+class SafetyFlagsTests(TestCase):
+    """Tests for the allergen and diet flags stored on grocery items"""
+
+    def test_flags_from_product_data(self):
+        """Detected allergens and diet conflicts become bits"""
+        flags = AllergenDetector.safety_flags({'ingredients': 'Skimmed milk, honey', 'allergens': ['milk']})
+
+        self.assertTrue(flags & DAIRY)
+        self.assertTrue(flags & VEGAN)
+        self.assertFalse(flags & ALLERGEN_BITS['peanuts'])
+        self.assertEqual(AllergenDetector.safety_flags({'ingredients': 'Water'}), 0)
+
+    def test_mask_ignores_unknown_names(self):
+        self.assertEqual(AllergenDetector.safety_mask(['dairy', 'unknown'], ['vegan']), DAIRY | VEGAN)
+        self.assertEqual(AllergenDetector.safety_mask(), 0)
+
+    def test_backfill_command(self):
+        """Flags come from the OFF mirror when it has the product, else the item's own text"""
+        OpenFoodFactsProduct.objects.create(
+            code='5000000000001', data={'ingredients': 'Oats, water', 'allergens': ['gluten']}
+        )
+        # Written without save(), as by an import, so nothing is detected yet
+        oat_drink, milk, water = GroceryItem.objects.bulk_create([
+            GroceryItem(name='Oat Drink', barcode='5000000000001', off_id='5000000000001'),
+            GroceryItem(name='Whole Milk'),
+            GroceryItem(name='Sparkling Water', safety_flags=DAIRY),
+        ])
+
+        out = StringIO()
+        call_command('backfill_safety_flags', '--batch-size', '2', stdout=out)
+
+        self.assertIn('Checked 3 items, updated flags on 3', out.getvalue())
+        oat_drink.refresh_from_db()
+        milk.refresh_from_db()
+        water.refresh_from_db()
+        self.assertEqual(oat_drink.safety_flags, ALLERGEN_BITS['gluten'])
+        self.assertTrue(milk.safety_flags & DAIRY)
+        self.assertEqual(water.safety_flags, 0)
+
+    def test_flags_are_detected_when_saved(self):
+        """Items created or edited by hand get flags from their text"""
+        User.objects.create_user(username='testuser', password='testpassword')
+        client = Client()
+        client.login(username='testuser', password='testpassword')
+        response = client.post(
+            reverse('groceries:create_item'),
+            {
+                'name': 'Buttermilk Pancakes', 'description': 'Wheat flour, eggs',
+                'category': ProductCategory.objects.create(name='Bakery').id,
+            }
+        )
+        self.assertEqual(response.status_code, 302)
+        pancakes = GroceryItem.objects.get(name='Buttermilk Pancakes')
+        self.assertEqual(pancakes.safety_flags & ~DIET_FLAGS, DAIRY | ALLERGEN_BITS['gluten'] | ALLERGEN_BITS['eggs'])
+        
+        pancakes.description = 'Rice flour'
+        pancakes.save(update_fields=['description'])
+        pancakes.refresh_from_db()
+        self.assertEqual(pancakes.safety_flags & ~DIET_FLAGS, DAIRY)
+        
+        # Unrelated saves leave the flags alone
+        GroceryItem.objects.filter(pk=pancakes.pk).update(safety_flags=0)
+        pancakes = GroceryItem.objects.get(pk=pancakes.pk)
+        pancakes.global_popularity = 3
+        pancakes.save()
+        pancakes.refresh_from_db()
+        self.assertEqual(pancakes.safety_flags, 0)
+
+    def test_mirrored_product_data_is_preferred(self):
+        OpenFoodFactsProduct.objects.create(
+            code='5000000000001', data={'ingredients': 'Oats, water', 'allergens': ['gluten']}
+        )
+        oat_drink = GroceryItem.objects.create(name='Oat Drink', barcode='5000000000001')
+        self.assertEqual(oat_drink.safety_flags, ALLERGEN_BITS['gluten'])
+        
+        # Explicit flags on creation are kept, and an item with no text is unknown
+        self.assertEqual(GroceryItem.objects.create(name='Soy Sauce', safety_flags=0).safety_flags, 0)
+        self.assertEqual(GroceryItem.objects.create(name='', off_id='123').safety_flags, UNANALYSED)
+
+    def test_populate_products_sets_flags(self):
+        data = PopulateCommand()._item_data(
+            {'product_name': 'Yogurt', 'ingredients_text': 'Milk, cultures', 'allergens_tags': ['en:milk']}, None
+        )
+        self.assertTrue(data['safety_flags'] & DAIRY)
+
+    def test_products_without_ingredients_are_unanalysed(self):
+        self.assertEqual(AllergenDetector.safety_flags({'ingredients': '', 'allergens': []}), UNANALYSED)
+        self.assertEqual(AllergenDetector.safety_flags({'ingredients': None}), UNANALYSED)
+        self.assertEqual(AllergenDetector.safety_flags({'allergens': ['en:milk']}), DAIRY)
+
+        # An imported product with no ingredient data is never offered as safe
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        user.profile.set_allergens(['dairy'])
+        data = PopulateCommand()._item_data({'product_name': 'Mystery Bar', 'ingredients_text': ''}, None)
+        self.assertEqual(data['safety_flags'], UNANALYSED)
+        # Written the way the importer writes it
+        GroceryItem.objects.bulk_create([GroceryItem(barcode='5000000000002', **data)])
+        update_search_vectors(GroceryItem.objects.filter(barcode='5000000000002'))
+        self.assertEqual(search_items('mystery', exclude_flags=user.profile.get_safety_mask()), [])
+        self.assertEqual(len(search_items('mystery')), 1)
+
+
+class SafetyFilterTests(TestCase):
+    """Tests for applying a user's allergens and diets as a query filter"""
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.user.profile.set_allergens(['dairy'])
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.category = ProductCategory.objects.create(name='Drinks')
+        self.milk = GroceryItem.objects.create(name='Milk', category=self.category, safety_flags=DAIRY)
+        self.oat_milk = GroceryItem.objects.create(
+            name='Oat Milk', category=self.category, safety_flags=ALLERGEN_BITS['gluten']
+        )
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_profile_mask(self):
+        self.user.profile.set_preferences(['vegan'])
+        self.assertEqual(self.user.profile.get_safety_mask(), DAIRY | VEGAN)
+
+    def test_search_excludes_flagged_items(self):
+        self.assertEqual(search_items('milk', exclude_flags=DAIRY), [self.oat_milk])
+
+        response = self.client.get(reverse('item_search'), {'family': self.family.id, 'query': 'milk'})
+        self.assertEqual([item['name'] for item in response.json()['items']], ['Oat Milk'])
+
+    def test_precomputed_recommendations_are_filtered_per_user(self):
+        FamilyRecommendation.objects.create(family=self.family, item_ids=[self.milk.id, self.oat_milk.id])
+
+        self.assertEqual(
+            ShoppingRecommender.get_recommendations_for_family(self.family, limit=1, exclude_flags=DAIRY),
+            [self.oat_milk]
+        )
+        self.assertEqual(ShoppingRecommender.get_recommendations_for_family(self.family, limit=1), [self.milk])
+
+    def test_unanalysed_items_are_not_taken_as_safe(self):
+        GroceryItem.objects.filter(pk=self.oat_milk.pk).update(safety_flags=UNANALYSED)
+
+        self.assertEqual(search_items('milk', exclude_flags=DAIRY), [])
+        self.assertEqual(len(search_items('milk')), 2)
+
+    def test_computed_recommendations_are_filled_after_filtering(self):
+        """Unsafe items dropped from a live ranking are replaced by the next ones"""
+        FamilyItemUsage.objects.create(family=self.family, item=self.milk, usage_count=5)
+        FamilyItemUsage.objects.create(family=self.family, item=self.oat_milk, usage_count=1)
+
+        # Nothing stored yet, so the ranking is computed live
+        self.assertEqual(
+            ShoppingRecommender.get_recommendations_for_family(self.family, limit=1, exclude_flags=DAIRY),
+            [self.oat_milk]
+        )
+
+    def test_list_recommendations_are_filtered(self):
+        coffee = GroceryItem.objects.create(name='Coffee')
+        shopping_list = ShoppingList.objects.create(
+            name='Weekly', store=self.store, family=self.family, created_by=self.user
+        )
+        ShoppingListItem.objects.create(shopping_list=shopping_list, item=coffee)
+        for item, count in ((self.milk, 5), (self.oat_milk, 1)):
+            ItemStoreInfo.objects.create(item=item, store=self.store)
+            ItemCoOccurrence.objects.create(family=None, item=coffee, other_item=item, count=count)
+
+        recommended = ShoppingRecommender.get_recommendations_based_on_list(shopping_list, exclude_flags=DAIRY)
+
+        self.assertIn(self.oat_milk, recommended)
+        self.assertNotIn(self.milk, recommended)
+
+    def test_category_selection_excludes_flagged_items(self):
+        shopping_list = ShoppingList.objects.create(
+            name='Weekly', store=self.store, family=self.family, created_by=self.user
+        )
+        GroceryItem.objects.create(name='Cream', category=ProductCategory.objects.create(name='Dairy'), safety_flags=DAIRY)
+
+        response = self.client.get(reverse('groceries:category_selection', args=[shopping_list.id]))
+
+        self.assertEqual([category.name for category in response.context['categories']], ['Drinks'])
+        self.assertEqual(list(response.context['items_by_category'][self.category.id]), [self.oat_milk])
+
+    @mock.patch('shopping.views.OpenFoodFactsAPI.get_product')
+    def test_barcode_lookup_stores_flags(self, mock_get_product):
+        mock_get_product.return_value = {
+            'code': '5000000000003', 'name': 'Greek Yogurt', 'brand': 'Farm', 'category': None,
+            'image_url': None, 'ingredients': 'Milk, cultures', 'allergens': ['milk'],
+        }
+
+        self.client.get(reverse('barcode_search', args=['5000000000003']))
+
+        self.assertTrue(GroceryItem.objects.get(barcode='5000000000003').safety_flags & DAIRY)
@@ -0,0 +1,120 @@
+from unittest import skipUnless
+
+import mock
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.contrib.auth.models import User
+
+from shopping.models import (
+    Family, FamilyMember, GroceryStore, ProductCategory, GroceryItem,
+    FamilyItemUsage, ItemStoreInfo
+)
+from shopping.search import NgramIndex, search_items, text_ngrams
+
+
+class NgramIndexTests(TestCase):
+    """Tests for the in-process trigram index"""
+    
+    def test_text_ngrams_pads_words(self):
+        """Words are padded so short words still produce trigrams"""
+        self.assertEqual(text_ngrams('Egg'), {' eg', 'egg', 'gg '})
+        self.assertEqual(text_ngrams('Egg', prefix=True), {' eg', 'egg'})
+        
+    def test_search_ranks_by_shared_trigrams(self):
+        """Closer spellings score higher and unrelated documents are dropped"""
+        index = NgramIndex()
+        index.add(1, 'Whole Milk')
+        index.add(2, 'Milk Chocolate')
+        index.add(3, 'Bread')
+        
+        results = index.search('milk')
+        
+        self.assertEqual({doc_id for doc_id, _ in results}, {1, 2})
+        self.assertNotIn(3, dict(index.search('mlik', min_score=0.0)))
+
+
+class SearchItemsTests(TestCase):
+    """Tests for ranked item search"""
+    
+    def setUp(self):
+        self.family = Family.objects.create(name='Test Family')
+        self.dairy = ProductCategory.objects.create(name='Dairy')
+        self.milk = GroceryItem.objects.create(name='Milk', category=self.dairy, global_popularity=5)
+        self.oat_milk = GroceryItem.objects.create(name='Oat Milk', category=self.dairy, global_popularity=50)
+        self.bread = GroceryItem.objects.create(name='Bread', brand='Milkwood Bakery', global_popularity=1)
+        self.cheese = GroceryItem.objects.create(name='Cheddar', category=self.dairy)
+        
+    def test_prefix_match(self):
+        """A partially typed word matches the full name"""
+        self.assertIn(self.cheese, search_items('chedd'))
+        
+    def test_family_usage_breaks_relevance_ties(self):
+        """Among equally relevant items the family's usage outranks global popularity"""
+        first_milk = GroceryItem.objects.create(name='Milk', global_popularity=100)
+        FamilyItemUsage.objects.create(family=self.family, item=self.milk, usage_count=3)
+        
+        results = search_items('milk', family=self.family)
+        
+        self.assertEqual(results[:2], [self.milk, first_milk])
+        
+    def test_store_filter_keeps_items_without_store_info(self):
+        """Items stocked only at other stores are excluded"""
+        store = GroceryStore.objects.create(name='Store A')
+        other = GroceryStore.objects.create(name='Store B')
+        ItemStoreInfo.objects.create(item=self.oat_milk, store=other)
+        
+        results = search_items('milk', store=store)
+        
+        self.assertIn(self.milk, results)
+        self.assertNotIn(self.oat_milk, results)
+        
+    @skipUnless(connection.vendor == 'postgresql', 'pg_trgm is PostgreSQL only')
+    def test_misspelled_name_matches_through_trigram_operator(self):
+        """Names a typo away match through the indexable % operator"""
+        with connection.cursor() as cursor:
+            try:
+                with transaction.atomic():
+                    cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            except DatabaseError:
+                self.skipTest('pg_trgm is not available')
+        
+        with mock.patch('shopping.search._trigram_available', True):
+            with CaptureQueriesContext(connection) as queries:
+                results = search_items('chedar')
+        
+        self.assertEqual(results, [self.cheese])
+        self.assertIn('"name" % ', queries.captured_queries[-1]['sql'])
+        
+    def test_index_sees_new_items(self):
+        """Saving an item invalidates the cached index"""
+        search_items('milk')
+        butter = GroceryItem.objects.create(name='Butter')
+        
+        self.assertIn(butter, search_items('butter'))
+
+
+class GroceryItemSearchViewTests(TestCase):
+    """Tests for the item search API"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+        self.milk = GroceryItem.objects.create(name='Milk', brand='Farm')
+        self.client.login(username='testuser', password='testpassword')
+        
+    def test_response_format(self):
+        """The search response keeps its item fields"""
+        response = self.client.get(reverse('item_search'), {'family': self.family.id, 'query': 'milk'})
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], [{
+            'id': self.milk.id,
+            'name': 'Milk',
+            'brand': 'Farm',
+            'category': '',
+            'image_url': '',
+        }])
@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from shopping.models import (
+    Family, FamilyMember, GroceryItem, GroceryStore, ItemStoreInfo, ProductCategory, StoreLocation
+)
+from shopping.store_utils import match_category_locations, resolve_item_locations
+
+
+class StoreLocationTableTests(TestCase):
+    """Tests for resolving items to store locations by category"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.other_store = GroceryStore.objects.create(name='Other Store')
+        self.family.stores.add(self.store, self.other_store)
+
+        self.produce = StoreLocation.objects.create(store=self.store, name='Fresh  PRODUCE', sort_order=10)
+        self.bakery = StoreLocation.objects.create(store=self.store, name='Bakery', sort_order=50)
+        self.other_bakery = StoreLocation.objects.create(store=self.other_store, name='Bread Aisle', sort_order=5)
+
+        self.apples = GroceryItem.objects.create(
+            name='Apples', category=ProductCategory.objects.create(name='Fruits'), created_by=self.user
+        )
+        self.bread = GroceryItem.objects.create(
+            name='Bread', category=ProductCategory.objects.create(name='bakery'), created_by=self.user
+        )
+        self.soap = GroceryItem.objects.create(name='Soap', created_by=self.user)
+
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_resolve_many_items_and_stores(self):
+        resolved = resolve_item_locations([self.apples, self.bread, self.soap], [self.store, self.other_store])
+
+        self.assertEqual(
+            {key: location.id for key, location in resolved.items()},
+            {
+                (self.apples.id, self.store.id): self.produce.id,
+                (self.bread.id, self.store.id): self.bakery.id,
+                (self.bread.id, self.other_store.id): self.other_bakery.id,
+            }
+        )
+
+    def test_table_is_cached_until_locations_change(self):
+        match_category_locations(self.store, ['Fruits'])
+        with self.assertNumQueries(0):
+            self.assertEqual(match_category_locations(self.store, ['Fruits', 'Bakery'])['Bakery'].id, self.bakery.id)
+            # Categories newer than the table are matched against the cached locations
+            self.assertEqual(match_category_locations(self.store, ['Baked Bakery Goods']), {})
+
+        fruit = StoreLocation.objects.create(store=self.store, name='Fruits', sort_order=1)
+        self.assertEqual(match_category_locations(self.store, ['Fruits'])['Fruits'].id, fruit.id)
+
+        fruit.delete()
+        self.produce.name = 'Dairy'
+        self.produce.save()
+        self.assertEqual(match_category_locations(self.store, ['Fruits']), {})
+
+    def test_store_locations_view_creates_missing_info_in_one_go(self):
+        ItemStoreInfo.objects.create(item=self.bread, store=self.store, location=None)
+        url = reverse('groceries:item_store_locations', args=[self.bread.id])
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        infos = {store.id: data['info'] for store, data in response.context['store_info'].items()}
+        self.assertIsNone(infos[self.store.id].location_id)
+        self.assertEqual(infos[self.other_store.id].location_id, self.other_bakery.id)
+        self.assertEqual(ItemStoreInfo.objects.filter(item=self.bread).count(), 2)
+        self.assertEqual(
+            [location.id for location in response.context['store_info'][self.store]['locations']],
+            [self.produce.id, self.bakery.id]
+        )
+
+        # Loading the page costs the same however many stores there are
+        queries = self.count_queries(url)
+        for index in range(3):
+            self.family.stores.add(GroceryStore.objects.create(name=f'Store {index}'))
+        self.assertEqual(self.count_queries(url), queries)
+
+    def count_queries(self, url):
+        # The first request creates any missing rows and builds the tables
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        return len(context.captured_queries)
@@ -0,0 +1,194 @@
+import json
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from shopping.models import (
+    Family, FamilyMember, GroceryStore, GroceryItem, ShoppingList, ShoppingListItem,
+    SyncChange, SyncLog
+)
+from shopping.sync import SETTLE_TIME
+
+
+class SyncTests(TestCase):
+    """Tests for the offline sync ingest and change feed endpoints"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+        self.other_family = Family.objects.create(name='Other Family', created_by=self.user)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.milk = GroceryItem.objects.create(name='Milk')
+        self.eggs = GroceryItem.objects.create(name='Eggs')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.list = ShoppingList.objects.create(
+                name='Weekly', store=self.store, family=self.family, created_by=self.user
+            )
+            self.milk_line = ShoppingListItem.objects.create(shopping_list=self.list, item=self.milk)
+            self.eggs_line = ShoppingListItem.objects.create(shopping_list=self.list, item=self.eggs)
+            self.other_list = ShoppingList.objects.create(
+                name='Theirs', store=self.store, family=self.other_family, created_by=self.user
+            )
+
+        self.client.login(username='testuser', password='testpassword')
+
+    def pull(self, since):
+        response = self.client.get(reverse('sync_changes'), {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def push(self, model, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('sync_ingest'),
+                data=json.dumps({'model': model, 'items': items}),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_snapshot_then_only_changed_rows(self):
+        """A first pull gets everything; later pulls only get what changed"""
+        snapshot = self.pull(0)
+        self.assertTrue(snapshot['reset'])
+        self.assertEqual([row['id'] for row in snapshot['lists']], [self.list.id])
+        self.assertEqual(len(snapshot['items']), 2)
+
+        self.assertEqual(self.pull(snapshot['cursor'])['items'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.list.apply_item_ops([{'op': 'toggle', 'id': self.milk_line.id}])
+            ShoppingListItem.objects.create(shopping_list=self.other_list, item=self.milk)
+
+        changes = self.pull(snapshot['cursor'])
+        self.assertFalse(changes['reset'])
+        self.assertEqual([row['id'] for row in changes['items']], [self.milk_line.id])
+        self.assertTrue(changes['items'][0]['checked'])
+        # The list comes along for its new counters
+        self.assertEqual(changes['lists'][0]['checked_items'], 1)
+        self.assertEqual(self.pull(changes['cursor'])['items'], [])
+
+    def test_deletes_are_reported_as_tombstones(self):
+        """Deleted rows are listed by ID, even if they changed earlier in the page"""
+        cursor = self.pull(0)['cursor']
+        eggs_line_id = self.eggs_line.id
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.eggs_line.quantity = 3
+            self.eggs_line.save()
+            self.eggs_line.delete()
+
+        changes = self.pull(cursor)
+        self.assertEqual(changes['deleted']['items'], [eggs_line_id])
+        self.assertEqual(changes['items'], [])
+
+    def test_pruned_cursor_gets_a_snapshot(self):
+        """A cursor older than the retained feed forces a full resync"""
+        cursor = self.pull(0)['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.milk_line.save()
+            self.milk_line.save()
+        SyncChange.objects.filter(id__lte=cursor + 1).delete()
+
+        self.assertTrue(self.pull(cursor)['reset'])
+
+    def test_pull_stops_short_of_changes_still_committing(self):
+        """A change that took its ID first but commits last is not skipped"""
+        cursor = self.pull(0)['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.milk_line.save()
+            self.eggs_line.save()
+        milk_change, eggs_change = SyncChange.objects.filter(id__gt=cursor)
+        # The milk change has its ID but hasn't committed yet
+        SyncChange.objects.filter(pk=milk_change.pk).delete()
+
+        changes = self.pull(cursor)
+        self.assertEqual(changes['items'], [])
+        self.assertEqual(changes['cursor'], cursor)
+
+        SyncChange.objects.bulk_create([milk_change])
+        changes = self.pull(cursor)
+        self.assertEqual({row['id'] for row in changes['items']}, {self.milk_line.id, self.eggs_line.id})
+        self.assertEqual(changes['cursor'], eggs_change.id)
+
+    def test_rolled_back_change_ids_are_skipped_once_settled(self):
+        """An ID that never commits only holds the cursor back for SETTLE_TIME"""
+        cursor = self.pull(0)['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.milk_line.save()
+            self.eggs_line.save()
+        SyncChange.objects.filter(id=cursor + 1).delete()
+        self.assertEqual(self.pull(cursor)['cursor'], cursor)
+
+        SyncChange.objects.filter(id__gt=cursor).update(created_at=timezone.now() - SETTLE_TIME)
+        changes = self.pull(cursor)
+        self.assertEqual([row['id'] for row in changes['items']], [self.eggs_line.id])
+        self.assertEqual(changes['cursor'], cursor + 2)
+
+    def test_ingest_is_idempotent_and_resolves_temp_ids(self):
+        """Replaying a batch applies nothing twice and temp IDs map to server IDs"""
+        list_ops = [{
+            'operation': 'create', 'record_id': None, 'op_id': 'op-1', 'timestamp': 1,
+            'data': {'list_data': {'name': 'Offline', 'store_id': self.store.id}, 'temp_id': -5},
+        }]
+        result = self.push('shopping_list', list_ops)
+        new_list_id = result['results'][0]['record_id']
+        self.assertEqual(result['updated_records'][0]['temp_id'], -5)
+
+        item_ops = [
+            {
+                'operation': 'create', 'record_id': None, 'op_id': 'op-2', 'timestamp': 2,
+                'data': {'item_data': {'item_id': self.milk.id, 'quantity': 2}, 'list_id': -5, 'temp_id': -6},
+            },
+            {
+                'operation': 'update', 'record_id': -6, 'op_id': 'op-3', 'timestamp': 3,
+                'data': {'checked': True, 'note': 'semi-skimmed'},
+            },
+        ]
+        self.push('shopping_list_item', item_ops)
+        replay = self.push('shopping_list_item', item_ops)
+        self.assertEqual([row['status'] for row in replay['results']], ['duplicate', 'duplicate'])
+        self.assertEqual(self.push('shopping_list', list_ops)['results'][0]['status'], 'duplicate')
+
+        new_list = ShoppingList.objects.get(pk=new_list_id)
+        line = new_list.items.get()
+        self.assertTrue(line.checked)
+        self.assertEqual(line.note, 'semi-skimmed')
+        self.assertEqual((new_list.item_count, new_list.checked_count), (1, 1))
+        self.assertEqual(ShoppingList.objects.filter(name='Offline').count(), 1)
+        self.assertEqual(SyncLog.objects.filter(user=self.user, synced=True).count(), 3)
+
+    def test_ingest_rejects_other_families(self):
+        """Ops on lists outside the user's families are rejected"""
+        result = self.push('shopping_list_item', [{
+            'operation': 'create', 'record_id': None, 'op_id': 'op-x',
+            'data': {'item_data': {'item_id': self.milk.id}, 'list_id': self.other_list.id},
+        }])
+        self.assertEqual(result['results'][0]['status'], 'rejected')
+        self.assertFalse(self.other_list.items.exists())
+
+    def test_concurrent_offline_edits_merge_per_field(self):
+        """Queues from two devices converge whichever is replayed first"""
+        phone = [
+            {'operation': 'update', 'record_id': self.milk_line.id, 'op_id': 'phone-1',
+             'clock': '0000000002000:0000:phone', 'data': {'checked': True}},
+            {'operation': 'update', 'record_id': self.milk_line.id, 'op_id': 'phone-2',
+             'clock': '0000000001000:0000:phone', 'data': {'quantity': '5'}},
+        ]
+        tablet = [
+            {'operation': 'update', 'record_id': self.milk_line.id, 'op_id': 'tablet-1',
+             'clock': '0000000001500:0000:tablet', 'data': {'checked': False, 'quantity': '2'}},
+        ]
+        self.push('shopping_list_item', tablet)
+        result = self.push('shopping_list_item', phone + tablet)
+
+        record = result['updated_records'][0]
+        self.assertTrue(record['checked'])
+        self.assertEqual(record['quantity'], '2.00')
+        self.assertEqual(
+            [row['status'] for row in result['results']], ['applied', 'applied', 'duplicate']
+        )
@@ -0,0 +1,39 @@
+from django.test import TestCase
+
+from shopping.models import ProductCategory, GroceryItem
+from shopping.utils import fuzzy_match_items
+
+
+class FuzzyMatchItemsTests(TestCase):
+    """Tests for bulk import item matching"""
+
+    def setUp(self):
+        self.dairy = ProductCategory.objects.create(name='Dairy')
+        self.milk = GroceryItem.objects.create(name='Whole Milk', category=self.dairy)
+        self.yogurt = GroceryItem.objects.create(name='Greek Yogurt', brand='Fage', category=self.dairy)
+        self.bread = GroceryItem.objects.create(name='Sourdough Bread')
+
+    def test_exact_and_fuzzy_matches(self):
+        """Substring matches score 1.0 and misspellings are matched from the index shortlist"""
+        results = fuzzy_match_items(['whole milk', 'sourdogh bread', 'Fage Greek Yoghurt', ''])
+
+        matches = {found['input_name']: found for found in results['found']}
+        self.assertEqual(matches['whole milk']['matched_item']['id'], self.milk.id)
+        self.assertEqual(matches['whole milk']['score'], 1.0)
+        self.assertEqual(matches['sourdogh bread']['matched_item']['id'], self.bread.id)
+        self.assertEqual(matches['Fage Greek Yoghurt']['matched_item']['id'], self.yogurt.id)
+        self.assertEqual(results['not_found'], [])
+
+    def test_unmatched_items_get_suggestions(self):
+        """Lines with no close item are reported with a suggested name"""
+        results = fuzzy_match_items(['dragon fruit'])
+
+        self.assertEqual(results['found'], [])
+        self.assertEqual(results['not_found'][0]['suggested_name'], 'Dragon Fruit')
+
+    def test_query_count_is_independent_of_line_count(self):
+        """Exact matches and fuzzy candidates are each fetched in a single query"""
+        fuzzy_match_items(['warmup'])
+
+        with self.assertNumQueries(2):
+            fuzzy_match_items(['whole milk', 'greek yogurt', 'sourdogh bread', 'wholemilk', 'yoghurt'])
@@ -2,10 +2,14 @@ from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from decimal import Decimal
 
 from shopping.models import (
     Family, FamilyMember, UserProfile, GroceryStore, StoreLocation,
-    ProductCategory, GroceryItem, ShoppingList, ShoppingListItem
+    ProductCategory, GroceryItem, ShoppingList, ShoppingListItem, ItemStoreInfo
 )
 
 
@@ -209,6 +213,56 @@ class ShoppingListViewTests(TestCase):
         self.assertEqual(len(response.context['list_items']), 1)
         self.assertEqual(response.context['list_items'][0], self.list_item)
         
+    def test_list_detail_view_store_locations(self):
+        """Items carry their location at the list's store and are ordered by aisle"""
+        self.client.login(username='testuser', password='testpassword')
+        other_store = GroceryStore.objects.create(name='Other Store')
+        produce = StoreLocation.objects.create(name='Produce', store=self.store, sort_order=1)
+        bakery = StoreLocation.objects.create(name='Bakery', store=self.store, sort_order=2)
+        elsewhere = StoreLocation.objects.create(name='Aisle 9', store=other_store, sort_order=0)
+        ItemStoreInfo.objects.create(item=self.item1, store=self.store, location=bakery)
+        ItemStoreInfo.objects.create(item=self.item1, store=other_store, location=elsewhere)
+        ItemStoreInfo.objects.create(item=self.item2, store=self.store, location=produce)
+        item3 = GroceryItem.objects.create(name='Test Item 3', category=self.category)
+        second = ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=self.item2)
+        third = ShoppingListItem.objects.create(shopping_list=self.shopping_list, item=item3, checked=True)
+        
+        response = self.client.get(self.list_detail_url)
+        
+        items = response.context['all_items']
+        self.assertEqual(items, [second, self.list_item, third])
+        self.assertEqual(items[0].current_store_info.location, produce)
+        self.assertEqual(items[1].current_store_info.location, bakery)
+        self.assertIsNone(items[2].current_store_info)
+        self.assertEqual(response.context['total_items'], 3)
+        self.assertEqual(response.context['checked_items'], 1)
+        
+    def test_list_detail_view_query_count(self):
+        """The number of queries doesn't grow with the number of items on the list"""
+        self.client.login(username='testuser', password='testpassword')
+        location = StoreLocation.objects.create(name='Produce', store=self.store)
+        ItemStoreInfo.objects.create(item=self.item1, store=self.store, location=location)
+        
+        def count_queries():
+            # Walk orders are cached per list version, so compare uncached loads
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.list_detail_url)
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+        
+        count_queries()
+        small_list_queries = count_queries()
+        
+        for position in range(30):
+            item = GroceryItem.objects.create(name=f'Bulk Item {position}', category=self.category)
+            ItemStoreInfo.objects.create(item=item, store=self.store, location=location)
+            ShoppingListItem.objects.create(
+                shopping_list=self.shopping_list, item=item, checked=position % 2 == 0
+            )
+        
+        self.assertEqual(count_queries(), small_list_queries)
+        
     def test_list_edit_view(self):
         """Test the shopping list edit view"""
         self.client.login(username='testuser', password='testpassword')
@@ -351,4 +405,94 @@ class ItemManagementViewTests(TestCase):
         self.assertIsNotNone(list_item)
         self.assertEqual(list_item.quantity, 1)
         self.assertEqual(list_item.unit, 'piece')
-        self.assertEqual(list_item.note, 'Another test note')
\ No newline at end of file
+        self.assertEqual(list_item.note, 'Another test note')
+
+class BatchUpdateListItemsViewTests(TestCase):
+    """Tests for the batched in-store item edit endpoint"""
+    
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.family = Family.objects.create(name='Test Family', created_by=self.user)
+        FamilyMember.objects.create(user=self.user, family=self.family, is_admin=True)
+        self.store = GroceryStore.objects.create(name='Test Store')
+        self.shopping_list = ShoppingList.objects.create(
+            name='Test List', store=self.store, family=self.family, created_by=self.user
+        )
+        self.milk = ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, item=GroceryItem.objects.create(name='Milk'), sort_order=1
+        )
+        self.eggs = ShoppingListItem.objects.create(
+            shopping_list=self.shopping_list, item=GroceryItem.objects.create(name='Eggs'), sort_order=2
+        )
+        self.url = reverse('groceries:batch_update_list_items', args=[self.shopping_list.id])
+        self.client.login(username='testuser', password='testpassword')
+        
+    def post_ops(self, ops):
+        import json
+        return self.client.post(self.url, json.dumps({'ops': ops}), content_type='application/json')
+    
+    def test_batch_applies_all_ops(self):
+        """Toggle, reorder, quantity and price ops are applied and counted together"""
+        version = ShoppingList.objects.get(pk=self.shopping_list.pk).version
+        
+        response = self.post_ops([
+            {'op': 'toggle', 'id': self.milk.id},
+            {'op': 'quantity', 'id': self.eggs.id, 'quantity': '12'},
+            {'op': 'price', 'id': self.eggs.id, 'price': '0.30'},
+            {'op': 'reorder', 'id': self.eggs.id, 'sort_order': 0},
+        ])
+        
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['version'], version + 1)
+        self.assertEqual((data['total_items'], data['checked_items']), (2, 1))
+        self.assertEqual(data['estimated_total'], '3.60')
+        
+        self.milk.refresh_from_db()
+        self.eggs.refresh_from_db()
+        self.assertTrue(self.milk.checked)
+        self.assertEqual(self.milk.sort_order, 102)
+        self.assertEqual((self.eggs.quantity, self.eggs.actual_price, self.eggs.sort_order),
+                         (12, Decimal('0.30'), 0))
+        info = ItemStoreInfo.objects.get(item=self.eggs.item, store=self.store)
+        self.assertEqual(info.last_price, Decimal('0.30'))
+        
+    def test_repeated_toggles_collapse(self):
+        """Explicit checked states are idempotent and unchanged items aren't written"""
+        self.post_ops([{'op': 'toggle', 'id': self.milk.id, 'checked': True}])
+        
+        response = self.post_ops([
+            {'op': 'toggle', 'id': self.milk.id, 'checked': True},
+            {'op': 'toggle', 'id': self.eggs.id},
+            {'op': 'toggle', 'id': self.eggs.id},
+        ])
+        
+        data = response.json()
+        self.assertEqual(data['checked_items'], 1)
+        self.assertEqual({item['id'] for item in data['items']}, {self.eggs.id})
+        
+        # A batch that changes nothing leaves the version alone
+        response = self.post_ops([{'op': 'toggle', 'id': self.milk.id, 'checked': True}])
+        self.assertEqual(response.json()['version'], data['version'])
+        
+    def test_invalid_batch_is_rejected_whole(self):
+        """One bad op rejects the whole batch without applying anything"""
+        other_list = ShoppingList.objects.create(
+            name='Other', store=self.store, family=self.family, created_by=self.user
+        )
+        stranger = ShoppingListItem.objects.create(shopping_list=other_list, item=self.milk.item)
+        
+        for ops in (
+            [{'op': 'toggle', 'id': self.milk.id}, {'op': 'toggle', 'id': stranger.id}],
+            [{'op': 'toggle', 'id': self.milk.id}, {'op': 'quantity', 'id': self.eggs.id, 'quantity': 'lots'}],
+            [{'op': 'delete', 'id': self.milk.id}],
+            # Too big for the item's columns
+            [{'op': 'toggle', 'id': self.milk.id}, {'op': 'price', 'id': self.eggs.id, 'price': 1e6}],
+            [{'op': 'price', 'id': self.eggs.id, 'price': '9999.999'}],
+            [{'op': 'quantity', 'id': self.eggs.id, 'quantity': '10000'}],
+        ):
+            self.assertEqual(self.post_ops(ops).status_code, 400)
+        
+        self.milk.refresh_from_db()
+        self.assertFalse(self.milk.checked)
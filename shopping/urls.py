@@ -17,6 +17,7 @@ urlpatterns = [
     path('lists/bulk-import/', views.BulkImportView.as_view(), name='bulk_import'),
     path('lists/bulk-import/confirm/', views.BulkImportConfirmView.as_view(), name='bulk_import_confirm'),
     path('lists/<int:pk>/', views.ShoppingListDetailView.as_view(), name='list_detail'),
+    path('lists/<int:pk>/basket/', views.ShoppingListBasketView.as_view(), name='list_basket'),
     path('lists/<int:pk>/edit/', views.ShoppingListUpdateView.as_view(), name='edit_list'),
     path('lists/<int:pk>/delete/', views.ShoppingListDeleteView.as_view(), name='delete_list'),
     path('lists/<int:pk>/complete/', views.ShoppingListCompleteView.as_view(), name='complete_list'),
@@ -27,6 +28,8 @@ urlpatterns = [
     path('lists/<int:list_id>/items/add/', views.AddListItemView.as_view(), name='add_list_item'),
     path('lists/<int:list_id>/items/categories/', views.CategoryItemSelectionView.as_view(), name='category_selection'),
     path('lists/<int:list_id>/items/add-multiple/', views.AddMultipleItemsView.as_view(), name='add_multiple_items'),
+    path('lists/<int:list_id>/items/batch/', views.BatchUpdateListItemsView.as_view(), name='batch_update_list_items'),
+    path('lists/<int:list_id>/events/', views.ListEventsView.as_view(), name='list_events'),
     path('lists/<int:list_id>/items/<int:item_id>/toggle/', views.ToggleListItemView.as_view(), name='toggle_list_item'),
     path('lists/<int:list_id>/items/<int:item_id>/price/', views.UpdateListItemPriceView.as_view(), name='update_item_price'),
     path('lists/<int:list_id>/items/<int:item_id>/location/', views.UpdateListItemLocationView.as_view(), name='update_item_location'),
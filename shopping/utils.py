@@ -80,42 +80,83 @@ def similarity(a: str, b: str) -> float:
     return SequenceMatcher(None, a.lower(), b.lower()).ratio()
 
 
+# How many index candidates are scored exactly for each input line
+FUZZY_CANDIDATE_LIMIT = 40
+
+# Minimum share of shared trigrams for an item to be shortlisted
+FUZZY_CANDIDATE_MIN_SCORE = 0.2
+
+
 def fuzzy_match_items(item_names: List[str], threshold: float = 0.6) -> Dict[str, List[Dict]]:
     """
     Fuzzy match a list of item names against existing grocery items.
     
+    Exact and substring matches for every line are found with a single
+    query. Remaining lines are shortlisted from the in-memory trigram index
+    and only those candidates are scored with SequenceMatcher.
+    
     Returns a dictionary with:
     - 'found': List of items that were matched
     - 'not_found': List of items that couldn't be matched
     """
+    from .search import get_item_index
+    
     results = {
         'found': [],
         'not_found': []
     }
     
-    # Get all existing items
-    existing_items = GroceryItem.objects.all().values('id', 'name', 'brand', 'category__name')
-    
-    for item_name in item_names:
-        item_name = item_name.strip()
-        if not item_name:
-            continue
-            
-        best_match = None
-        best_score = 0
-        
-        # Search for exact matches first
-        exact_matches = GroceryItem.objects.filter(
-            Q(name__iexact=item_name) |
-            Q(name__icontains=item_name)
-        ).values('id', 'name', 'brand', 'category__name')
+    names = [item_name.strip() for item_name in item_names]
+    names = [item_name for item_name in names if item_name]
+    if not names:
+        return results
+    
+    fields = ('id', 'name', 'brand', 'category__name')
+    
+    # Search for exact matches first, for all lines at once
+    exact_query = Q()
+    for item_name in set(names):
+        exact_query |= Q(name__icontains=item_name)
+    exact_rows = list(GroceryItem.objects.filter(exact_query).values(*fields))
+    
+    exact_matches = {}
+    for item_name in names:
+        needle = item_name.lower()
+        for row in exact_rows:
+            if needle in row['name'].lower():
+                exact_matches[item_name] = row
+                break
+    
+    # Shortlist fuzzy candidates from the trigram index
+    index = get_item_index()
+    candidate_ids = {}
+    for item_name in names:
+        if item_name not in exact_matches:
+            candidate_ids[item_name] = [
+                item_id for item_id, _ in index.names.search(
+                    item_name,
+                    limit=FUZZY_CANDIDATE_LIMIT,
+                    min_score=FUZZY_CANDIDATE_MIN_SCORE
+                )
+            ]
+    
+    all_candidate_ids = {item_id for ids in candidate_ids.values() for item_id in ids}
+    candidates = {
+        row['id']: row
+        for row in GroceryItem.objects.filter(id__in=all_candidate_ids).values(*fields)
+    } if all_candidate_ids else {}
+    
+    for item_name in names:
+        best_match = exact_matches.get(item_name)
+        best_score = 1.0 if best_match else 0
         
-        if exact_matches:
-            best_match = exact_matches[0]
-            best_score = 1.0
-        else:
+        if not best_match:
             # Fuzzy matching
-            for existing_item in existing_items:
+            for item_id in candidate_ids[item_name]:
+                existing_item = candidates.get(item_id)
+                if not existing_item:
+                    continue
+                
                 # Compare with item name
                 score = similarity(item_name, existing_item['name'])
                 
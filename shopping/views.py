@@ -4,14 +4,13 @@ from django.http import JsonResponse, HttpResponseForbidden
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import F, Count, Q, Subquery, OuterRef
+from django.db.models import F, Q, Subquery, OuterRef
 from django.db import IntegrityError
 from django.utils.text import slugify
 from django.views.generic import (
     ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView, View
 )
 from django.views.generic.base import TemplateView
-from django.utils import timezone
 
 import logging
 
@@ -21,7 +20,7 @@ logger = logging.getLogger(__name__)
 from .models import (
     Family, FamilyMember, UserProfile, GroceryStore, GroceryItem,
     ShoppingList, ShoppingListItem, StoreLocation,
-    FamilyItemUsage, ProductCategory, ItemStoreInfo
+    FamilyItemUsage, ProductCategory, ItemStoreInfo, CheapestItemPrice
 )
 from .forms import (
     ShoppingListForm, FamilyForm, GroceryStoreForm, GroceryItemForm,
@@ -29,7 +28,11 @@ from .forms import (
     UserRegistrationForm, BulkImportForm
 )
 from .utils import parse_bulk_import_text, fuzzy_match_items
+from .allergens import AllergenDetector
+from .basket import DEFAULT_SPLIT_STORES, MAX_SPLIT_STORES, price_basket
 from .recommender import ShoppingRecommender
+from .search import search_items
+from .food_api import OpenFoodFactsAPI
 from .store_utils import (
     create_default_store_locations, get_common_store_data,
     search_store_info, save_store_logo_from_url
@@ -119,7 +122,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                 
                 # Get recommended items for this family
                 context['recommended_items'] = ShoppingRecommender.get_recommendations_for_family(
-                    family, limit=8
+                    family, limit=8, exclude_flags=UserProfile.safety_mask_for(self.request.user)
                 )
             else:
                 context['recent_lists'] = []
@@ -253,16 +256,8 @@ class ShoppingListCreateView(LoginRequiredMixin, CreateView):
     def duplicate_template_items(self, template_list):
         """Duplicate items from a template list to the current list"""
         # Check if template list belongs to the same family
-        if template_list.family == self.object.family:
-            for item in template_list.items.all():
-                ShoppingListItem.objects.create(
-                    shopping_list=self.object,
-                    item=item.item,
-                    quantity=item.quantity,
-                    unit=item.unit,
-                    note=item.note,
-                    sort_order=item.sort_order
-                )
+        if template_list.family_id == self.object.family_id:
+            self.object.copy_items_from(template_list)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -310,44 +305,15 @@ class ShoppingListDetailView(LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         shopping_list = self.object
 
-        # Import here to avoid circular imports
-        from django.db.models import Prefetch, OuterRef, Subquery
-        
-        # Get list items organized with store location ordering
-        list_items = shopping_list.items.select_related(
-            'item', 'item__category'
-        ).annotate(
-            # Get location sort order only for the current store
-            location_sort=Subquery(
-                ItemStoreInfo.objects.filter(
-                    item=OuterRef('item_id'),
-                    store=shopping_list.store
-                ).values('location__sort_order')[:1]
-            )
-        ).order_by(
-            'checked',
-            'location_sort',
-            'sort_order',
-            'item__name'
-        ).distinct()
+        # One query for the items, their store info and aisle at this store
+        all_items = shopping_list.load_detail_items()
+        total_items = len(all_items)
+        checked_items = sum(1 for item in all_items if item.checked)
         
-        # Add the current store's location information to each item
-        for item in list_items:
-            # Find the store_info for this item and store
-            store_info = ItemStoreInfo.objects.filter(
-                item=item.item,
-                store=shopping_list.store
-            ).select_related('location').first()
-            
-            # Attach it directly to the item for easy access in the template
-            item.current_store_info = store_info
-
-        # Use flat list view only
-        all_items = list(list_items)    
         # Get recommendations for this list
         try:
             recommended_items = ShoppingRecommender.get_recommendations_based_on_list(
-                shopping_list, limit=8
+                shopping_list, limit=8, exclude_flags=UserProfile.safety_mask_for(self.request.user)
             )
         except Exception as e:
             # Use a default empty list if an error occurs
@@ -357,9 +323,10 @@ class ShoppingListDetailView(LoginRequiredMixin, DetailView):
         # Add all items to context for flat list view
         context['all_items'] = all_items
         context['recommended_items'] = recommended_items
-        context['total_items'] = list_items.count()
-        context['checked_items'] = list_items.filter(checked=True).count()
-        context['list_items'] = list_items  # Original queryset for reference
+        context['total_items'] = total_items
+        context['checked_items'] = checked_items
+        context['progress_percentage'] = int(checked_items / total_items * 100) if total_items else 0
+        context['list_items'] = all_items
         context['store_locations'] = StoreLocation.objects.filter(store=shopping_list.store).order_by('sort_order')
         
         # Add categories for the add product modal
@@ -367,6 +334,24 @@ class ShoppingListDetailView(LoginRequiredMixin, DetailView):
         
         return context
 
+class ShoppingListBasketView(LoginRequiredMixin, View):
+    """What a list costs at each of the family's stores, and the cheapest split-trip plan"""
+    
+    def get(self, request, pk):
+        shopping_list = get_object_or_404(
+            ShoppingList.objects.filter(family__members__user=request.user).distinct(),
+            pk=pk
+        )
+        
+        try:
+            max_stores = int(request.GET.get('max_stores', DEFAULT_SPLIT_STORES))
+        except ValueError:
+            max_stores = 0
+        if not 1 <= max_stores <= MAX_SPLIT_STORES:
+            return JsonResponse({'error': f'max_stores must be between 1 and {MAX_SPLIT_STORES}'}, status=400)
+        
+        return JsonResponse(price_basket(shopping_list, max_stores))
+
 class ShoppingListUpdateView(LoginRequiredMixin, UpdateView):
     model = ShoppingList
     form_class = ShoppingListForm
@@ -432,10 +417,8 @@ class ShoppingListCompleteView(LoginRequiredMixin, View):
             pk=pk
         )
         
-        # Update list status
-        shopping_list.completed = True
-        shopping_list.completed_at = timezone.now()
-        shopping_list.save()
+        # Also feeds the list into the co-purchase counts and replenishment cadence
+        shopping_list.set_completed(True)
         
         messages.success(request, f'Shopping list "{shopping_list.name}" marked as complete')
         
@@ -455,10 +438,9 @@ class ShoppingListReopenView(LoginRequiredMixin, View):
             pk=pk
         )
         
-        # Update list status
-        shopping_list.completed = False
-        shopping_list.completed_at = None
-        shopping_list.save()
+        # Also takes the list back out of the co-purchase counts and
+        # replenishment cadence until it is completed again
+        shopping_list.set_completed(False)
         
         messages.success(request, f'Shopping list "{shopping_list.name}" reopened')
         
@@ -586,6 +568,75 @@ class ToggleListItemView(LoginRequiredMixin, View):
             'checked': list_item.checked
         })
 
+class BatchUpdateListItemsView(LoginRequiredMixin, View):
+    """Apply many toggle/reorder/quantity/price edits to a list in one request"""
+    
+    def post(self, request, list_id):
+        import json
+        
+        shopping_list = get_object_or_404(
+            ShoppingList.objects.filter(family__members__user=request.user).distinct(),
+            pk=list_id
+        )
+        
+        try:
+            data = json.loads(request.body)
+            ops = data.get('ops') if isinstance(data, dict) else None
+            if not isinstance(ops, list):
+                return JsonResponse({'error': 'Expected a list of ops'}, status=400)
+            changed = shopping_list.apply_item_ops(ops)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        return JsonResponse({
+            'success': True,
+            'version': shopping_list.version,
+            'total_items': shopping_list.item_count,
+            'checked_items': shopping_list.checked_count,
+            'estimated_total': str(shopping_list.estimated_total),
+            'items': [
+                {
+                    'id': item.id,
+                    'checked': item.checked,
+                    'sort_order': item.sort_order,
+                    'quantity': str(item.quantity),
+                    'actual_price': None if item.actual_price is None else str(item.actual_price),
+                }
+                for item in changed
+            ]
+        })
+
+class ListEventsView(View):
+    """Server-Sent Events stream of changes to a list's items"""
+    
+    async def get(self, request, list_id):
+        from django.contrib.auth.views import redirect_to_login
+        from django.http import Http404, StreamingHttpResponse
+        from .live import event_stream
+        
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        
+        if not await ShoppingList.objects.filter(pk=list_id, family__members__user=user).aexists():
+            raise Http404('Shopping list not found')
+        
+        # Browsers resend the last event ID when they reconnect
+        try:
+            last_event_id = int(request.headers.get('Last-Event-ID') or request.GET['since'])
+        except (KeyError, ValueError):
+            last_event_id = None
+        
+        response = StreamingHttpResponse(
+            event_stream(list_id, last_event_id), content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Stop nginx buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
 class UpdateListItemPriceView(LoginRequiredMixin, View):
     """Update a list item's price"""
     
@@ -600,44 +651,30 @@ class UpdateListItemPriceView(LoginRequiredMixin, View):
         )
         
         try:
-            price = float(request.POST.get('price', 0))
+            # An empty price clears it
+            price = request.POST.get('price', 0)
+            price = float(price) if str(price).strip() else None
             
             # Update item price
             list_item.actual_price = price
             list_item.save()
             
-            # If this item has store info, update the last price there too
-            try:
-                item_store_info = ItemStoreInfo.objects.get(
-                    item=list_item.item,
-                    store=list_item.shopping_list.store
-                )
-                item_store_info.last_price = price
-                item_store_info.last_purchased = timezone.now()
-                
-                # Update average price
-                if item_store_info.average_price:
-                    item_store_info.average_price = (item_store_info.average_price + price) / 2
-                else:
-                    item_store_info.average_price = price
-                    
-                item_store_info.save()
-            except ItemStoreInfo.DoesNotExist:
-                # Create new store info if it doesn't exist
-                store_info = ItemStoreInfo.objects.create(
-                    item=list_item.item,
-                    store=list_item.shopping_list.store,
-                    last_price=price,
-                    average_price=price,
-                    last_purchased=timezone.now()
-                )
-                
+            # Record the price in the item's history and statistics at this
+            # store, replacing any entered on this list item before
+            store = list_item.shopping_list.store
+            created = ItemStoreInfo.record_prices(
+                store.id, {list_item.item_id: price}, list_item_ids={list_item.item_id: list_item.id}
+            )
+            
+            if created:
                 # Set the location based on the item's category
-                from .store_utils import find_matching_store_location
-                matching_location = find_matching_store_location(list_item.item, list_item.shopping_list.store)
-                if matching_location:
-                    store_info.location = matching_location
-                    store_info.save()
+                from .store_utils import resolve_item_locations
+                placed = resolve_item_locations([list_item.item], [store])
+                for store_info in created:
+                    matching_location = placed.get((store_info.item_id, store.id))
+                    if matching_location:
+                        store_info.location = matching_location
+                        store_info.save(update_fields=['location'])
             
             return JsonResponse({
                 'success': True,
@@ -1116,37 +1153,16 @@ class GroceryItemSearchView(LoginRequiredMixin, View):
             if store_id:
                 store = GroceryStore.objects.get(id=store_id)
             
+            # Leave out items with the user's allergens or diet conflicts
+            exclude_flags = UserProfile.safety_mask_for(request.user)
+            
             if query:
-                # Search for items by name/brand matching the query (case insensitive)
-                items = GroceryItem.objects.filter(
-                    Q(name__icontains=query) | 
-                    Q(brand__icontains=query) |
-                    Q(description__icontains=query) |
-                    Q(category__name__icontains=query)
-                ).distinct()
-                
-                if store:
-                    # Use a left outer join to include items without store info
-                    items = items.filter(
-                        Q(store_info__store=store) | Q(store_info__isnull=True)
-                    )
-                
-                # Log the query and result count for debugging
-                print(f"DEBUG: Search query '{query}' for family {family.id}, found initial count: {items.count()}")
-                
-                # Sort by family usage first, then global popularity
-                items = items.annotate(
-                    family_usage_count=Count(
-                        'family_usage',
-                        filter=Q(family_usage__family=family),
-                        distinct=True
-                    )
-                ).order_by('-family_usage_count', '-global_popularity')[:20]
-                
+                # Ranked by relevance, then family usage, then global popularity
+                items = search_items(query, family=family, store=store, limit=20, exclude_flags=exclude_flags)
             else:
                 # Get recommendations for this family and store
                 items = ShoppingRecommender.get_recommendations_for_family(
-                    family, store, limit=20
+                    family, store, limit=20, exclude_flags=exclude_flags
                 )
             
             # Format response
@@ -1318,6 +1334,43 @@ class LandingPageView(TemplateView):
 class OfflineView(TemplateView):
     template_name = 'groceries/offline.html'
 
+class SyncIngestView(LoginRequiredMixin, View):
+    """Apply a batch of changes queued by a device while it was offline"""
+    
+    def post(self, request):
+        import json
+        from .sync import apply_client_ops
+        
+        try:
+            data = json.loads(request.body)
+            ops = data.get('items') if isinstance(data, dict) else None
+            if not isinstance(ops, list):
+                return JsonResponse({'error': 'Expected a list of items'}, status=400)
+            results, records = apply_client_ops(request.user, data.get('model'), ops)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        return JsonResponse({
+            'success': True,
+            'results': results,
+            'updated_records': records,
+        })
+
+class SyncChangesView(LoginRequiredMixin, View):
+    """Lists and items changed since the device's last sync cursor"""
+    
+    def get(self, request):
+        from .sync import changes_since
+        
+        try:
+            since = int(request.GET.get('since', 0))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        
+        return JsonResponse({'success': True, **changes_since(request.user, since)})
+
 class BarcodeSearchView(LoginRequiredMixin, View):
     """API endpoint to search for items by barcode"""
     
@@ -1337,43 +1390,29 @@ class BarcodeSearchView(LoginRequiredMixin, View):
                     'image_url': item.image_url or ''
                 })
             
-            # If not found locally, try Open Food Facts API
-            # This is an example of how to query the Open Food Facts API
-            # In a real implementation, you would want to handle API errors, rate limiting, etc.
-            import requests
-            response = requests.get(f'https://world.openfoodfacts.org/api/v0/product/{barcode}.json')
-            data = response.json()
+            # If not found locally, try Open Food Facts (timed out, coalesced
+            # and circuit broken by the shared client, so an OFF outage
+            # can't hold this worker)
+            product = OpenFoodFactsAPI.get_product(barcode)
             
-            if data.get('status') == 1:
-                # Product found in Open Food Facts
-                product = data.get('product', {})
-                
-                # Extract relevant data
-                name = product.get('product_name', '')
-                brand = product.get('brands', '')
-                category_tag = product.get('categories_tags', [''])[0] if product.get('categories_tags') else ''
-                image_url = product.get('image_url', '')
-                
+            if product:
                 # Find or create a category
                 category = None
-                if category_tag:
-                    # Convert category tag to a readable name
-                    category_name = category_tag.replace('en:', '').replace('-', ' ').title()
-                    
-                    # Find or create the category
+                if product['category']:
                     category, _ = ProductCategory.objects.get_or_create(
-                        name=category_name
+                        name=product['category']
                     )
                 
                 # Create the item in our database
                 item = GroceryItem.objects.create(
-                    name=name,
-                    brand=brand,
+                    name=product['name'] or '',
+                    brand=product['brand'] or '',
                     category=category,
                     barcode=barcode,
-                    image_url=image_url,
+                    image_url=product['image_url'] or '',
                     is_verified=True,  # This is from a verified source
-                    off_id=data.get('code'),  # Store the Open Food Facts ID
+                    off_id=product['code'],  # Store the Open Food Facts ID
+                    safety_flags=AllergenDetector.safety_flags(product),
                     created_by=None  # System-created item
                 )
                 
@@ -1742,10 +1781,13 @@ class GroceryItemListView(LoginRequiredMixin, ListView):
         # Filter query by search term if provided
         search_term = self.request.GET.get('search', '')
         
-        # Start with basic queryset filtering for items accessible to the user
+        # Items the user created or their families use; a subquery rather than
+        # a join through the families keeps rows unique without distinct()
         queryset = GroceryItem.objects.filter(
-            Q(created_by=self.request.user) | 
-            Q(families__members__user=self.request.user)
+            Q(created_by=self.request.user) |
+            Q(pk__in=FamilyItemUsage.objects.filter(
+                family__members__user=self.request.user
+            ).values('item_id'))
         )
         
         if search_term:
@@ -1755,43 +1797,24 @@ class GroceryItemListView(LoginRequiredMixin, ListView):
                 Q(category__name__icontains=search_term)
             )
             
-        # Annotate the queryset with lowest price info
-        # First, get user's accessible stores
-        user_families = Family.objects.filter(members__user=self.request.user)
-        accessible_stores = GroceryStore.objects.filter(
-            families__in=user_families
-        ).distinct()
+        return queryset.order_by('name')
+    
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, items, is_paginated = super().paginate_queryset(queryset, page_size)
         
-        # Add annotations for lowest price and associated store
-        from django.db.models import Min, OuterRef, Subquery
-        
-        # Subquery to find the lowest price for each item
-        # This complex query handles cases where typical_price might be NULL
-        # by falling back to last_price or average_price
-        from django.db.models.functions import Coalesce
-        
-        store_info_subquery = ItemStoreInfo.objects.filter(
-            item=OuterRef('pk'),
-            store__in=accessible_stores
-        ).annotate(
-            effective_price=Coalesce('typical_price', 'last_price', 'average_price')
-        ).exclude(
-            effective_price__isnull=True
-        ).order_by('effective_price')
-        
-        queryset = queryset.annotate(
-            lowest_price=Subquery(
-                store_info_subquery.values('effective_price')[:1]
-            ),
-            lowest_price_store_id=Subquery(
-                store_info_subquery.values('store__id')[:1]
-            ),
-            lowest_price_store_name=Subquery(
-                store_info_subquery.values('store__name')[:1]
-            )
-        )
-            
-        return queryset.distinct().order_by('name')
+        # Only the page's items need a lowest price, read from the maintained
+        # per-family cheapest prices across the user's families
+        items = list(items)
+        family_ids = FamilyMember.objects.filter(user=self.request.user).values_list('family_id', flat=True)
+        cheapest = CheapestItemPrice.for_items(family_ids, [item.id for item in items])
+        for item in items:
+            row = cheapest.get(item.id)
+            item.lowest_price = row.price if row else None
+            item.lowest_price_store_id = row.store_id if row else None
+            item.lowest_price_store_name = row.store.name if row else None
+        
+        page.object_list = items
+        return paginator, page, items, is_paginated
         
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1818,41 +1841,52 @@ class ItemStoreLocationView(LoginRequiredMixin, UpdateView):
         return GroceryItem.objects.filter(
             Q(created_by=self.request.user) | 
             Q(families__members__user=self.request.user)
-        ).distinct()
+        ).select_related('category').distinct()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
         # Get stores the user has access to
         user_families = Family.objects.filter(members__user=self.request.user)
-        stores = GroceryStore.objects.filter(
+        stores = list(GroceryStore.objects.filter(
             families__in=user_families
-        ).distinct()
+        ).distinct())
+        
+        # Get store info for this item at every store at once
+        infos = {
+            info.store_id: info
+            for info in ItemStoreInfo.objects.filter(item=self.object, store__in=stores).select_related('location')
+        }
+        
+        # Create the missing associations in one insert, placing the item
+        # by its category where the store has a matching location
+        missing = [store for store in stores if store.id not in infos]
+        if missing:
+            from .store_utils import resolve_item_locations
+            from .routes import invalidate_store_routes
+            placed = resolve_item_locations([self.object], missing)
+            ItemStoreInfo.objects.bulk_create([
+                ItemStoreInfo(item=self.object, store=store, location=placed.get((self.object.id, store.id)))
+                for store in missing
+            ], ignore_conflicts=True)
+            infos.update(
+                (info.store_id, info)
+                for info in ItemStoreInfo.objects.filter(item=self.object, store__in=missing).select_related('location')
+            )
+            # bulk_create skips the signal that keeps aisle routes current
+            if placed:
+                invalidate_store_routes({store_id for _, store_id in placed})
+        
+        # Get store locations for every store in one query
+        locations = {}
+        for location in StoreLocation.objects.filter(store__in=stores).order_by('sort_order', 'name'):
+            locations.setdefault(location.store_id, []).append(location)
         
-        # Get store info for this item
         store_info = {}
         for store in stores:
-            # Get or initialize store info for this item
-            info, created = ItemStoreInfo.objects.get_or_create(
-                item=self.object,
-                store=store
-            )
-            
-            # If this is a new association and the item doesn't have a location yet,
-            # try to set it based on the item's category
-            if created and not info.location:
-                from .store_utils import find_matching_store_location
-                matching_location = find_matching_store_location(self.object, store)
-                if matching_location:
-                    info.location = matching_location
-                    info.save()
-            
-            # Get store locations
-            locations = StoreLocation.objects.filter(store=store).order_by('sort_order', 'name')
-            
             store_info[store] = {
-                'info': info,
-                'locations': locations
+                'info': infos[store.id],
+                'locations': locations.get(store.id, [])
             }
         
         context['store_info'] = store_info
@@ -2057,18 +2091,24 @@ class BulkImportView(LoginRequiredMixin, View):
                 created_by=request.user
             )
             
+            # Fetch every matched item in one query
+            found_items = bulk_data['matching_results']['found']
+            grocery_items = GroceryItem.objects.in_bulk(
+                [found_item['matched_item']['id'] for found_item in found_items]
+            )
+            
             # Add all matched items to the list
             items_added = 0
-            for found_item in bulk_data['matching_results']['found']:
+            for found_item in found_items:
                 # Find the corresponding parsed item to get quantity and unit
                 parsed_item = next(
                     (item for item in bulk_data['parsed_items'] 
                      if item['name'] == found_item['input_name']), 
                     None
                 )
+                grocery_item = grocery_items.get(found_item['matched_item']['id'])
                 
-                if parsed_item:
-                    grocery_item = GroceryItem.objects.get(id=found_item['matched_item']['id'])
+                if parsed_item and grocery_item:
                     ShoppingListItem.objects.create(
                         shopping_list=shopping_list,
                         item=grocery_item,
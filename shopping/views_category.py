@@ -6,8 +6,9 @@ from django.views.generic import View
 from django.db.models import Count
 from django.contrib import messages
 
+from .allergens import safe_items_filter
 from .models import (
-    ShoppingList, ShoppingListItem, GroceryItem, ProductCategory, FamilyMember
+    ShoppingList, ShoppingListItem, GroceryItem, ProductCategory, FamilyMember, UserProfile
 )
 
 class CategoryItemSelectionView(LoginRequiredMixin, View):
@@ -22,15 +23,19 @@ class CategoryItemSelectionView(LoginRequiredMixin, View):
         if not FamilyMember.objects.filter(user=request.user, family=shopping_list.family).exists():
             return HttpResponseForbidden("You don't have permission to view this list")
         
+        # Leave out items with the user's allergens or diet conflicts
+        exclude_flags = UserProfile.safety_mask_for(request.user)
+        
         # Get all categories with items
         categories = ProductCategory.objects.annotate(
-            item_count=Count('items')
+            item_count=Count('items', filter=safe_items_filter(exclude_flags, 'items__safety_flags'))
         ).filter(item_count__gt=0).order_by('name')
         
         # Get items for each category
         items_by_category = {}
         for category in categories:
             items_by_category[category.id] = GroceryItem.objects.filter(
+                safe_items_filter(exclude_flags),
                 category=category
             ).order_by('name')
         
@@ -0,0 +1,106 @@
+/**
+ * Live list updates
+ *
+ * Listens for item changes other family members make to the open list
+ * (Server-Sent Events from /app/lists/<id>/events/) and applies them to the
+ * page in place, so the list doesn't need reloading to stay current.
+ */
+(function() {
+    const container = document.getElementById('shopping-list');
+    if (!container || !window.EventSource) {
+        return;
+    }
+
+    const listId = container.dataset.listId;
+    let newItemsNoticeShown = false;
+
+    function formatQuantity(quantity, unit) {
+        const value = parseFloat(quantity);
+        const text = Number.isInteger(value) ? String(value) : quantity;
+        return unit ? `${text} ${unit}` : text;
+    }
+
+    function applyItem(item) {
+        const rows = document.querySelectorAll(`.list-item[data-item-id="${item.id}"]`);
+        if (rows.length === 0) {
+            return false;
+        }
+
+        rows.forEach(row => {
+            row.classList.toggle('checked', item.checked);
+            row.querySelectorAll('.custom-checkbox').forEach(cb => cb.classList.toggle('checked', item.checked));
+
+            const quantity = row.querySelector('.item-quantity');
+            if (quantity) {
+                quantity.textContent = formatQuantity(item.quantity, item.unit);
+            }
+
+            const price = row.querySelector('.item-price');
+            if (price) {
+                price.textContent = item.actual_price ? `$${item.actual_price}` : '';
+            }
+
+            const note = row.querySelector('.item-note');
+            if (note) {
+                note.textContent = item.note || '';
+            }
+        });
+        return true;
+    }
+
+    function applyCounters(list) {
+        const progressCount = document.querySelector('.progress-count');
+        if (progressCount) {
+            progressCount.textContent = `${list.checked_items}/${list.total_items}`;
+        }
+
+        const progressBar = document.querySelector('.progress-bar');
+        if (progressBar) {
+            const percentage = list.total_items > 0 ? Math.floor((list.checked_items / list.total_items) * 100) : 0;
+            progressBar.style.width = percentage + '%';
+            progressBar.setAttribute('aria-valuenow', percentage);
+        }
+    }
+
+    function showNewItemsNotice() {
+        if (newItemsNoticeShown) {
+            return;
+        }
+        newItemsNoticeShown = true;
+
+        // New rows need the server-rendered markup, so offer a refresh
+        if (typeof window.toastNotification === 'function') {
+            window.toastNotification('Items were added to this list. Refresh to see them.', 'info');
+        }
+    }
+
+    const source = new EventSource(`/app/lists/${listId}/events/`);
+
+    source.addEventListener('changes', function(event) {
+        const delta = JSON.parse(event.data);
+
+        if (!delta.list) {
+            if (typeof window.toastNotification === 'function') {
+                window.toastNotification('This list was deleted.', 'warning');
+            }
+            source.close();
+            return;
+        }
+
+        delta.items.forEach(item => {
+            if (!applyItem(item)) {
+                showNewItemsNotice();
+            }
+        });
+
+        delta.deleted_items.forEach(itemId => {
+            document.querySelectorAll(`.list-item[data-item-id="${itemId}"]`).forEach(row => row.remove());
+        });
+
+        applyCounters(delta.list);
+    });
+
+    window.addEventListener('pagehide', function() {
+        source.close();
+    });
+})();
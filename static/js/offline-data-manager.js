@@ -21,6 +21,10 @@ class OfflineDataManager {
       { name: 'userPreferences', keyPath: 'key' }
     ];
     
+    // Hybrid logical clock stamped on queued edits so the server can merge
+    // edits from several devices field by field
+    this.lastClock = JSON.parse(localStorage.getItem('shopsmartClock') || '{"wall":0,"counter":0}');
+    
     this.initialized = this.initDatabase();
     
     // Monitor online status
@@ -154,19 +158,20 @@ class OfflineDataManager {
       
       if (pendingSyncs.length === 0) {
         console.log('No pending changes to sync');
-        this.hideOfflineIndicator();
-        return;
+      } else {
+        console.log(`Syncing ${pendingSyncs.length} pending changes`);
+        
+        // Group by model type
+        const groupedSyncs = this.groupSyncsByModel(pendingSyncs);
+        
+        // Process each group
+        for (const [modelName, items] of Object.entries(groupedSyncs)) {
+          await this.syncModelChanges(modelName, items);
+        }
       }
       
-      console.log(`Syncing ${pendingSyncs.length} pending changes`);
-      
-      // Group by model type
-      const groupedSyncs = this.groupSyncsByModel(pendingSyncs);
-      
-      // Process each group
-      for (const [modelName, items] of Object.entries(groupedSyncs)) {
-        await this.syncModelChanges(modelName, items);
-      }
+      // Fetch what other devices changed while we were away
+      await this.pullChanges();
       
       // Remove offline indicator after successful sync
       this.hideOfflineIndicator();
@@ -209,6 +214,12 @@ class OfflineDataManager {
         return;
       }
       
+      // Entries queued before ops carried an ID get one now, kept for retries
+      for (const item of items.filter(item => !item.op_id)) {
+        item.op_id = this.newOpId();
+        await this.saveToStore('syncLog', item);
+      }
+      
       // Prepare sync data
       const syncData = {
         model: modelName,
@@ -216,7 +227,9 @@ class OfflineDataManager {
           operation: item.operation,
           data: item.data,
           timestamp: item.timestamp,
-          record_id: item.record_id
+          record_id: item.record_id,
+          op_id: item.op_id,
+          clock: item.clock
         }))
       };
       
@@ -276,6 +289,11 @@ class OfflineDataManager {
       
       // Update each record in local database
       for (const record of records) {
+        // Records created offline replace their temporary copy
+        if (record.temp_id != null) {
+          await this.deleteFromStore(storeName, record.temp_id);
+          delete record.temp_id;
+        }
         await this.saveToStore(storeName, record);
       }
       
@@ -285,6 +303,116 @@ class OfflineDataManager {
     }
   }
   
+  /**
+   * Get this device's ID, creating it on first use
+   * @returns {string} - Device ID
+   */
+  getDeviceId() {
+    let deviceId = localStorage.getItem('shopsmartDeviceId');
+    if (!deviceId) {
+      deviceId = `device-${Math.random().toString(36).slice(2, 10)}`;
+      localStorage.setItem('shopsmartDeviceId', deviceId);
+    }
+    return deviceId;
+  }
+  
+  /**
+   * Read the hybrid logical clock for a local edit
+   * @returns {string} - Clock as "wall:counter:device"
+   */
+  nextClock() {
+    const wall = Date.now();
+    if (wall > this.lastClock.wall) {
+      this.lastClock = { wall, counter: 0 };
+    } else {
+      this.lastClock = { wall: this.lastClock.wall, counter: this.lastClock.counter + 1 };
+    }
+    localStorage.setItem('shopsmartClock', JSON.stringify(this.lastClock));
+    
+    const wallPart = String(this.lastClock.wall).padStart(13, '0');
+    const counterPart = String(this.lastClock.counter).padStart(4, '0');
+    return `${wallPart}:${counterPart}:${this.getDeviceId()}`;
+  }
+  
+  /**
+   * Generate an ID for a queued op that no other op on any device shares
+   * @returns {string} - Op ID
+   */
+  newOpId() {
+    if (window.crypto && crypto.randomUUID) {
+      return crypto.randomUUID();
+    }
+    return `${this.getDeviceId()}-${Date.now()}-${Math.random().toString(36).slice(2)}`;
+  }
+  
+  /**
+   * Move the clock past one seen from another device or the server
+   * @param {string} clock - Clock as "wall:counter:node"
+   */
+  observeClock(clock) {
+    const [wall, counter] = clock.split(':').map(Number);
+    if (wall > this.lastClock.wall || (wall === this.lastClock.wall && counter > this.lastClock.counter)) {
+      this.lastClock = { wall, counter };
+      localStorage.setItem('shopsmartClock', JSON.stringify(this.lastClock));
+    }
+  }
+  
+  /**
+   * Pull lists and items changed on the server since the last sync.
+   * Only rows changed after the stored cursor are downloaded.
+   */
+  async pullChanges() {
+    const cursorEntry = await this.getFromStore('userPreferences', 'syncCursor');
+    let since = cursorEntry ? cursorEntry.data : 0;
+    let hasMore = true;
+    
+    while (hasMore) {
+      const response = await fetch(`/api/sync/changes/?since=${since}`, {
+        headers: { 'Accept': 'application/json' }
+      });
+      
+      if (!response.ok) {
+        throw new Error(`Server returned ${response.status}: ${response.statusText}`);
+      }
+      
+      const changes = await response.json();
+      
+      if (changes.reset) {
+        // Full snapshot: drop server rows but keep anything not yet synced
+        for (const storeName of ['lists', 'items']) {
+          const records = await this.getAllFromStore(storeName);
+          for (const record of records) {
+            if (!record.is_temp_id) {
+              await this.deleteFromStore(storeName, record.id);
+            }
+          }
+        }
+      }
+      
+      for (const list of changes.lists) {
+        await this.saveToStore('lists', list);
+      }
+      for (const item of changes.items) {
+        Object.values(item.field_clocks || {}).forEach(clock => this.observeClock(clock));
+        await this.saveToStore('items', item);
+      }
+      for (const listId of changes.deleted.lists) {
+        await this.deleteFromStore('lists', listId);
+        const items = await this.getAllFromStore('items');
+        for (const item of items.filter(item => item.shopping_list_id === listId)) {
+          await this.deleteFromStore('items', item.id);
+        }
+      }
+      for (const itemId of changes.deleted.items) {
+        await this.deleteFromStore('items', itemId);
+      }
+      
+      since = changes.cursor;
+      hasMore = changes.has_more;
+      await this.saveToStore('userPreferences', { key: 'syncCursor', data: since });
+    }
+  }
+  
   /**
    * Get sync endpoint URL for a model
    * @param {string} modelName - Model name
@@ -292,8 +420,8 @@ class OfflineDataManager {
    */
   getSyncEndpoint(modelName) {
     const endpoints = {
-      'shopping_list': '/api/lists/sync/',
-      'shopping_list_item': '/api/lists/items/sync/',
+      'shopping_list': '/api/sync/',
+      'shopping_list_item': '/api/sync/',
       'user_profile': '/api/profile/sync/',
       'product': '/api/products/sync/'
     };
@@ -349,9 +477,16 @@ class OfflineDataManager {
    */
   async addToSyncLog(modelName, operation, recordId, data) {
     try {
+      // The queue is keyed by timestamp, so ops queued in the same millisecond get distinct ones
+      const timestamp = Math.max(Date.now(), (this.lastQueued || 0) + 1);
+      this.lastQueued = timestamp;
+      
       // Create sync log entry
       const syncEntry = {
-        timestamp: Date.now(),
+        timestamp,
+        // Lets the server recognise a retried op so it is applied once
+        op_id: this.newOpId(),
+        clock: this.nextClock(),
         model_name: modelName,
         operation: operation,
         record_id: recordId,
@@ -46,16 +46,9 @@ function handleCheckboxClick() {
         }
     });
     
-    // Send toggle request to server first to ensure database gets updated
-    fetch(`/app/lists/${listId}/items/${itemId}/toggle/`, {
-        method: 'POST',
-        headers: {
-            'X-CSRFToken': getCSRFToken()
-        }
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
+    // Queue the change; taps are debounced and sent to the server in batches
+    queueItemOp(listId, { op: 'toggle', id: Number(itemId), checked: isNowChecked }, {
+        onSuccess: function() {
             // After success, move checked items to bottom
             if (typeof moveCheckedItemToBottom === 'function') {
                 moveCheckedItemToBottom(listItem, isNowChecked);
@@ -65,21 +58,84 @@ function handleCheckboxClick() {
             if (typeof updateProgress === 'function') {
                 updateProgress();
             }
-        } else {
+        },
+        onFailure: function(originalChecked) {
             // Revert the visual state if there was an error
-            allCheckboxes.forEach(cb => cb.classList.toggle('checked'));
-            allListItems.forEach(li => li.classList.toggle('checked'));
-            console.error('Error toggling item');
+            allCheckboxes.forEach(cb => cb.classList.toggle('checked', originalChecked));
+            allListItems.forEach(li => li.classList.toggle('checked', originalChecked));
+        },
+        originalChecked: wasChecked
+    });
+}
+
+// Pending item edits, keyed by op and item so repeated taps collapse into one
+const ITEM_OP_DEBOUNCE_MS = 400;
+let pendingItemOps = new Map();
+let pendingItemOpsListId = null;
+let itemOpsTimer = null;
+
+function queueItemOp(listId, op, callbacks) {
+    if (pendingItemOpsListId !== null && pendingItemOpsListId !== listId) {
+        flushItemOps();
+    }
+    pendingItemOpsListId = listId;
+    
+    const key = `${op.op}:${op.id}`;
+    const previous = pendingItemOps.get(key);
+    pendingItemOps.set(key, {
+        op: op,
+        onSuccess: callbacks.onSuccess,
+        onFailure: callbacks.onFailure,
+        // Keep the state from before the first queued tap for reverting
+        originalChecked: previous ? previous.originalChecked : callbacks.originalChecked
+    });
+    
+    clearTimeout(itemOpsTimer);
+    itemOpsTimer = setTimeout(flushItemOps, ITEM_OP_DEBOUNCE_MS);
+}
+
+function flushItemOps(keepalive) {
+    clearTimeout(itemOpsTimer);
+    if (pendingItemOps.size === 0) {
+        return;
+    }
+    
+    const batch = Array.from(pendingItemOps.values());
+    const listId = pendingItemOpsListId;
+    pendingItemOps = new Map();
+    
+    const failBatch = function(error) {
+        batch.forEach(entry => entry.onFailure && entry.onFailure(entry.originalChecked));
+        console.error('Error updating items:', error);
+    };
+    
+    fetch(`/app/lists/${listId}/items/batch/`, {
+        method: 'POST',
+        keepalive: Boolean(keepalive),
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': getCSRFToken()
+        },
+        body: JSON.stringify({ ops: batch.map(entry => entry.op) })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            batch.forEach(entry => entry.onSuccess && entry.onSuccess(data));
+        } else {
+            failBatch(data.error);
         }
     })
-    .catch(error => {
-        // Revert the visual state if there was an error
-        allCheckboxes.forEach(cb => cb.classList.toggle('checked'));
-        allListItems.forEach(li => li.classList.toggle('checked'));
-        console.error('Error toggling item:', error);
-    });
+    .catch(failBatch);
 }
 
+// Don't lose queued taps when the page is hidden or closed
+document.addEventListener('visibilitychange', function() {
+    if (document.visibilityState === 'hidden') {
+        flushItemOps(true);
+    }
+});
+
 // Global flags to prevent duplicate initializations
 let isInitialized = false;
 